@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+规则构建清单
+记录每个规则集的输入摘要（配置项、来源内容、依赖产物、脚本代码）与产物摘要，
+输入未变化且产物文件未被改动时直接复用上次产物，跳过转换与优化。
+"""
+
+import hashlib
+import json
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+from fetch_cache import content_hash, write_bytes_atomic
+from rule_source import file_digest
+
+MANIFEST_VERSION = 1
+
+
+def text_digest(content: str) -> str:
+    return content_hash(content.encode("utf-8"))
+
+
+def rules_digest(rules: Iterable[str]) -> str:
+    """按规则顺序计算摘要，作为下游规则集的依赖输入。"""
+    digest = hashlib.sha256()
+    for rule in rules:
+        digest.update(rule.encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def code_digest(paths: Iterable[Path]) -> str:
+    """脚本代码变化时使全部清单失效。"""
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(Path(path).read_bytes())
+    return digest.hexdigest()
+
+
+class BuildManifest:
+    """按产物路径保存 inputs/rules/output 三类摘要。"""
+
+    def __init__(self, path: Path, code: str):
+        self.path = Path(path)
+        self.code = code
+        self.entries: Dict[str, Dict[str, str]] = {}
+        self.reused: List[str] = []
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        if (
+            isinstance(data, dict) and
+            data.get("version") == MANIFEST_VERSION and
+            data.get("code") == code and
+            isinstance(data.get("entries"), dict)
+        ):
+            self.entries = data["entries"]
+
+    def input_digest(self, rule: Dict, source_digests: Dict[str, str]) -> str:
+        payload = json.dumps(
+            {"rule": rule, "sources": source_digests},
+            ensure_ascii=False,
+            sort_keys=True,
+            separators=(",", ":")
+        )
+        return text_digest(payload)
+
+    def reuse(
+        self,
+        relative_path: str,
+        inputs: str,
+        output_path: Path,
+        read_rules: Callable[[Path], List[str]]
+    ) -> Optional[List[str]]:
+        """输入摘要一致且产物文件未变时返回上次产物规则，否则返回 None。"""
+        entry = self.entries.get(relative_path)
+        if not entry or entry.get("inputs") != inputs or not output_path.is_file():
+            return None
+        if file_digest(output_path)[0] != entry.get("output"):
+            return None
+        rules = read_rules(output_path)
+        if rules_digest(rules) != entry.get("rules"):
+            return None
+        self.reused.append(relative_path)
+        return rules
+
+    def rules_digest_of(self, relative_path: str) -> str:
+        return self.entries.get(relative_path, {}).get("rules", "")
+
+    def record(self, relative_path: str, inputs: str, rules: List[str]) -> str:
+        digest = rules_digest(rules)
+        self.entries[relative_path] = {"inputs": inputs, "rules": digest}
+        return digest
+
+    def record_output(self, relative_path: str, output_path: Path) -> None:
+        entry = self.entries.get(relative_path)
+        if entry is None:
+            return
+        if output_path.is_file():
+            entry["output"] = file_digest(output_path)[0]
+        else:
+            entry.pop("output", None)
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        payload = {"version": MANIFEST_VERSION, "code": self.code, "entries": self.entries}
+        write_bytes_atomic(
+            self.path,
+            (json.dumps(payload, ensure_ascii=False, indent=2, sort_keys=True) + "\n").encode("utf-8")
+        )
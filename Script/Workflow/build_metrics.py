@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+规则构建指标
+1. 记录每个来源的下载耗时、解压后字节数与实际传输字节数，每个规则集的解析行数、各阶段耗时与峰值RSS
+2. 可选用 tracemalloc 统计分配内存最多的代码位置
+3. 指标逐条输出为JSON行，结束时汇总为 GitHub 步骤摘要表格并写入 GITHUB_OUTPUT
+"""
+
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+TOP_ALLOCATIONS = 5
+STAGES = ("exclude", "parse", "optimize")
+
+
+def peak_rss_kb(children: bool = False) -> int:
+    """当前进程（或已回收子进程）的峰值RSS，单位KB。"""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # macOS 的 ru_maxrss 以字节为单位，Linux 以KB为单位
+    if sys.platform == "darwin":
+        return usage.ru_maxrss // 1024
+    return usage.ru_maxrss
+
+
+def count_items(items: Iterable, record: Dict, key: str) -> Iterator:
+    """透传迭代器并把条数累加到 record[key]，迭代中断时同样计入。"""
+    count = 0
+    try:
+        for count, item in enumerate(items, start=1):
+            yield item
+    finally:
+        record[key] += count
+
+
+@contextmanager
+def source_record(location: str) -> Iterator[Dict]:
+    """单个来源的行数、规则条数与耗时。"""
+    record = {"location": location, "lines": 0, "rules": 0, "seconds": 0.0}
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = round(time.perf_counter() - started, 6)
+
+
+class RuleMetrics:
+    """
+    单个规则集的构建指标，在执行构建的进程内采集，随结果返回主进程
+    阶段按顺序计时: lap(stage) 记录自上次计时以来的耗时；
+    来源为流式处理，parse 阶段和来源耗时都包含写入去重结构的时间。
+    """
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.started = time.perf_counter()
+        self._mark = self.started
+        self.stages: Dict[str, float] = {}
+        self.sources: List[Dict] = []
+        if trace_memory:
+            tracemalloc.start()
+
+    def lap(self, stage: str) -> None:
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self._mark
+        self._mark = now
+
+    def add_source(self, record: Dict) -> None:
+        """记录在其他进程中转换的来源。"""
+        self.sources.append(dict(record))
+
+    def result(self) -> Dict:
+        metrics = {
+            "seconds": round(time.perf_counter() - self.started, 6),
+            "stages": {stage: round(seconds, 6) for stage, seconds in self.stages.items()},
+            "sources": self.sources,
+            "lines": sum(source["lines"] for source in self.sources),
+            "peak_rss_kb": peak_rss_kb(),
+        }
+        if self.trace_memory and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            metrics["traced_peak_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+            metrics["top_allocations"] = [
+                {
+                    "location": f"{statistic.traceback[0].filename}:{statistic.traceback[0].lineno}",
+                    "size_kb": statistic.size // 1024,
+                    "count": statistic.count,
+                }
+                for statistic in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+            ]
+            tracemalloc.stop()
+        return metrics
+
+
+class BuildMetrics:
+    """主进程汇总下载与规则集指标，path 为 "-" 时JSON行写到标准输出。"""
+
+    def __init__(self, path: str = "", trace_memory: bool = False):
+        self.path = path
+        self.trace_memory = trace_memory
+        self.started = time.perf_counter()
+        self.fetches: List[Dict] = []
+        self.rules: List[Dict] = []
+        self._lock = threading.Lock()
+        if path and path != "-":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            Path(path).write_text("", encoding="utf-8")
+
+    def emit(self, event: str, **fields) -> Dict:
+        record = {"event": event, **fields}
+        if self.path:
+            line = json.dumps(record, ensure_ascii=False, sort_keys=True) + "\n"
+            with self._lock:
+                if self.path == "-":
+                    sys.stdout.write(line)
+                    sys.stdout.flush()
+                else:
+                    with open(self.path, "a", encoding="utf-8") as file_handle:
+                        file_handle.write(line)
+        return record
+
+    def record_fetch(self, location: str, seconds: float, size: int, wire_bytes: int = 0) -> None:
+        """size 为解压后字节数，wire_bytes 为压缩传输字节数，未经网络传输时为 0。"""
+        record = self.emit(
+            "fetch",
+            location=location,
+            seconds=round(seconds, 6),
+            bytes=size,
+            wire_bytes=wire_bytes
+        )
+        with self._lock:
+            self.fetches.append(record)
+
+    def record_rule(self, rule_id: str, path: str, rules: int, metrics: Optional[Dict] = None) -> None:
+        """metrics 为 None 表示规则集由构建清单直接复用。"""
+        self.rules.append(self.emit(
+            "ruleset",
+            rule=rule_id,
+            path=path,
+            rules=rules,
+            reused=metrics is None,
+            **(metrics or {})
+        ))
+
+    def finish(self) -> Dict:
+        return self.emit(
+            "summary",
+            seconds=round(time.perf_counter() - self.started, 6),
+            fetch_bytes=sum(fetch["bytes"] for fetch in self.fetches),
+            wire_bytes=sum(fetch["wire_bytes"] for fetch in self.fetches),
+            peak_rss_kb=peak_rss_kb(),
+            children_peak_rss_kb=peak_rss_kb(children=True),
+        )
+
+    def slowest_stage(self) -> str:
+        candidates = [
+            (seconds, f"{record['rule']}:{stage}")
+            for record in self.rules
+            for stage, seconds in record.get("stages", {}).items()
+        ]
+        return max(candidates)[1] if candidates else ""
+
+    def render_summary(self, title: str, summary: Dict) -> str:
+        lines = [
+            f"### {title}",
+            "",
+            f"总耗时 {summary['seconds']:.2f}s，来源 {summary['fetch_bytes'] / 1048576:.1f} MiB，"
+            f"网络传输 {summary['wire_bytes'] / 1048576:.1f} MiB，"
+            f"主进程峰值RSS {summary['peak_rss_kb'] / 1024:.1f} MiB，"
+            f"子进程峰值RSS {summary['children_peak_rss_kb'] / 1024:.1f} MiB",
+            "",
+            "| 规则集 | 规则数 | 解析行数 | " + " | ".join(f"{stage}(s)" for stage in STAGES) +
+            " | 总耗时(s) | 峰值RSS(MiB) |",
+            "|---" * (len(STAGES) + 5) + "|",
+        ]
+        for record in self.rules:
+            if record["reused"]:
+                lines.append(f"| {record['rule']} | {record['rules']} | 复用 |" + " |" * (len(STAGES) + 2))
+                continue
+            stages = record.get("stages", {})
+            lines.append(
+                f"| {record['rule']} | {record['rules']} | {record['lines']} | " +
+                " | ".join(f"{stages.get(stage, 0.0):.3f}" for stage in STAGES) +
+                f" | {record['seconds']:.3f} | {record['peak_rss_kb'] / 1024:.1f} |"
+            )
+
+        if self.fetches:
+            lines.extend(["", "| 来源 | 耗时(s) | 字节 | 传输字节 |", "|---|---|---|---|"])
+            for record in sorted(self.fetches, key=lambda item: -item["seconds"]):
+                lines.append(
+                    f"| {record['location']} | {record['seconds']:.3f} | "
+                    f"{record['bytes']} | {record['wire_bytes']} |"
+                )
+
+        for record in self.rules:
+            allocations = record.get("top_allocations")
+            if not allocations:
+                continue
+            lines.extend(["", f"{record['rule']} 内存分配 Top {len(allocations)}:", ""])
+            lines.extend(
+                f"- `{item['location']}` {item['size_kb']} KiB / {item['count']} 次"
+                for item in allocations
+            )
+        return "\n".join(lines) + "\n"
+
+    def write_github(self, title: str) -> None:
+        """输出 summary 事件，并写入步骤摘要与 GITHUB_OUTPUT（环境变量存在时）。"""
+        summary = self.finish()
+        summary_path = os.environ.get("GITHUB_STEP_SUMMARY")
+        if summary_path:
+            with open(summary_path, "a", encoding="utf-8") as file_handle:
+                file_handle.write(self.render_summary(title, summary))
+        output_path = os.environ.get("GITHUB_OUTPUT")
+        if output_path:
+            with open(output_path, "a", encoding="utf-8") as file_handle:
+                file_handle.write(f"build_seconds={summary['seconds']:.2f}\n")
+                file_handle.write(
+                    f"peak_rss_mb={max(summary['peak_rss_kb'], summary['children_peak_rss_kb']) / 1024:.1f}\n"
+                )
+                file_handle.write(f"slowest_stage={self.slowest_stage()}\n")
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+域名前缀树
+按反转标签组织域名（example.com -> com -> example），供规则编译脚本共用:
+1. 插入泛域名/精确域名并统计完全重复
+2. 按标签逐级查询覆盖关系，无需拼接父域名字符串
+3. 单次遍历同时完成覆盖裁剪与排除规则过滤，排除规则可由多棵已建好的树共同给出
+4. 序列化时只保存平铺数组，载入时重建边索引，比由域名重新插入更快
+5. 按插入顺序返回保留的条目，输入为若干有序段时结果同样由有序段组成，调用方排序时可利用这些有序段
+"""
+
+import sys
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+WILDCARD = 1
+EXACT = 2
+
+KEPT = "kept"
+WILDCARD_COVERED = "wildcard_covered"
+EXACT_COVERED = "exact_covered"
+EXCLUDED_BY_DOMAIN = "excluded_by_domain"
+EXCLUDED_BY_FULL = "excluded_by_full"
+PRUNE_STATES = (KEPT, WILDCARD_COVERED, EXACT_COVERED, EXCLUDED_BY_DOMAIN, EXCLUDED_BY_FULL)
+
+_LIVE = 0
+_COVERED = 1
+_EXCLUDED = 2
+
+
+class DomainTrie:
+    """
+    反转标签域名前缀树
+    节点以整数编号保存在平铺数组中，子节点经 (父节点, 标签) 索引查找，
+    标签经 sys.intern 驻留；父节点编号总小于子节点，裁剪只需顺序扫描一遍。
+    """
+
+    __slots__ = ("_edges", "_parents", "_labels", "_flags", "_names", "_orders", "size")
+
+    def __init__(self, entries: Iterable[Tuple[str, int]] = ()):
+        self._edges: Dict[Tuple[int, str], int] = {}
+        self._parents: List[int] = [0]
+        self._labels: List[str] = [""]
+        self._flags = bytearray(1)
+        self._names: List[Optional[str]] = [None]
+        # 各类型条目首次插入时的节点编号，按插入顺序排列
+        self._orders = {WILDCARD: array("i"), EXACT: array("i")}
+        self.size = 0
+        for domain, kind in entries:
+            self.add(domain, kind)
+
+    def __getstate__(self):
+        return (
+            array("i", self._parents).tobytes(),
+            self._labels,
+            bytes(self._flags),
+            self._names,
+            self._orders[WILDCARD].tobytes(),
+            self._orders[EXACT].tobytes(),
+            self.size
+        )
+
+    def __setstate__(self, state) -> None:
+        parents_data, labels, flags, names, wildcard_order, exact_order, size = state
+        parents = array("i")
+        parents.frombytes(parents_data)
+        self._parents = parents.tolist()
+        self._orders = {WILDCARD: array("i"), EXACT: array("i")}
+        self._orders[WILDCARD].frombytes(wildcard_order)
+        self._orders[EXACT].frombytes(exact_order)
+        self._labels = [sys.intern(label) for label in labels]
+        self._flags = bytearray(flags)
+        self._names = names
+        self.size = size
+        self._edges = dict(zip(zip(self._parents[1:], self._labels[1:]), range(1, len(self._parents))))
+
+    def add(self, domain: str, kind: int) -> bool:
+        """插入域名，返回是否为新条目（False 表示完全重复）。"""
+        return not self.add_many((domain,), kind)
+
+    def add_many(self, domains: Iterable[str], kind: int) -> int:
+        """批量插入同类型域名，返回完全重复的条数。"""
+        edges = self._edges
+        parents = self._parents
+        labels = self._labels
+        flags = self._flags
+        names = self._names
+        order = self._orders[kind]
+        intern = sys.intern
+        duplicates = 0
+        added = 0
+
+        for domain in domains:
+            node = 0
+            for label in domain.split('.')[::-1]:
+                child = edges.get((node, label))
+                if child is None:
+                    child = len(parents)
+                    label = intern(label)
+                    edges[(node, label)] = child
+                    parents.append(node)
+                    labels.append(label)
+                    flags.append(0)
+                    names.append(None)
+                node = child
+            node_flags = flags[node]
+            if node_flags & kind:
+                duplicates += 1
+                continue
+            flags[node] = node_flags | kind
+            if names[node] is None:
+                names[node] = domain
+            order.append(node)
+            added += 1
+
+        self.size += added
+        return duplicates
+
+    def _find(self, domain: str) -> Optional[int]:
+        edges = self._edges
+        node = 0
+        for label in reversed(domain.split('.')):
+            node = edges.get((node, label))
+            if node is None:
+                return None
+        return node
+
+    def covers(self, domain: str, include_self: bool = True) -> bool:
+        """判断域名是否被某条泛域名覆盖，include_self 控制是否计入自身。"""
+        edges = self._edges
+        flags = self._flags
+        labels = domain.split('.')
+        remaining = len(labels)
+        node = 0
+        for label in reversed(labels):
+            node = edges.get((node, label))
+            if node is None:
+                return False
+            remaining -= 1
+            if flags[node] & WILDCARD and (include_self or remaining):
+                return True
+        return False
+
+    def contains(self, domain: str, kind: int) -> bool:
+        """判断指定类型的域名条目是否存在。"""
+        node = self._find(domain)
+        return node is not None and bool(self._flags[node] & kind)
+
+    def prune(
+        self,
+        excludes: Sequence["DomainTrie"] = (),
+        wildcard_covers_exact: bool = True
+    ) -> Tuple[List[str], List[str], Dict[str, int]]:
+        """
+        单次遍历完成覆盖裁剪与排除过滤
+        返回: (保留的泛域名, 保留的精确域名, 各裁剪状态的条数)，两类域名各自按插入顺序排列
+        excludes 中任一棵树的泛域名排除自身及子域的全部条目，精确域名只排除同名精确条目，
+        排除匹配时条目标签按小写比较，排除树只读，可在多次裁剪间共用;
+        wildcard_covers_exact 控制同名泛域名是否覆盖精确域名。
+        """
+        parents = self._parents
+        labels = self._labels
+        flags = self._flags
+        names = self._names
+        node_count = len(parents)
+        states = bytearray(node_count)
+        counts = dict.fromkeys(PRUNE_STATES, 0)
+        # 各节点保留的条目类型，遍历结束后按插入顺序取出
+        kept = bytearray(node_count)
+
+        # 每棵排除树记录本树节点在其中的对应节点，-1 表示排除树中无此路径
+        mappings = []
+        for exclude in excludes:
+            mapped = [-1] * node_count
+            mapped[0] = 0
+            mappings.append((exclude._edges, exclude._flags, mapped))
+
+        for node in range(1, node_count):
+            parent = parents[node]
+            state = states[parent]
+            if state == _LIVE and flags[parent] & WILDCARD:
+                state = _COVERED
+
+            excluded_full = False
+            if mappings and state != _EXCLUDED:
+                label = None
+                for exclude_edges, exclude_flags, mapped in mappings:
+                    parent_mapped = mapped[parent]
+                    if parent_mapped < 0:
+                        continue
+                    if label is None:
+                        label = labels[node].lower()
+                    exclude_node = exclude_edges.get((parent_mapped, label))
+                    if exclude_node is None:
+                        continue
+                    mapped[node] = exclude_node
+                    if exclude_flags[exclude_node] & WILDCARD:
+                        state = _EXCLUDED
+                        break
+                    if exclude_flags[exclude_node] & EXACT:
+                        excluded_full = True
+            states[node] = state
+
+            node_flags = flags[node]
+            if not node_flags:
+                continue
+            if state == _EXCLUDED:
+                if node_flags & WILDCARD:
+                    counts[EXCLUDED_BY_DOMAIN] += 1
+                if node_flags & EXACT:
+                    counts[EXCLUDED_BY_DOMAIN] += 1
+                continue
+            if node_flags & WILDCARD:
+                if state == _COVERED:
+                    counts[WILDCARD_COVERED] += 1
+                else:
+                    kept[node] = WILDCARD
+            if node_flags & EXACT:
+                if state == _COVERED or (wildcard_covers_exact and node_flags & WILDCARD):
+                    counts[EXACT_COVERED] += 1
+                elif excluded_full:
+                    counts[EXCLUDED_BY_FULL] += 1
+                else:
+                    kept[node] |= EXACT
+
+        wildcards = [names[node] for node in self._orders[WILDCARD] if kept[node] & WILDCARD]
+        exacts = [names[node] for node in self._orders[EXACT] if kept[node] & EXACT]
+        counts[KEPT] = len(wildcards) + len(exacts)
+        return wildcards, exacts, counts
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+规则来源下载缓存
+功能:
+1. 按URL在磁盘保存响应体、ETag、Last-Modified与内容哈希
+2. 以 If-None-Match/If-Modified-Since 发起条件请求，304时复用缓存
+3. 响应体分块写入缓存文件，不在内存中保留整份内容
+4. 按最近使用时间淘汰，保持缓存总体积不超过上限
+5. 离线模式只从缓存重建，不发起任何网络请求
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass, replace
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from http_pool import HttpClient, HttpError, shared_client
+from rule_source import SourceFile, copy_stream, file_digest
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+CACHE_DIR_ENV = "RULE_FETCH_CACHE_DIR"
+
+
+class FetchCacheError(Exception):
+    pass
+
+
+@dataclass
+class CacheEntry:
+    url: str
+    sha256: str
+    size: int
+    etag: str = ""
+    last_modified: str = ""
+    fetched_at: float = 0.0
+    last_used: float = 0.0
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def write_bytes_atomic(path: Path, data: bytes) -> None:
+    descriptor, temporary_name = tempfile.mkstemp(
+        dir=path.parent,
+        prefix=f".{path.name}."
+    )
+    temporary_path = Path(temporary_name)
+    try:
+        with os.fdopen(descriptor, "wb") as file_handle:
+            file_handle.write(data)
+        os.replace(temporary_path, path)
+    finally:
+        temporary_path.unlink(missing_ok=True)
+
+
+class FetchCache:
+    """以URL哈希为键的磁盘缓存，元数据与响应体分文件存放。"""
+
+    def __init__(
+        self,
+        directory: Path,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        offline: bool = False
+    ):
+        if max_bytes <= 0:
+            raise ValueError("缓存上限必须是正整数")
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.stats = {"hits": 0, "revalidated": 0, "downloaded": 0, "evicted": 0}
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _paths(self, url: str):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+        return self.directory / f"{key}.json", self.directory / f"{key}.body"
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+    def lookup(self, url: str) -> Optional[CacheEntry]:
+        """读取缓存元数据，元数据损坏或响应体缺失视为未命中。"""
+        meta_path, body_path = self._paths(url)
+        try:
+            entry = CacheEntry(**json.loads(meta_path.read_text(encoding="utf-8")))
+        except (OSError, ValueError, TypeError):
+            return None
+        if entry.url != url or not body_path.is_file():
+            return None
+        return entry
+
+    def read_body(self, entry: CacheEntry) -> Optional[SourceFile]:
+        """分块校验响应体哈希，一致时返回缓存文件，否则返回 None。"""
+        _, body_path = self._paths(entry.url)
+        try:
+            sha256, size = file_digest(body_path)
+        except OSError:
+            return None
+        if size != entry.size or sha256 != entry.sha256:
+            return None
+        return SourceFile(entry.url, body_path, sha256, size)
+
+    def touch(self, entry: CacheEntry) -> None:
+        entry.last_used = time.time()
+        meta_path, _ = self._paths(entry.url)
+        write_bytes_atomic(
+            meta_path,
+            json.dumps(asdict(entry), ensure_ascii=False).encode("utf-8")
+        )
+
+    def store(self, url: str, stream, headers) -> SourceFile:
+        """
+        将响应流写入缓存，空响应不覆盖已有缓存
+        先落到 .part 文件，确认非空后才替换响应体并更新元数据。
+        """
+        _, body_path = self._paths(url)
+        part_path = body_path.with_suffix(".part")
+        try:
+            sha256, size = copy_stream(stream, part_path)
+            if not size:
+                return SourceFile(url, part_path, sha256, size)
+            os.replace(part_path, body_path)
+        finally:
+            part_path.unlink(missing_ok=True)
+
+        now = time.time()
+        self.touch(CacheEntry(
+            url=url,
+            sha256=sha256,
+            size=size,
+            etag=headers.get("ETag", "") or "",
+            last_modified=headers.get("Last-Modified", "") or "",
+            fetched_at=now,
+            last_used=now,
+        ))
+        return SourceFile(url, body_path, sha256, size)
+
+    def fetch(self, url: str, headers: Dict[str, str], client: HttpClient) -> SourceFile:
+        """条件请求下载URL，304或离线模式时返回缓存文件。"""
+        entry = self.lookup(url)
+        cached = self.read_body(entry) if entry is not None else None
+
+        if self.offline:
+            if cached is None:
+                raise FetchCacheError(f"离线模式下缓存缺失: {url}")
+            self.touch(entry)
+            self._count("hits")
+            return cached
+
+        request_headers = dict(headers)
+        if cached is not None:
+            if entry.etag:
+                request_headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                request_headers["If-Modified-Since"] = entry.last_modified
+
+        with client.open(url, request_headers) as response:
+            if response.status == 304 and cached is not None:
+                self.touch(entry)
+                self._count("revalidated")
+                return cached
+            if response.status != 200:
+                raise HttpError(url, response.status)
+            source = self.store(url, response, response.headers)
+
+        self._count("downloaded")
+        return replace(source, wire_bytes=response.wire_bytes)
+
+    def evict(self) -> int:
+        """按最近使用时间淘汰缓存直至总体积不超过上限，返回淘汰条数。"""
+        entries: List[CacheEntry] = []
+        for meta_path in self.directory.glob("*.json"):
+            try:
+                entries.append(CacheEntry(**json.loads(meta_path.read_text(encoding="utf-8"))))
+            except (OSError, ValueError, TypeError):
+                meta_path.unlink(missing_ok=True)
+                meta_path.with_suffix(".body").unlink(missing_ok=True)
+
+        total = sum(entry.size for entry in entries)
+        evicted = 0
+        for entry in sorted(entries, key=lambda item: (item.last_used, item.url)):
+            if total <= self.max_bytes:
+                break
+            meta_path, body_path = self._paths(entry.url)
+            meta_path.unlink(missing_ok=True)
+            body_path.unlink(missing_ok=True)
+            total -= entry.size
+            evicted += 1
+
+        self.stats["evicted"] += evicted
+        return evicted
+
+    def summary(self) -> str:
+        return (
+            f"缓存: 命中 {self.stats['hits']}, 304 复用 {self.stats['revalidated']}, "
+            f"下载 {self.stats['downloaded']}, 淘汰 {self.stats['evicted']}"
+        )
+
+
+def fetch_source(
+    url: str,
+    headers: Dict[str, str],
+    spool_dir: Path,
+    cache: Optional[FetchCache] = None,
+    client: Optional[HttpClient] = None
+) -> SourceFile:
+    """
+    经连接池下载URL到磁盘，失败或内容为空时按连接池的退避策略重试
+    提供缓存时走条件请求并直接使用缓存文件，否则响应流写入 spool_dir 下的临时文件。
+    """
+    client = client or shared_client()
+    path = Path(spool_dir) / hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+
+    def attempt() -> SourceFile:
+        if cache is not None:
+            source = cache.fetch(url, headers, client)
+        else:
+            with client.open(url, headers) as response:
+                if response.status != 200:
+                    raise HttpError(url, response.status)
+                sha256, size = copy_stream(response, path)
+            source = SourceFile(url, path, sha256, size, response.wire_bytes)
+        if not source.size:
+            raise ValueError("下载内容为空")
+        return source
+
+    if cache is not None and cache.offline:
+        return attempt()
+    return client.retry(attempt, url, (ValueError,))
+
+
+def open_cache(
+    directory: str,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+    offline: bool = False
+) -> Optional[FetchCache]:
+    """按命令行参数或环境变量创建缓存，未指定目录时返回 None（离线模式必须指定）。"""
+    directory = directory or os.environ.get(CACHE_DIR_ENV, "")
+    if not directory:
+        if offline:
+            raise FetchCacheError(f"离线模式需要 --cache-dir 或 {CACHE_DIR_ENV}")
+        return None
+    return FetchCache(Path(directory), max_bytes, offline)
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+规则来源HTTP连接池
+1. 按 (协议, 主机, 端口) 复用 HTTP/1.1 keep-alive 连接，避免每个来源重复TLS握手
+2. 每个主机限制并发连接数，单次请求设置套接字超时与整体截止时间
+3. 声明 Accept-Encoding 并流式解码 gzip/deflate 响应体，安装 brotli 或 brotlicffi 时同时协商 br
+4. 失败按固定退避重试，重试策略与原 proxy_rules.download 一致
+"""
+
+import http.client
+import ssl
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+from urllib.parse import urljoin, urlsplit
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+DEFAULT_PER_HOST = 8
+DEFAULT_TIMEOUT = 30
+DEFAULT_TOTAL_TIMEOUT = 180
+DEFAULT_ATTEMPTS = 3
+DEFAULT_BACKOFF = 2
+MAX_REDIRECTS = 5
+READ_SIZE = 1 << 16
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+ACCEPT_ENCODING = "gzip, deflate, br" if brotli is not None else "gzip, deflate"
+DECODE_ERRORS = (zlib.error,) if brotli is None else (zlib.error, brotli.error)
+
+T = TypeVar("T")
+PoolKey = Tuple[str, str, int]
+
+
+class HttpError(Exception):
+    """服务器返回错误状态码。"""
+
+    def __init__(self, url: str, status: int, reason: str = ""):
+        super().__init__(f"HTTP {status} {reason}".rstrip() + f": {url}")
+        self.url = url
+        self.status = status
+
+
+class DecodedBody:
+    """
+    按 Content-Encoding 流式解码的响应体
+    read() 每次返回一块解码后的数据（长度不保证不超过 size），读完返回 b""；
+    wire_bytes 为已读取的传输字节数，decoded_bytes 为解码后的字节数。
+    """
+
+    def __init__(self, response: http.client.HTTPResponse, deadline: float):
+        self._response = response
+        self._deadline = deadline
+        self._decoder = None
+        self._raw_deflate_checked = True
+        self.encoding = (response.getheader("Content-Encoding") or "").strip().lower()
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+        self.finished = False
+        if self.encoding in ("gzip", "x-gzip", "deflate"):
+            # 32 + MAX_WBITS 自动识别 gzip 与 zlib 头；deflate 偶见无头的原始流，首块失败时改用原始模式
+            self._decoder = zlib.decompressobj(32 + zlib.MAX_WBITS)
+            self._raw_deflate_checked = self.encoding != "deflate"
+        elif self.encoding == "br" and brotli is not None:
+            self._decoder = brotli.Decompressor()
+        elif self.encoding not in ("", "identity"):
+            raise ValueError(f"不支持的 Content-Encoding: {self.encoding}")
+
+    def _decompress(self, raw: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._decoder.process(raw)
+        if not self._raw_deflate_checked:
+            self._raw_deflate_checked = True
+            try:
+                return self._decoder.decompress(raw)
+            except zlib.error:
+                self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._decoder.decompress(raw)
+
+    def _flush(self) -> bytes:
+        if self._decoder is None:
+            return b""
+        if self.encoding == "br":
+            if not self._decoder.is_finished():
+                raise ValueError("brotli 响应体不完整")
+            return b""
+        return self._decoder.flush()
+
+    def read(self, size: int = READ_SIZE) -> bytes:
+        while True:
+            if time.monotonic() > self._deadline:
+                raise TimeoutError("下载超出整体超时")
+            raw = self._response.read(size if size and size > 0 else READ_SIZE)
+            if not raw:
+                self.finished = True
+                data = self._flush()
+            else:
+                self.wire_bytes += len(raw)
+                data = raw if self._decoder is None else self._decompress(raw)
+            self.decoded_bytes += len(data)
+            if data or not raw:
+                return data
+
+
+class Response:
+    def __init__(self, url: str, status: int, headers, body: DecodedBody):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def read(self, size: int = READ_SIZE) -> bytes:
+        return self.body.read(size)
+
+    @property
+    def wire_bytes(self) -> int:
+        return self.body.wire_bytes
+
+
+class HttpClient:
+    """线程安全的 keep-alive 连接池，供两个规则编译脚本共用。"""
+
+    def __init__(
+        self,
+        per_host: int = DEFAULT_PER_HOST,
+        timeout: float = DEFAULT_TIMEOUT,
+        total_timeout: float = DEFAULT_TOTAL_TIMEOUT,
+        attempts: int = DEFAULT_ATTEMPTS,
+        backoff: float = DEFAULT_BACKOFF
+    ):
+        if per_host <= 0 or attempts <= 0:
+            raise ValueError("每主机连接数与重试次数必须是正整数")
+        self.per_host = per_host
+        self.timeout = timeout
+        self.total_timeout = total_timeout
+        self.attempts = attempts
+        self.backoff = backoff
+        self.stats = {"requests": 0, "connections": 0, "reused": 0, "retries": 0}
+        self._idle: Dict[PoolKey, List[http.client.HTTPConnection]] = {}
+        self._slots: Dict[PoolKey, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        self._ssl_context = ssl.create_default_context()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+    def _slot(self, key: PoolKey) -> threading.BoundedSemaphore:
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = threading.BoundedSemaphore(self.per_host)
+            return slot
+
+    def _checkout(self, key: PoolKey, fresh: bool) -> Tuple[http.client.HTTPConnection, bool]:
+        """取出空闲连接，没有或要求新连接时创建，返回 (连接, 是否复用)。"""
+        if not fresh:
+            with self._lock:
+                idle = self._idle.get(key)
+                if idle:
+                    self.stats["reused"] += 1
+                    return idle.pop(), True
+        scheme, host, port = key
+        if scheme == "https":
+            connection = http.client.HTTPSConnection(
+                host, port, timeout=self.timeout, context=self._ssl_context
+            )
+        else:
+            connection = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        self._count("connections")
+        return connection, False
+
+    def _checkin(self, key: PoolKey, connection: http.client.HTTPConnection) -> None:
+        with self._lock:
+            self._idle.setdefault(key, []).append(connection)
+
+    def _send(
+        self,
+        key: PoolKey,
+        target: str,
+        headers: Dict[str, str]
+    ) -> Tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        """发送请求，复用的连接已被服务器关闭时换新连接重发一次。"""
+        for fresh in (False, True):
+            connection, reused = self._checkout(key, fresh)
+            try:
+                connection.request("GET", target, headers=headers)
+                return connection, connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionError, http.client.CannotSendRequest):
+                connection.close()
+                if not reused:
+                    raise
+            except BaseException:
+                connection.close()
+                raise
+        raise AssertionError("unreachable")
+
+    @contextmanager
+    def open(self, url: str, headers: Dict[str, str]) -> Iterator[Response]:
+        """
+        发起GET请求并跟随重定向，返回可流式读取的响应
+        4xx/5xx 抛出 HttpError，2xx 与 304 交给调用方处理；
+        退出时响应体已读完则连接放回连接池，否则关闭。
+        """
+        deadline = time.monotonic() + self.total_timeout
+        request_headers = {"Accept-Encoding": ACCEPT_ENCODING, **headers}
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            if parts.scheme not in ("http", "https") or not parts.hostname:
+                raise ValueError(f"不支持的URL: {url}")
+            key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+            target = parts.path or "/"
+            if parts.query:
+                target += f"?{parts.query}"
+
+            slot = self._slot(key)
+            if not slot.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                raise TimeoutError(f"等待连接超时: {url}")
+            connection = None
+            reusable = False
+            try:
+                self._count("requests")
+                connection, response = self._send(key, target, request_headers)
+                location = response.getheader("Location")
+                if response.status in REDIRECT_STATUSES and location:
+                    response.read()
+                    reusable = not response.will_close
+                    url = urljoin(url, location)
+                    continue
+                if response.status >= 400:
+                    response.read()
+                    reusable = not response.will_close
+                    raise HttpError(url, response.status, response.reason)
+                body = DecodedBody(response, deadline)
+                yield Response(url, response.status, response.headers, body)
+                if not body.finished:
+                    # 调用方未读完（如 304），读完剩余内容后连接才能复用
+                    response.read()
+                reusable = not response.will_close
+                return
+            finally:
+                if connection is not None:
+                    if reusable:
+                        self._checkin(key, connection)
+                    else:
+                        connection.close()
+                slot.release()
+        raise http.client.HTTPException(f"重定向次数过多: {url}")
+
+    def retry(self, function: Callable[[], T], url: str, retry_on: Tuple = ()) -> T:
+        """
+        按 attempt * backoff 秒退避重试，网络错误、HTTP错误与 retry_on 中的异常均重试
+        全部失败后抛出 RuntimeError。
+        """
+        last_error = None
+        for attempt in range(1, self.attempts + 1):
+            try:
+                return function()
+            except (OSError, http.client.HTTPException, HttpError) + DECODE_ERRORS + tuple(retry_on) as error:
+                last_error = error
+                if attempt < self.attempts:
+                    self._count("retries")
+                    time.sleep(attempt * self.backoff)
+        raise RuntimeError(f"下载失败({self.attempts} 次): {url} -> {last_error}")
+
+    def close(self) -> None:
+        with self._lock:
+            idle = [connection for connections in self._idle.values() for connection in connections]
+            self._idle.clear()
+        for connection in idle:
+            connection.close()
+
+    def summary(self) -> str:
+        return (
+            f"连接: 请求 {self.stats['requests']}, 新建 {self.stats['connections']}, "
+            f"复用 {self.stats['reused']}, 重试 {self.stats['retries']}"
+        )
+
+
+_shared_client: Optional[HttpClient] = None
+_shared_lock = threading.Lock()
+
+
+def shared_client() -> HttpClient:
+    """进程内共享的默认连接池。"""
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            _shared_client = HttpClient()
+        return _shared_client
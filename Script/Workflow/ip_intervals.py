@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+IP整数区间引擎
+将CIDR直接解析为 (起始地址, 前缀长度) 整数，按 IPv4/IPv6 分开处理:
+1. 排序键打包为单个整数 (起始地址 << 8 | 前缀长度)，IPv4 键存放在 array('Q') 中
+2. 有序扫描维护最大结束地址，裁剪被父网段覆盖的子网段
+3. 可选把相邻网段合并为最少数量的CIDR
+安装 NumPy 时 IPv4 键直接复用 array 缓冲区做向量化排序与累计最大值。
+"""
+
+import ipaddress
+import socket
+from array import array
+from typing import Dict, Iterable, List, Tuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+WIDTHS = {4: 32, 6: 128}
+FAMILIES = {4: socket.AF_INET, 6: socket.AF_INET6}
+PREFIX_BITS = 8
+PREFIX_MASK = (1 << PREFIX_BITS) - 1
+
+
+def parse_network(rule: str) -> Tuple[int, int, int]:
+    """
+    解析CIDR或单个地址，返回 (版本, 起始地址, 前缀长度)，主机位按 strict=False 清零
+    规范写法走 inet_pton 快速路径，其余写法交给 ipaddress，无效时抛出 ValueError。
+    """
+    address, _, prefix = rule.partition('/')
+    version = 6 if ':' in address else 4
+    width = WIDTHS[version]
+    try:
+        packed = socket.inet_pton(FAMILIES[version], address)
+    except OSError:
+        packed = None
+    if packed is not None and (not prefix or (prefix.isdigit() and prefix.isascii())):
+        prefixlen = int(prefix) if prefix else width
+        if prefixlen <= width:
+            host_bits = width - prefixlen
+            start = int.from_bytes(packed, "big") >> host_bits << host_bits
+            return version, start, prefixlen
+
+    network = ipaddress.ip_network(rule, strict=False)
+    return network.version, int(network.network_address), network.prefixlen
+
+
+def format_network(version: int, start: int, prefixlen: int) -> str:
+    """输出与 ipaddress with_prefixlen 一致的文本。"""
+    if version == 4:
+        return f"{socket.inet_ntoa(start.to_bytes(4, 'big'))}/{prefixlen}"
+    return f"{ipaddress.IPv6Address(start).compressed}/{prefixlen}"
+
+
+def remove_covered(version: int, keys) -> Tuple[List[int], List[int]]:
+    """排序键后裁剪被覆盖网段，返回保留网段的 (起始地址列表, 前缀长度列表)。"""
+    if numpy is None or version != 4 or not keys:
+        return _scan_covered(sorted(keys), WIDTHS[version])
+
+    ordered = numpy.sort(numpy.frombuffer(keys, dtype=numpy.uint64))
+    starts = ordered >> numpy.uint64(PREFIX_BITS)
+    prefixes = ordered & numpy.uint64(PREFIX_MASK)
+    ends = starts + (numpy.uint64(1) << (numpy.uint64(32) - prefixes)) - numpy.uint64(1)
+    kept = numpy.ones(len(ordered), dtype=bool)
+    kept[1:] = ends[1:] > numpy.maximum.accumulate(ends)[:-1]
+    return starts[kept].tolist(), prefixes[kept].tolist()
+
+
+def _scan_covered(ordered_keys: Iterable[int], width: int) -> Tuple[List[int], List[int]]:
+    """按 (起始地址, 前缀长度) 升序扫描，结束地址不超过已见最大值的网段即被覆盖。"""
+    starts = []
+    prefixes = []
+    max_end = -1
+    for key in ordered_keys:
+        start = key >> PREFIX_BITS
+        prefixlen = key & PREFIX_MASK
+        end = start + (1 << (width - prefixlen)) - 1
+        if end <= max_end:
+            continue
+        starts.append(start)
+        prefixes.append(prefixlen)
+        max_end = end
+    return starts, prefixes
+
+
+def split_range(start: int, end: int, width: int) -> Tuple[List[int], List[int]]:
+    """把地址区间 [start, end] 拆分为最少数量的对齐CIDR。"""
+    starts = []
+    prefixes = []
+    while start <= end:
+        alignment = (start & -start).bit_length() - 1 if start else width
+        bits = min(alignment, (end - start + 1).bit_length() - 1)
+        starts.append(start)
+        prefixes.append(width - bits)
+        start += 1 << bits
+    return starts, prefixes
+
+
+def aggregate_networks(
+    starts: List[int],
+    prefixes: List[int],
+    width: int
+) -> Tuple[List[int], List[int]]:
+    """
+    合并相邻网段并拆分为最少数量的CIDR
+    输入须为互不重叠且按起始地址升序的网段，即覆盖裁剪后的结果。
+    """
+    merged_starts = []
+    merged_prefixes = []
+    range_start = None
+    range_end = -2
+
+    def split(start: int, end: int) -> None:
+        split_starts, split_prefixes = split_range(start, end, width)
+        merged_starts.extend(split_starts)
+        merged_prefixes.extend(split_prefixes)
+
+    for start, prefixlen in zip(starts, prefixes):
+        end = start + (1 << (width - prefixlen)) - 1
+        if start == range_end + 1:
+            range_end = end
+            continue
+        if range_start is not None:
+            split(range_start, range_end)
+        range_start, range_end = start, end
+    if range_start is not None:
+        split(range_start, range_end)
+    return merged_starts, merged_prefixes
+
+
+def optimize_networks(
+    rules: Iterable[str],
+    aggregate: bool = False
+) -> Tuple[List[str], Dict[str, int]]:
+    """
+    去重并裁剪被父网段覆盖的子网段，aggregate 为真时再合并相邻网段
+    返回: (按版本、起始地址、前缀长度排序的CIDR列表, 统计信息)
+    """
+    total = 0
+    unique_rules = set()
+    for rule in rules:
+        total += 1
+        unique_rules.add(rule)
+
+    v4_keys = array('Q')
+    v6_keys = []
+    for rule in unique_rules:
+        version, start, prefixlen = parse_network(rule)
+        key = start << PREFIX_BITS | prefixlen
+        if version == 4:
+            v4_keys.append(key)
+        else:
+            v6_keys.append(key)
+
+    stats = {
+        "total": total,
+        "duplicates": total - len(unique_rules),
+        "covered_subnets": 0,
+        "aggregated": 0,
+        "kept": 0
+    }
+    final_rules = []
+    for version, keys in ((4, v4_keys), (6, v6_keys)):
+        starts, prefixes = remove_covered(version, keys)
+        stats["covered_subnets"] += len(keys) - len(starts)
+        if aggregate:
+            kept_count = len(starts)
+            starts, prefixes = aggregate_networks(starts, prefixes, WIDTHS[version])
+            stats["aggregated"] += kept_count - len(starts)
+        final_rules.extend(
+            format_network(version, start, prefixlen)
+            for start, prefixlen in zip(starts, prefixes)
+        )
+
+    stats["kept"] = len(final_rules)
+    return final_rules, stats
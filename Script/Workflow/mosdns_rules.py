@@ -9,8 +9,10 @@ MosDNS规则处理脚本
 4. 去掉正则匹配类型的规则
 5. 按规则类型执行去重和优化
 6. 支持用MosDNS域名规则排除被覆盖的域名
+7. IP规则可按配置合并相邻网段（aggregate）
 """
 
+import argparse
 import json
 import ipaddress
 import os
@@ -18,16 +20,52 @@ import re
 import sys
 import tempfile
 import time
-import urllib.request
 from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from pathlib import Path
-from typing import Dict, Iterable, List, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from domain_trie import EXACT, WILDCARD, DomainTrie
+from ip_intervals import optimize_networks
+from build_manifest import BuildManifest, code_digest
+from build_metrics import BuildMetrics, RuleMetrics, count_items
+from fetch_cache import DEFAULT_MAX_BYTES, FetchCache, fetch_source, open_cache
+from http_pool import shared_client
+from output_index import OutputIndex, content_digest, diff_sorted, open_index, render_patch
+from parse_cache import ConvertedSource, ParseCache, convert_source_file, open_parse_cache
+from rule_budget import check_budgets, output_rule_counter, validate_budget
+from rule_emitters import classify_mosdns_rule, emit_formats, validate_outputs
+from rule_scheduler import default_workers, dependency_graph, input_graph, run_graph
+from rule_source import SourceFile, local_source, read_lines, read_rule_lines
 
 # 编译正则模式以提升性能
 REGEX_PATTERN = re.compile(r'[\*\[\]\(\)\\+\?\^\$\|]')
 DOMAIN_PATTERN = re.compile(r'^[a-zA-Z0-9._-]+$')
+INLINE_COMMENT_PATTERN = re.compile(r'\s+[#!;].*$')
+# AdGuard 快速路径: 行首字符 -> 整行匹配的写法，分组为不含正则字符、端口、路径与查询参数的域名
+# 尾部不含 * 保证不会是 */ 注释；未匹配的行按逐步处理的原路径转换
+ADGUARD_PATTERNS = {
+    '|': re.compile(r'\|\|([a-zA-Z0-9._-]+)\^[^*]*').fullmatch,
+    '.': re.compile(r'\.([a-zA-Z0-9._-]*)').fullmatch,
+}
+ADGUARD_PLAIN_MATCH = re.compile(r'([a-zA-Z0-9._-]*\.[a-zA-Z0-9._-]*)').fullmatch
 DOMAIN_FAMILY = "domain"
 IP_FAMILY = "ip"
+CODE_PATHS = (
+    Path(__file__),
+    Path(__file__).with_name("domain_trie.py"),
+    Path(__file__).with_name("rule_source.py"),
+    Path(__file__).with_name("ip_intervals.py"),
+)
+# 解析缓存的版本只取决于逐行转换代码
+PARSE_CODE_PATHS = (
+    Path(__file__),
+    Path(__file__).with_name("rule_source.py"),
+)
+# 每主机并发由共享连接池限制，线程数只决定同时处理的来源数
+FETCH_WORKERS = 16
+# 规则分批写入前缀树，流式转换时只缓冲一批
+ADD_BATCH_SIZE = 65536
 FORMAT_FAMILIES = {
     "domain_adguard": DOMAIN_FAMILY,
     "domain_surge": DOMAIN_FAMILY,
@@ -217,22 +255,6 @@ def convert_ip_cidr_rule(rule: str) -> Tuple[str, str]:
 
     return network.with_prefixlen, "converted"
 
-def filter_regex_rules(rules: List[str]) -> Tuple[List[str], int]:
-    """
-    过滤掉正则表达式规则
-    返回: (过滤后的规则列表, 被过滤的数量)
-    """
-    filtered_rules = []
-    regex_count = 0
-
-    for rule in rules:
-        if is_regex_rule(rule):
-            regex_count += 1
-        else:
-            filtered_rules.append(rule)
-
-    return filtered_rules, regex_count
-
 def convert_mosdns_domain_rule(rule: str) -> Tuple[str, str]:
     """严格解析MosDNS域名规则，仅接受 domain: 和 full:。"""
     original_rule = rule.strip()
@@ -265,135 +287,57 @@ def convert_mosdns_domain_rule(rule: str) -> Tuple[str, str]:
 
     return f"{prefix}:{domain}", "converted"
 
-def sort_ip_network_key(network) -> Tuple[int, int, int]:
-    """为IP网络生成稳定排序键"""
-    return (network.version, int(network.network_address), network.prefixlen)
-
-def remove_covered_ip_networks(networks) -> Tuple[List, Dict[str, int], List[Tuple[str, str]]]:
+def add_domain_rules(trie: DomainTrie, rules: Iterable[str], other_rules: Set[str]) -> int:
     """
-    严格去重IP规则:
-    1. 保留更大父网段
-    2. 删除被父网段完整覆盖的子网段
-    3. 不主动聚合相邻网段
+    将MosDNS域名规则分批写入前缀树，非 domain:/full: 规则单独去重
+    返回完全重复的条数
     """
-    kept_networks = []
-    coverage_stats = {"covered_subnets": 0}
-    max_end_by_version = {4: -1, 6: -1}
-    max_end_network_by_version = {4: None, 6: None}
-    covered_samples = []
-
-    for network in sorted(networks, key=sort_ip_network_key):
-        version = network.version
-        network_end = int(network.broadcast_address)
-        if network_end <= max_end_by_version[version]:
-            coverage_stats["covered_subnets"] += 1
-            parent_network = max_end_network_by_version[version]
-            if parent_network is not None and len(covered_samples) < 5:
-                covered_samples.append((parent_network.with_prefixlen, network.with_prefixlen))
-            continue
-
-        kept_networks.append(network)
-        max_end_by_version[version] = network_end
-        max_end_network_by_version[version] = network
-
-    return kept_networks, coverage_stats, covered_samples
-
-def optimize_domains(rules: List[str]) -> Tuple[List[str], Dict[str, int]]:
+    duplicates = 0
+    rules = iter(rules)
+    while True:
+        batch = list(islice(rules, ADD_BATCH_SIZE))
+        if not batch:
+            return duplicates
+        wildcards = []
+        exacts = []
+        for rule in batch:
+            if rule.startswith('domain:'):
+                wildcards.append(rule[7:])
+            elif rule.startswith('full:'):
+                exacts.append(rule[5:])
+            elif rule in other_rules:
+                duplicates += 1
+            else:
+                other_rules.add(rule)
+        duplicates += trie.add_many(wildcards, WILDCARD)
+        duplicates += trie.add_many(exacts, EXACT)
+
+def collect_domain_rules(
+    trie: DomainTrie,
+    other_rules: Set[str],
+    excludes: Sequence[DomainTrie] = ()
+) -> Tuple[List[str], Dict[str, int]]:
     """
-    优化域名规则，合并重复和包含关系的域名
-    返回: (优化后的规则列表, 统计信息)
+    单次遍历前缀树，同时完成覆盖裁剪与排除过滤
+    返回: (排序后的规则列表, 各裁剪状态的条数)
+    转换结果均为升序，前缀树按插入顺序返回，拼接后只有少量升序段；
+    仍对全部规则排序一次，list.sort 会识别已有的升序段，实测比 heapq.merge 逐条归并更快。
     """
-    stats = {
-        "total": len(rules),
-        "duplicates": 0,
-        "wildcard_covered": 0,
-        "domain_covered_full": 0,
-        "kept": 0
-    }
-
-    # 分离不同类型的规则
-    domain_rules = []  # domain:example.com
-    full_rules = []    # full:example.com
-    other_rules = []   # 其他格式
-
-    for rule in rules:
-        if rule.startswith('domain:'):
-            domain_rules.append(rule[7:])  # 去掉 domain: 前缀
-        elif rule.startswith('full:'):
-            full_rules.append(rule[5:])  # 去掉 full: 前缀
-        else:
-            other_rules.append(rule)
-
-    # 去重
-    original_count = len(domain_rules) + len(full_rules) + len(other_rules)
-    domain_rules = list(set(domain_rules))
-    full_rules = list(set(full_rules))
-    other_rules = list(set(other_rules))
-
-    stats["duplicates"] = original_count - len(domain_rules) - len(full_rules) - len(other_rules)
-
-    # 优化domain规则 - 按域名长度排序，短的在前
-    sorted_domains = sorted(domain_rules, key=lambda x: (len(x.split('.')), x))
-
-    # 使用集合进行高效查找
-    kept_domains = set()
-    for domain in sorted_domains:
-        is_covered = False
-        domain_parts = domain.split('.')
-
-        # 检查是否被已保留的更短域名覆盖
-        for i in range(1, len(domain_parts)):
-            parent_domain = '.'.join(domain_parts[i:])
-            if parent_domain in kept_domains:
-                # 确保父域名确实能覆盖当前域名
-                if domain.endswith('.' + parent_domain):
-                    is_covered = True
-                    stats["wildcard_covered"] += 1
-                    break
-
-        if not is_covered:
-            kept_domains.add(domain)
-
-    # 处理 full 规则 - 检查是否被 domain 规则覆盖
-    kept_full_rules = []
-    for full_domain in full_rules:
-        is_covered = False
-
-        # 检查 full 域名本身是否在 domain 集合中
-        if full_domain in kept_domains:
-            is_covered = True
-            stats["domain_covered_full"] += 1
-        else:
-            # 检查 full 域名的任何父域名是否在 domain 集合中
-            domain_parts = full_domain.split('.')
-            for i in range(1, len(domain_parts)):
-                parent_domain = '.'.join(domain_parts[i:])
-                if parent_domain in kept_domains:
-                    is_covered = True
-                    stats["domain_covered_full"] += 1
-                    break
-
-        if not is_covered:
-            kept_full_rules.append(f"full:{full_domain}")
-
-    # 组装最终规则
-    optimized_domains = [f"domain:{d}" for d in kept_domains]
-    final_rules = optimized_domains + kept_full_rules + other_rules
-    stats["kept"] = len(final_rules)
-
-    return sorted(final_rules), stats
-
-def is_covered_by_domain_rule(domain: str, domain_rules: set) -> bool:
-    """判断域名是否被 domain: 规则覆盖。"""
-    domain_parts = domain.split('.')
-    for index in range(len(domain_parts)):
-        parent_domain = '.'.join(domain_parts[index:])
-        if parent_domain in domain_rules:
-            return True
-    return False
+    wildcards, exacts, counts = trie.prune(excludes)
+    final_rules = [f"domain:{domain}" for domain in wildcards]
+    final_rules.extend(f"full:{domain}" for domain in exacts)
+    final_rules.extend(sorted(other_rules))
+    final_rules.sort()
+    return final_rules, counts
+
+def build_exclude_trie(exclude_rules: Iterable[str]) -> DomainTrie:
+    """由MosDNS排除规则构建前缀树，非 domain:/full: 规则不参与排除。"""
+    trie = DomainTrie()
+    add_domain_rules(trie, exclude_rules, set())
+    return trie
 
 def parse_exclude_rules(lines: Iterable[str], label: str) -> List[str]:
-    """加载MosDNS排除规则，非MosDNS域名规则直接失败。"""
+    """加载MosDNS排除规则，非MosDNS域名规则直接失败；被覆盖的条目不影响排除结果，不再优化。"""
     exclude_rules = []
 
     for line_number, line in enumerate(lines, start=1):
@@ -406,70 +350,30 @@ def parse_exclude_rules(lines: Iterable[str], label: str) -> List[str]:
             )
         exclude_rules.append(converted_rule)
 
-    optimized_rules, _ = optimize_domains(exclude_rules)
-    return optimized_rules
-
-def apply_domain_exclusions(rules: List[str], exclude_rules: List[str]) -> Tuple[List[str], Dict[str, int]]:
-    """按MosDNS domain/full语义移除被排除规则覆盖的域名。"""
-    stats = {
-        "exclude_rules": len(exclude_rules),
-        "excluded_by_domain": 0,
-        "excluded_by_full": 0,
-        "kept": 0
-    }
-
-    exclude_domains = set()
-    exclude_fulls = set()
-
-    for rule in exclude_rules:
-        if rule.startswith('domain:'):
-            exclude_domains.add(rule[7:])
-        elif rule.startswith('full:'):
-            exclude_fulls.add(rule[5:])
-
-    filtered_rules = []
-    for rule in rules:
-        if rule.startswith('domain:'):
-            domain = rule[7:].lower()
-            if is_covered_by_domain_rule(domain, exclude_domains):
-                stats["excluded_by_domain"] += 1
-                continue
-        elif rule.startswith('full:'):
-            domain = rule[5:].lower()
-            if is_covered_by_domain_rule(domain, exclude_domains):
-                stats["excluded_by_domain"] += 1
-                continue
-            if domain in exclude_fulls:
-                stats["excluded_by_full"] += 1
-                continue
-
-        filtered_rules.append(rule)
-
-    stats["kept"] = len(filtered_rules)
-    return filtered_rules, stats
+    return exclude_rules
 
-def optimize_ip_networks(rules: List[str]) -> Tuple[List[str], Dict[str, int]]:
+def build_exclusion_index(path: str, rules: Optional[List[str]], source: Optional[SourceFile]) -> DomainTrie:
+    """
+    构建单个排除项的只读索引，可在子进程中执行
+    rules 为已生成产物的规则，为 None 时读取外部文件 source；同一排除项只构建一次，供各规则集共用。
+    """
+    if rules is None:
+        rules = parse_exclude_rules(clean_rule_lines(read_lines(source)), path)
+    return build_exclude_trie(rules)
+
+def optimize_ip_networks(
+    rules: Iterable[str],
+    aggregate: bool = False
+) -> Tuple[List[str], Dict[str, int]]:
     """
     规范化IP规则，执行完全重复去重和父网段覆盖子网段裁剪
+    aggregate 为真时再把相邻网段合并为最少数量的CIDR
     """
-    unique_rules = set(rules)
-    unique_networks = [
-        ipaddress.ip_network(rule, strict=False)
-        for rule in unique_rules
-    ]
-    kept_networks, coverage_stats, _ = remove_covered_ip_networks(unique_networks)
-    stats = {
-        "total": len(rules),
-        "duplicates": len(rules) - len(unique_rules),
-        "covered_subnets": coverage_stats["covered_subnets"],
-        "kept": len(kept_networks)
-    }
-
-    return [network.with_prefixlen for network in kept_networks], stats
+    return optimize_networks(rules, aggregate)
 
-def parse_nft_ip_cidr_rules(lines: Iterable[str], label: str) -> List[str]:
-    """从nftables set elements中提取IP/CIDR规则。"""
-    nft_rules = []
+def parse_nft_ip_cidr_rules(lines: Iterable[str], label: str) -> Iterator[str]:
+    """从nftables set elements中逐条提取IP/CIDR规则。"""
+    found = False
     in_elements = False
 
     for line_number, line in enumerate(lines, start=1):
@@ -496,59 +400,121 @@ def parse_nft_ip_cidr_rules(lines: Iterable[str], label: str) -> List[str]:
                 raise ValueError(
                     f"nft IP集合 {label} 第 {line_number} 行无效: {token}"
                 )
-            nft_rules.append(converted_rule)
+            found = True
+            yield converted_rule
 
     if in_elements:
         raise ValueError(f"nft IP集合未正确闭合: {label}")
-    if not nft_rules:
+    if not found:
         raise ValueError(f"未从nft IP集合提取到有效IP/CIDR规则: {label}")
 
-    return nft_rules
-
-def clean_rule_lines(content: str) -> Iterable[str]:
-    """执行各文本格式共用的轻量清理。"""
-    for raw_line in content.splitlines():
-        line = raw_line.strip()
-        if (
-            not line or
-            line.startswith(('#', ';', '!', '//', '/*')) or
-            line.startswith('payload:') or
-            '*/' in line
-        ):
-            continue
-        line = re.sub(r'\s+[#!;].*$', '', line).strip()
+def clean_rule_line(raw_line: str) -> str:
+    """执行各文本格式共用的轻量清理，注释与空行返回空字符串。"""
+    line = raw_line.strip()
+    if (
+        not line or
+        line.startswith(('#', ';', '!', '//', '/*')) or
+        line.startswith('payload:') or
+        '*/' in line
+    ):
+        return ""
+    return INLINE_COMMENT_PATTERN.sub('', line).strip()
+
+
+def clean_rule_lines(lines: Iterable[str]) -> Iterator[str]:
+    for raw_line in lines:
+        line = clean_rule_line(raw_line)
         if line:
             yield line
 
 
-def convert_lines(lines: Iterable[str], converter) -> List[str]:
-    converted_rules = []
+def convert_lines(lines: Iterable[str], converter) -> Iterator[str]:
     for line in lines:
         converted_rule, rule_type = converter(line)
         if rule_type in ("converted", "mosdns"):
-            converted_rules.append(converted_rule)
-    return converted_rules
+            yield converted_rule
+
+
+def convert_adguard_lines(lines: Iterable[str], counters: Dict[str, int]) -> Iterator[str]:
+    """
+    单遍转换AdGuard来源，等价于 clean_rule_lines、convert_adguard_to_mosdns 与正则过滤串联
+    按行首字符查表取整行匹配的写法，一次匹配即得到域名；未匹配的行走逐步处理的原路径
+    域名统一转为小写，被剔除的正则规则累加到 counters["regex"]
+    """
+    patterns_get = ADGUARD_PATTERNS.get
+    plain_match = ADGUARD_PLAIN_MATCH
+    regex_count = 0
+    try:
+        for line in lines:
+            match = patterns_get(line[:1], plain_match)(line)
+            if match is not None:
+                yield "domain:" + match[1].lower()
+                continue
+
+            line = clean_rule_line(line)
+            if not line:
+                continue
+            converted_rule, rule_type = convert_adguard_to_mosdns(line)
+            if rule_type not in ("converted", "mosdns"):
+                continue
+            if is_regex_rule(converted_rule):
+                regex_count += 1
+                continue
+            yield converted_rule.lower()
+    finally:
+        counters["regex"] = counters.get("regex", 0) + regex_count
 
 
-def convert_source(rule_format: str, content: str, label: str) -> List[str]:
+def convert_source(
+    rule_format: str,
+    lines: Iterable[str],
+    label: str,
+    counters: Optional[Dict[str, int]] = None
+) -> Iterator[str]:
+    """逐行转换来源，来源读完仍未产出规则时失败；AdGuard 剔除的正则规则计入 counters。"""
     converters = {
-        "domain_adguard": convert_adguard_to_mosdns,
         "domain_surge": convert_surge_domain_set_to_mosdns,
         "domain_mosdns": convert_mosdns_domain_rule,
         "ip_cidr": convert_ip_cidr_rule,
     }
 
     if rule_format == "ip_nft":
-        rules = parse_nft_ip_cidr_rules(content.splitlines(), label)
+        rules = parse_nft_ip_cidr_rules(lines, label)
+    elif rule_format == "domain_adguard":
+        rules = convert_adguard_lines(lines, counters if counters is not None else {})
     else:
         converter = converters.get(rule_format)
         if converter is None:
             raise ValueError(f"不支持的规则格式: {rule_format}")
-        rules = convert_lines(clean_rule_lines(content), converter)
+        rules = convert_lines(clean_rule_lines(lines), converter)
 
-    if not rules:
+    found = False
+    for rule in rules:
+        found = True
+        yield rule
+    if not found:
         raise ValueError(f"来源未产生有效规则: {label}")
-    return rules
+
+
+def parse_location(rule_format: str, source: SourceFile, label: str, record: Dict) -> Iterator[str]:
+    """
+    读取并转换单个来源，行数与规则条数累加到 record
+    转换时剔除的正则规则仍计入规则条数，与先转换后过滤时的统计一致。
+    """
+    counters = {"regex": 0}
+    try:
+        yield from count_items(
+            convert_source(
+                rule_format,
+                count_items(read_lines(source), record, "lines"),
+                label,
+                counters
+            ),
+            record,
+            "rules"
+        )
+    finally:
+        record["rules"] += counters["regex"]
 
 
 def workspace_path(workspace: Path, relative_path: str) -> Path:
@@ -558,25 +524,25 @@ def workspace_path(workspace: Path, relative_path: str) -> Path:
     return path
 
 
-def read_location(workspace: Path, location: str) -> str:
+def read_location(
+    workspace: Path,
+    location: str,
+    spool_dir: Path,
+    cache: Optional[FetchCache] = None
+) -> SourceFile:
+    """
+    远程来源经共享连接池下载到缓存或 spool_dir（失败按退避重试），
+    本地来源直接登记工作区文件。
+    """
     if location.startswith(("https://", "http://")):
-        request = urllib.request.Request(
+        return fetch_source(
             location,
-            headers={"User-Agent": "Provider-MosDNS-Workflow"}
+            {"User-Agent": "Provider-MosDNS-Workflow"},
+            spool_dir,
+            cache
         )
-        with urllib.request.urlopen(request, timeout=30) as response:
-            data = response.read()
-        if not data:
-            raise ValueError(f"下载内容为空: {location}")
-        return data.decode("utf-8")
 
-    path = workspace_path(workspace, location)
-    if not path.is_file():
-        raise FileNotFoundError(f"本地来源不存在: {location}")
-    content = path.read_text(encoding="utf-8")
-    if not content:
-        raise ValueError(f"本地来源为空: {location}")
-    return content
+    return local_source(workspace_path(workspace, location), location)
 
 
 def load_config(workspace: Path) -> List[Dict]:
@@ -610,12 +576,25 @@ def load_config(workspace: Path) -> List[Dict]:
             isinstance(path, str) and path for path in excludes
         ):
             raise ValueError(f"规则 {rule_id} 的 exclude 无效")
+        if not isinstance(rule.get("aggregate", False), bool):
+            raise ValueError(f"规则 {rule_id} 的 aggregate 必须是布尔值")
         seen_ids.add(rule_id)
         seen_paths.add(output_path)
+        validate_budget(rule, rule_id)
+        for path in validate_outputs(rule.get("outputs", {}), rule_id):
+            if path in seen_paths:
+                raise ValueError(f"规则 {rule_id} 的输出路径重复: {path}")
+            seen_paths.add(path)
     return rules
 
 
-def load_locations(workspace: Path, rules: List[Dict]) -> Dict[str, str]:
+def load_locations(
+    workspace: Path,
+    rules: List[Dict],
+    spool_dir: Path,
+    cache: Optional[FetchCache] = None,
+    metrics: Optional[BuildMetrics] = None
+) -> Dict[str, SourceFile]:
     output_paths = {rule["path"] for rule in rules}
     locations = {
         location
@@ -630,73 +609,243 @@ def load_locations(workspace: Path, rules: List[Dict]) -> Dict[str, str]:
         if exclude_path not in output_paths
     )
     ordered_locations = sorted(locations)
-    with ThreadPoolExecutor(max_workers=min(8, len(ordered_locations))) as executor:
-        contents = executor.map(
-            lambda location: read_location(workspace, location),
-            ordered_locations
-        )
+
+    def load(location: str) -> SourceFile:
+        started = time.perf_counter()
+        source = read_location(workspace, location, spool_dir, cache)
+        if metrics is not None:
+            metrics.record_fetch(
+                location, time.perf_counter() - started, source.size, source.wire_bytes
+            )
+        return source
+
+    with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(ordered_locations))) as executor:
+        contents = executor.map(load, ordered_locations)
         return dict(zip(ordered_locations, contents))
 
 
-def build_rulesets(
-    rules: List[Dict],
-    contents: Dict[str, str]
-) -> Dict[str, List[str]]:
-    output_paths = {rule["path"] for rule in rules}
-    generated = {}
+def rule_input_digests(
+    rule: Dict,
+    source_digests: Dict[str, str],
+    generated_digests: Dict[str, str]
+) -> Dict[str, str]:
+    """收集规则集全部输入的摘要，排除项引用的产物取其生成结果摘要。"""
+    digests = {}
+    for locations in rule["sources"].values():
+        for location in locations:
+            digests[location] = source_digests[location]
+    for exclude_path in rule.get("exclude", []):
+        if exclude_path in generated_digests:
+            digests[exclude_path] = generated_digests[exclude_path]
+        else:
+            digests[exclude_path] = source_digests[exclude_path]
+    return digests
 
-    for rule in rules:
-        rule_id = rule["id"]
-        families = {FORMAT_FAMILIES[rule_format] for rule_format in rule["sources"]}
-        if len(families) != 1:
-            raise ValueError(f"规则 {rule_id} 不能混合域名与 IP 来源")
-        family = next(iter(families))
 
-        converted_rules = []
+def read_output_rules(path: Path) -> List[str]:
+    return list(read_rule_lines(path, comment=None))
+
+
+def source_node(rule_format: str, location: str) -> str:
+    """来源转换任务在依赖图中的节点名，与产物路径互不冲突。"""
+    return f"{rule_format}:{location}"
+
+
+def convert_location(
+    rule_format: str,
+    source: SourceFile,
+    label: str,
+    parse_cache: Optional[ParseCache] = None
+) -> ConvertedSource:
+    """转换单个来源，可在子进程中执行，提供 parse_cache 时内容未变的来源直接回放缓存的转换结果。"""
+    return convert_source_file(
+        parse_cache,
+        source,
+        rule_format,
+        ("lines", "rules"),
+        lambda record: parse_location(rule_format, source, label, record)
+    )
+
+
+def build_ruleset(
+    rule: Dict,
+    converted: Dict[str, ConvertedSource],
+    exclusions: Dict[str, DomainTrie],
+    trace_memory: bool = False
+) -> Tuple[List[str], int, Dict]:
+    """
+    生成单个规则集，可在子进程中执行
+    converted 为本规则各来源的转换结果（按 source_node 索引），exclusions 为各排除项已构建的只读索引；
+    来源按配置顺序依次解码后写入去重结构
+    返回: (最终规则, 转换得到的规则条数, 构建指标)
+    """
+    metrics = RuleMetrics(trace_memory)
+    rule_id = rule["id"]
+    families = {FORMAT_FAMILIES[rule_format] for rule_format in rule["sources"]}
+    if len(families) != 1:
+        raise ValueError(f"规则 {rule_id} 不能混合域名与 IP 来源")
+    family = next(iter(families))
+    converted_count = 0
+
+    def converted_rules() -> Iterator[str]:
+        nonlocal converted_count
         for rule_format, locations in rule["sources"].items():
             for location in locations:
-                converted_rules.extend(convert_source(
-                    rule_format,
-                    contents[location],
-                    f"{rule_id}:{location}"
-                ))
-
-        filtered_rules = converted_rules
-        exclude_paths = rule.get("exclude", [])
-        if exclude_paths:
-            if family != DOMAIN_FAMILY:
-                raise ValueError(f"IP 规则 {rule_id} 不支持 exclude")
-            exclude_rules = []
-            for exclude_path in exclude_paths:
-                if exclude_path in output_paths:
-                    if exclude_path not in generated:
-                        raise ValueError(
-                            f"规则 {rule_id} 的依赖尚未生成: {exclude_path}"
-                        )
-                    exclude_rules.extend(generated[exclude_path])
-                else:
-                    exclude_rules.extend(parse_exclude_rules(
-                        clean_rule_lines(contents[exclude_path]),
-                        exclude_path
-                    ))
-            exclude_rules, _ = optimize_domains(exclude_rules)
-            filtered_rules, _ = apply_domain_exclusions(
-                filtered_rules,
-                exclude_rules
-            )
+                result = converted[source_node(rule_format, location)]
+                metrics.add_source(result.record)
+                converted_count += result.record["rules"]
+                yield from result.rules
+        metrics.lap("parse")
+
+    exclude_paths = rule.get("exclude", [])
+    if exclude_paths and family != DOMAIN_FAMILY:
+        raise ValueError(f"IP 规则 {rule_id} 不支持 exclude")
+    aggregate = rule.get("aggregate", False)
+    if aggregate and family != IP_FAMILY:
+        raise ValueError(f"域名规则 {rule_id} 不支持 aggregate")
+
+    if family == DOMAIN_FAMILY:
+        excludes = [exclusions[exclude_path] for exclude_path in exclude_paths]
+        metrics.lap("exclude")
+        # 正则规则已在转换时剔除，排除与覆盖裁剪均在同一棵前缀树上一次完成
+        trie = DomainTrie()
+        other_rules = set()
+        add_domain_rules(trie, converted_rules(), other_rules)
+        final_rules, _ = collect_domain_rules(trie, other_rules, excludes)
+    else:
+        final_rules, _ = optimize_ip_networks(converted_rules(), aggregate)
+    metrics.lap("optimize")
+
+    if not final_rules:
+        raise ValueError(f"规则 {rule_id} 的最终产物为空")
+    return final_rules, converted_count, metrics.result()
 
-        if family == DOMAIN_FAMILY:
-            filtered_rules, _ = filter_regex_rules(filtered_rules)
-            final_rules, _ = optimize_domains(filtered_rules)
-        else:
-            final_rules, _ = optimize_ip_networks(filtered_rules)
 
-        if not final_rules:
-            raise ValueError(f"规则 {rule_id} 的最终产物为空")
-        generated[rule["path"]] = final_rules
-        print(f"{rule_id}: {len(converted_rules)} -> {len(final_rules)} 条")
+def build_rulesets(
+    rules: List[Dict],
+    contents: Dict[str, SourceFile],
+    manifest: Optional[BuildManifest] = None,
+    workspace: Optional[Path] = None,
+    max_workers: int = 1,
+    metrics: Optional[BuildMetrics] = None,
+    parse_cache: Optional[ParseCache] = None
+) -> Dict[str, List[str]]:
+    """
+    按排除项形成的依赖图调度构建，各来源的转换、排除索引与互不依赖的规则集都在进程池中并行执行
+    来源转换与排除索引按 (输入, 规则集) 调度，只依赖该规则集的排除项，届时已能判断它是否复用，
+    复用时跳过；被多个规则集引用的输入只执行一次。
+    """
+    rules_by_path = {rule["path"]: rule for rule in rules}
+    source_nodes: Dict[str, Tuple[str, str]] = {}
+    index_nodes: Dict[str, str] = {}
+    rule_inputs: Dict[str, List[str]] = {}
 
-    return generated
+    for path, rule in rules_by_path.items():
+        inputs = []
+        for rule_format, locations in rule["sources"].items():
+            for location in locations:
+                node = source_node(rule_format, location)
+                source_nodes[node] = (rule_format, location)
+                inputs.append(node)
+        for exclude_path in rule.get("exclude", []):
+            node = f"exclude:{exclude_path}"
+            index_nodes[node] = exclude_path
+            inputs.append(node)
+        rule_inputs[path] = list(dict.fromkeys(inputs))
+
+    rule_dependencies = dependency_graph(rules_by_path, lambda path: rules_by_path[path].get("exclude", []))
+    graph, tasks, consumers = input_graph(rule_dependencies, rule_inputs)
+    generated = {}
+    generated_digests = {}
+    input_digests = {}
+    reused = {}
+    # 来源转换结果与排除索引，最后一个使用者取走后释放
+    shared = {}
+    pending = {node: len(paths) for node, paths in consumers.items()}
+    source_digests = {location: source.sha256 for location, source in contents.items()}
+
+    def reuse(path: str) -> bool:
+        """判断规则集能否复用上次产物，每个规则集只判断一次，需在其排除项完成后调用。"""
+        if path in reused:
+            return reused[path]
+        reused[path] = False
+        rule = rules_by_path[path]
+        if manifest is not None:
+            inputs = manifest.input_digest(
+                rule,
+                rule_input_digests(rule, source_digests, generated_digests)
+            )
+            reused_rules = manifest.reuse(
+                path,
+                inputs,
+                workspace_path(workspace, path),
+                read_output_rules
+            )
+            if reused_rules is not None:
+                generated[path] = reused_rules
+                generated_digests[path] = manifest.rules_digest_of(path)
+                print(f"{rule['id']}: 输入未变化，复用 {len(reused_rules)} 条")
+                if metrics is not None:
+                    metrics.record_rule(rule["id"], path, len(reused_rules))
+                reused[path] = True
+            else:
+                input_digests[path] = inputs
+        return reused[path]
+
+    def prepare(node: str):
+        if node in tasks:
+            input_node, path = tasks[node]
+            if input_node in shared or reuse(path):
+                return None
+            if input_node in index_nodes:
+                exclude_path = index_nodes[input_node]
+                if exclude_path in rules_by_path:
+                    return build_exclusion_index, (exclude_path, generated[exclude_path], None)
+                return build_exclusion_index, (exclude_path, None, contents[exclude_path])
+            rule_format, location = source_nodes[input_node]
+            label = f"{rules_by_path[path]['id']}:{location}"
+            return convert_location, (rule_format, contents[location], label, parse_cache)
+
+        path = node
+        rule = rules_by_path[path]
+        job = None
+        if not reuse(path):
+            job = build_ruleset, (
+                rule,
+                {
+                    source: shared[source]
+                    for source in rule_inputs[path]
+                    if source in source_nodes
+                },
+                {
+                    index_nodes[index]: shared[index]
+                    for index in rule_inputs[path]
+                    if index in index_nodes
+                },
+                metrics is not None and metrics.trace_memory
+            )
+        # 任务参数已持有共用结果，最后一个使用者取走后即可释放
+        for input_node in rule_inputs[path]:
+            pending[input_node] -= 1
+            if not pending[input_node]:
+                shared.pop(input_node, None)
+        return job
+
+    def finish(node: str, result) -> None:
+        if node in tasks:
+            shared[tasks[node][0]] = result
+            return
+        path = node
+        final_rules, converted_count, rule_metrics = result
+        generated[path] = final_rules
+        if manifest is not None:
+            generated_digests[path] = manifest.record(path, input_digests[path], final_rules)
+        print(f"{rules_by_path[path]['id']}: {converted_count} -> {len(final_rules)} 条")
+        if metrics is not None:
+            metrics.record_rule(rules_by_path[path]["id"], path, len(final_rules), rule_metrics)
+
+    run_graph(graph, prepare, finish, max_workers)
+    return {path: generated[path] for path in rules_by_path}
 
 
 def atomic_write(path: Path, content: str) -> None:
@@ -717,35 +866,66 @@ def atomic_write(path: Path, content: str) -> None:
         temporary_path.unlink(missing_ok=True)
 
 
+def publish_formats(workspace: Path, rule: Dict, final_rules: List[str], refresh: bool) -> None:
+    """按 outputs 配置一次遍历写出其他格式，规则变化或有目标缺失时才重写。"""
+    targets = {
+        output_format: workspace_path(workspace, path)
+        for output_format, path in rule.get("outputs", {}).items()
+    }
+    if not targets or (not refresh and all(path.is_file() for path in targets.values())):
+        return
+    skipped = emit_formats(final_rules, classify_mosdns_rule, targets)
+    for output_format, count in skipped.items():
+        if count:
+            print(f"{rule['id']}: {output_format} 不支持的规则 {count} 条已跳过")
+
+
 def publish_rulesets(
     workspace: Path,
     rules: List[Dict],
-    generated: Dict[str, List[str]]
+    generated: Dict[str, List[str]],
+    unchanged: Iterable[str] = (),
+    index: Optional[OutputIndex] = None,
+    patch_dir: Optional[Path] = None
 ) -> List[str]:
+    """
+    与产物的有序索引归并比较，仅在规则增删时落盘并更新索引，再按 outputs 写出其他格式
+    提供 patch_dir 时为每个变化的规则集写出补丁；unchanged 中的产物直接跳过。
+    """
     summaries = []
     pending_writes = []
+    unchanged = set(unchanged)
+    index = index or OutputIndex()
 
     for rule in rules:
         relative_path = rule["path"]
+        if relative_path in unchanged:
+            continue
         output_path = workspace_path(workspace, relative_path)
         new_rules = generated[relative_path]
-        old_rules = set()
-        if output_path.is_file():
-            old_rules = {
-                line.strip()
-                for line in output_path.read_text(encoding="utf-8").splitlines()
-                if line.strip()
-            }
-        new_rule_set = set(new_rules)
-        if old_rules == new_rule_set:
+        ordered_rules = sorted(new_rules)
+        base_digest, old_rules = index.previous(relative_path, output_path, read_output_rules)
+        added, removed = diff_sorted(old_rules, ordered_rules)
+        if not added and not removed:
+            index.save(relative_path, base_digest, ordered_rules)
             continue
-        added = len(new_rule_set - old_rules)
-        removed = len(old_rules - new_rule_set)
-        summaries.append(f"{rule['id']} (+{added} -{removed})")
-        pending_writes.append((output_path, "\n".join(new_rules) + "\n"))
-
-    for output_path, content in pending_writes:
+        summaries.append(f"{rule['id']} (+{len(added)} -{len(removed)})")
+        content = "\n".join(new_rules) + "\n"
+        target_digest = content_digest(content)
+        patch = None
+        if patch_dir is not None:
+            patch = render_patch(relative_path, base_digest, target_digest, added, removed)
+        pending_writes.append((relative_path, output_path, content, target_digest, ordered_rules, patch))
+
+    for relative_path, output_path, content, target_digest, ordered_rules, patch in pending_writes:
         atomic_write(output_path, content)
+        index.save(relative_path, target_digest, ordered_rules)
+        if patch is not None:
+            atomic_write(patch_dir / f"{relative_path}.patch", patch)
+
+    changed_paths = {relative_path for relative_path, *_ in pending_writes}
+    for rule in rules:
+        publish_formats(workspace, rule, generated[rule["path"]], rule["path"] in changed_paths)
     return summaries
 
 
@@ -760,15 +940,110 @@ def write_github_output(summaries: List[str]) -> None:
         )
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="MosDNS规则生成")
+    parser.add_argument(
+        "--cache-dir",
+        default="",
+        help="远程来源下载缓存目录，默认读取 RULE_FETCH_CACHE_DIR"
+    )
+    parser.add_argument(
+        "--cache-max-bytes",
+        type=int,
+        default=DEFAULT_MAX_BYTES,
+        help="下载缓存体积上限（字节）"
+    )
+    parser.add_argument("--offline", action="store_true", help="仅使用下载缓存重建规则")
+    parser.add_argument(
+        "--manifest",
+        default="",
+        help="构建清单路径，默认位于下载缓存目录的 manifests/mosdns.json"
+    )
+    parser.add_argument(
+        "--index-dir",
+        default="",
+        help="产物有序索引目录，默认位于下载缓存目录的 indexes 子目录"
+    )
+    parser.add_argument(
+        "--patch-dir",
+        default="",
+        help="为变化的规则集写出增删补丁（<产物路径>.patch）的目录，默认不输出"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=default_workers(),
+        help="并行构建规则集的进程数，1 表示串行"
+    )
+    parser.add_argument(
+        "--metrics",
+        default="",
+        help="构建指标JSON行输出路径，- 表示标准输出"
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="用 tracemalloc 统计各规则集分配内存最多的代码位置（明显变慢）"
+    )
+    return parser.parse_args()
+
+
+def open_manifest(manifest_path: str, cache: Optional[FetchCache]) -> Optional[BuildManifest]:
+    if not manifest_path:
+        if cache is None:
+            return None
+        manifest_path = cache.directory / "manifests" / "mosdns.json"
+    return BuildManifest(Path(manifest_path), code_digest(CODE_PATHS))
+
+
 def main() -> int:
+    args = parse_args()
     start_time = time.time()
     workspace = Path(os.environ.get("GITHUB_WORKSPACE", Path.cwd())).resolve()
     try:
+        metrics = BuildMetrics(args.metrics, args.trace_memory)
+        cache = open_cache(args.cache_dir, args.cache_max_bytes, args.offline)
+        manifest = open_manifest(args.manifest, cache)
+        index = open_index(args.index_dir, cache)
+        parse_cache = open_parse_cache(cache, PARSE_CODE_PATHS)
         rules = load_config(workspace)
-        contents = load_locations(workspace, rules)
-        generated = build_rulesets(rules, contents)
-        summaries = publish_rulesets(workspace, rules, generated)
+        with tempfile.TemporaryDirectory(prefix="mosdns-sources-") as spool_dir:
+            contents = load_locations(workspace, rules, Path(spool_dir), cache, metrics)
+            client = shared_client()
+            client.close()
+            print(client.summary())
+            generated = build_rulesets(
+                rules, contents, manifest, workspace, args.jobs, metrics, parse_cache
+            )
+        unchanged = manifest.reused if manifest is not None else ()
+        check_budgets(
+            rules,
+            generated,
+            "id",
+            classify_mosdns_rule,
+            output_rule_counter(lambda path: workspace_path(workspace, path), read_output_rules),
+            unchanged
+        )
+        summaries = publish_rulesets(
+            workspace,
+            rules,
+            generated,
+            unchanged,
+            index,
+            Path(args.patch_dir) if args.patch_dir else None
+        )
+        print(index.summary())
         write_github_output(summaries)
+        if manifest is not None:
+            for rule in rules:
+                manifest.record_output(rule["path"], workspace_path(workspace, rule["path"]))
+            manifest.save()
+        if cache is not None:
+            cache.evict()
+            print(cache.summary())
+        if parse_cache is not None:
+            print(f"解析缓存: 淘汰 {parse_cache.evict()}")
+        metrics.write_github("MosDNS 规则构建指标")
     except Exception as error:
         print(f"错误: {error}", file=sys.stderr)
         return 1
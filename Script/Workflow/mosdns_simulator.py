@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MosDNS 规则匹配模拟
+1. 读取 RuleSet/Extra/MosDNS 下的规则列表，每个列表编译为独立的匹配器（域名后缀表与 CIDR 区间段）
+2. 按路由器配置的优先级顺序回放查询日志，每条查询由首个命中的列表处理，
+   日志每行为域名及其解析得到的 IP，以空白或逗号分隔
+3. 统计各列表的命中率与匹配吞吐，以及被更早的列表抢先命中的规则（被遮蔽）和从未命中的规则，
+   据此裁剪在路由器上占用内存与 CPU 却不起作用的列表
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from rule_emitters import classify_mosdns_rule
+from rule_lookup import RuleIndex, network_range, read_line_entries
+
+# 与路由器配置一致: 拦截优先，随后是 Apple、直连、国内、国外域名，最后按应答 IP 判断
+DEFAULT_ORDER = ("reject", "apple", "direct", "china", "foreign", "geoip")
+DEFAULT_TOP = 20
+
+Query = Tuple[str, List[Tuple[int, int, int]]]
+
+
+class ListMatcher:
+    """单个 MosDNS 规则列表的匹配器，返回首个命中规则的编号，未命中为 None。"""
+
+    def __init__(self, name: str, path: Path):
+        self.name = name
+        self.path = path
+        self.index = RuleIndex()
+        self.index.add_file(path.name, read_line_entries(path, classify_mosdns_rule))
+        self.index.finish()
+        self.seconds = 0.0
+
+    @property
+    def size(self) -> int:
+        return len(self.index.rules)
+
+    def match(self, domain: str, addresses: List[Tuple[int, int, int]]) -> Optional[int]:
+        """域名优先于应答 IP；同一列表内完整域名先于后缀，后缀越长越优先，IP 取最小的网段。"""
+        index = self.index
+        if domain:
+            found = index.first_domain(domain)
+            if found is not None:
+                return found
+        for version, start, end in addresses:
+            found = index.lookup_network(version, start, end)
+            if found:
+                return max(found, key=index.network_ends.__getitem__)
+        return None
+
+
+def parse_query(line: str) -> Optional[Query]:
+    """解析一行查询日志，首个非 IP 字段视为域名，可只有 IP。"""
+    domain = ""
+    addresses = []
+    for token in line.replace(',', ' ').split():
+        try:
+            addresses.append(network_range(token))
+        except ValueError:
+            if not domain:
+                domain = token.lower().rstrip('.')
+    if not domain and not addresses:
+        return None
+    return domain, addresses
+
+
+def read_queries(lines: Iterable[str]) -> Iterator[Query]:
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        query = parse_query(line)
+        if query is not None:
+            yield query
+
+
+class Simulation:
+    """
+    按顺序回放查询并累计统计
+    每条查询对全部列表求值: 首个命中的列表计为处理，其后命中的列表中的规则计为被遮蔽。
+    """
+
+    def __init__(self, matchers: List[ListMatcher]):
+        self.matchers = matchers
+        self.queries = 0
+        self.unmatched = 0
+        self.claimed: Dict[str, Counter] = {matcher.name: Counter() for matcher in matchers}
+        self.shadowed: Dict[str, Dict[int, Counter]] = {matcher.name: {} for matcher in matchers}
+
+    def replay(self, queries: Iterable[Query]) -> None:
+        clock = time.perf_counter
+        for domain, addresses in queries:
+            self.queries += 1
+            claimer = None
+            for matcher in self.matchers:
+                started = clock()
+                rule_id = matcher.match(domain, addresses)
+                matcher.seconds += clock() - started
+                if rule_id is None:
+                    continue
+                if claimer is None:
+                    claimer = matcher.name
+                    self.claimed[matcher.name][rule_id] += 1
+                else:
+                    self.shadowed[matcher.name].setdefault(rule_id, Counter())[claimer] += 1
+            if claimer is None:
+                self.unmatched += 1
+
+    def report(self, top: int = DEFAULT_TOP) -> Dict:
+        lists = []
+        total_seconds = 0.0
+        for matcher in self.matchers:
+            claimed = self.claimed[matcher.name]
+            shadowed = {
+                rule_id: shadowers
+                for rule_id, shadowers in self.shadowed[matcher.name].items()
+                if rule_id not in claimed
+            }
+            hits = sum(claimed.values())
+            total_seconds += matcher.seconds
+            lists.append({
+                "name": matcher.name,
+                "path": matcher.path.as_posix(),
+                "rules": matcher.size,
+                "hits": hits,
+                "hit_rate": round(hits / self.queries, 6) if self.queries else 0.0,
+                "rules_hit": len(claimed),
+                "rules_shadowed": len(shadowed),
+                "rules_unused": matcher.size - len(claimed) - len(shadowed),
+                "seconds": round(matcher.seconds, 6),
+                "queries_per_second": round(self.queries / matcher.seconds) if matcher.seconds else 0,
+                "shadowed": [
+                    {
+                        "rule": matcher.index.rules[rule_id],
+                        "queries": sum(shadowers.values()),
+                        "by": dict(shadowers.most_common()),
+                    }
+                    for rule_id, shadowers in sorted(
+                        shadowed.items(),
+                        key=lambda item: (-sum(item[1].values()), item[0])
+                    )[:top]
+                ],
+            })
+        return {
+            "queries": self.queries,
+            "unmatched": self.unmatched,
+            "seconds": round(total_seconds, 6),
+            "queries_per_second": round(self.queries / total_seconds) if total_seconds else 0,
+            "lists": lists,
+        }
+
+
+def render_report(report: Dict) -> str:
+    lines = [
+        f"查询 {report['queries']} 条，未命中 {report['unmatched']} 条，"
+        f"匹配总耗时 {report['seconds']:.3f} 秒（{report['queries_per_second']} 条/秒）",
+        "",
+        f"{'列表':<10}{'规则':>10}{'命中':>10}{'命中率':>10}{'命中规则':>10}{'被遮蔽':>10}{'未使用':>10}{'条/秒':>12}",
+    ]
+    for item in report["lists"]:
+        lines.append(
+            f"{item['name']:<10}{item['rules']:>10}{item['hits']:>10}{item['hit_rate']:>10.2%}"
+            f"{item['rules_hit']:>10}{item['rules_shadowed']:>10}{item['rules_unused']:>10}"
+            f"{item['queries_per_second']:>12}"
+        )
+    for item in report["lists"]:
+        if not item["shadowed"]:
+            continue
+        lines.extend(["", f"{item['name']} 被遮蔽的规则:"])
+        lines.extend(
+            f"  {shadowed['rule']}  {shadowed['queries']} 次，由 " +
+            ", ".join(f"{name}({count})" for name, count in shadowed["by"].items()) + " 先命中"
+            for shadowed in item["shadowed"]
+        )
+    return "\n".join(lines) + "\n"
+
+
+def load_matchers(directory: Path, order: List[str]) -> List[ListMatcher]:
+    matchers = []
+    for name in order:
+        path = directory / f"{name}.txt"
+        if not path.is_file():
+            raise FileNotFoundError(f"规则列表不存在: {path}")
+        matchers.append(ListMatcher(name, path))
+    return matchers
+
+
+def parse_order(value: str) -> List[str]:
+    order = [name.strip() for name in value.split(",") if name.strip()]
+    if not order or len(set(order)) != len(order):
+        raise argparse.ArgumentTypeError(f"无效的列表顺序: {value}")
+    return order
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="按路由器优先级回放查询日志，模拟 MosDNS 规则匹配")
+    parser.add_argument("log", nargs="?", default="", help="查询日志，每行为域名及其应答 IP，默认读取标准输入")
+    parser.add_argument(
+        "--order",
+        type=parse_order,
+        default=list(DEFAULT_ORDER),
+        help=f"逗号分隔的列表优先级，默认 {','.join(DEFAULT_ORDER)}"
+    )
+    parser.add_argument("--directory", default="", help="规则列表目录，默认工作区下的 RuleSet/Extra/MosDNS")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP, help="每个列表列出的被遮蔽规则条数")
+    parser.add_argument("--output", default="", help="JSON报告路径")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    workspace = Path(os.environ.get("GITHUB_WORKSPACE", Path.cwd())).resolve()
+    directory = Path(args.directory) if args.directory else workspace / "RuleSet/Extra/MosDNS"
+    try:
+        started = time.perf_counter()
+        matchers = load_matchers(directory, args.order)
+        print(
+            f"载入 {len(matchers)} 个列表，{sum(matcher.size for matcher in matchers)} 条规则，"
+            f"用时 {time.perf_counter() - started:.2f} 秒",
+            file=sys.stderr
+        )
+        simulation = Simulation(matchers)
+        if args.log:
+            with open(args.log, "r", encoding="utf-8") as file_handle:
+                simulation.replay(read_queries(file_handle))
+        else:
+            simulation.replay(read_queries(sys.stdin))
+        report = simulation.report(max(args.top, 0))
+        sys.stdout.write(render_report(report))
+        if args.output:
+            Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    except (OSError, ValueError) as error:
+        print(f"错误: {error}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
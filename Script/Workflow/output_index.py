@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+规则产物增量发布
+1. 每个产物在磁盘保存一份有序去重的规则索引，首行记录产物内容的 sha256
+2. 索引与产物不一致（缺失、手工修改、首次运行）时从产物重建
+3. 旧索引与新规则均为有序流，归并遍历一次得到新增与删除的规则
+4. 可选为每个变化的规则集写出 +/- 行格式的补丁文件
+"""
+
+import hashlib
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from fetch_cache import FetchCache, write_bytes_atomic
+from rule_source import file_digest, iter_mapped_text, split_text_lines
+
+INDEX_HEADER = "#sha256 "
+
+
+def unique_sorted(rules: Iterable[str]) -> Iterator[str]:
+    """对已排序序列去除相邻重复项。"""
+    previous = None
+    for rule in rules:
+        if rule != previous:
+            yield rule
+            previous = rule
+
+
+def diff_sorted(old_rules: Iterable[str], new_rules: Iterable[str]) -> Tuple[List[str], List[str]]:
+    """
+    归并遍历两个升序序列，返回 (新增规则, 删除规则)，两者均保持升序
+    输入中的重复项视为一条。
+    """
+    added = []
+    removed = []
+    old_iter = unique_sorted(old_rules)
+    new_iter = unique_sorted(new_rules)
+    old = next(old_iter, None)
+    new = next(new_iter, None)
+    while old is not None and new is not None:
+        if old == new:
+            old = next(old_iter, None)
+            new = next(new_iter, None)
+        elif old < new:
+            removed.append(old)
+            old = next(old_iter, None)
+        else:
+            added.append(new)
+            new = next(new_iter, None)
+    if old is not None:
+        removed.append(old)
+        removed.extend(old_iter)
+    if new is not None:
+        added.append(new)
+        added.extend(new_iter)
+    return added, removed
+
+
+class OutputIndex:
+    """
+    产物的有序规则索引，directory 为空时不持久化，每次从产物重建
+    索引文件名取产物相对路径的哈希，mosdns 与 proxy 可共用同一目录。
+    """
+
+    def __init__(self, directory: Optional[Path] = None):
+        self.directory = Path(directory) if directory else None
+        self.stats = {"reused": 0, "rebuilt": 0}
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, relative_path: str) -> Optional[Path]:
+        if self.directory is None:
+            return None
+        key = hashlib.sha256(relative_path.encode("utf-8")).hexdigest()[:32]
+        return self.directory / f"{key}.idx"
+
+    def previous(
+        self,
+        relative_path: str,
+        output_path: Path,
+        read_rules: Callable[[Path], Iterable[str]]
+    ) -> Tuple[str, Iterable[str]]:
+        """
+        返回 (产物 sha256, 旧规则升序序列)，产物不存在时为 ("", [])
+        索引首行的哈希与产物一致时流式读取索引，否则用 read_rules 解析产物后排序。
+        """
+        if not output_path.is_file():
+            return "", []
+        digest, _ = file_digest(output_path)
+        index_path = self._path(relative_path)
+        if index_path is not None and index_path.is_file():
+            lines = split_text_lines(iter_mapped_text(index_path))
+            if next(lines, "") == INDEX_HEADER + digest:
+                self.stats["reused"] += 1
+                return digest, lines
+            lines.close()
+        self.stats["rebuilt"] += 1
+        return digest, sorted(read_rules(output_path))
+
+    def save(self, relative_path: str, digest: str, ordered_rules: Iterable[str]) -> None:
+        """保存产物内容哈希为 digest 时的有序规则，索引已对应该哈希时跳过。"""
+        index_path = self._path(relative_path)
+        if index_path is None:
+            return
+        if index_path.is_file():
+            with open(index_path, "r", encoding="utf-8") as file_handle:
+                if file_handle.readline().rstrip("\n") == INDEX_HEADER + digest:
+                    return
+        lines = [INDEX_HEADER + digest]
+        lines.extend(unique_sorted(ordered_rules))
+        write_bytes_atomic(index_path, ("\n".join(lines) + "\n").encode("utf-8"))
+
+    def summary(self) -> str:
+        return f"产物索引: 复用 {self.stats['reused']}, 重建 {self.stats['rebuilt']}"
+
+
+def render_patch(
+    relative_path: str,
+    base_digest: str,
+    target_digest: str,
+    added: List[str],
+    removed: List[str]
+) -> str:
+    """
+    补丁格式: 三行头部后先列删除（-规则）再列新增（+规则）
+    base 为空表示产物此前不存在，下游仅在本地产物哈希等于 base 时应用补丁。
+    """
+    lines = [
+        f"#path {relative_path}",
+        f"#base {base_digest}",
+        f"#target {target_digest}",
+    ]
+    lines.extend(f"-{rule}" for rule in removed)
+    lines.extend(f"+{rule}" for rule in added)
+    return "\n".join(lines) + "\n"
+
+
+def content_digest(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def open_index(directory: str, cache: Optional[FetchCache]) -> OutputIndex:
+    """未指定目录时放在下载缓存的 indexes 子目录，两者都没有则不持久化。"""
+    if not directory and cache is not None:
+        directory = cache.directory / "indexes"
+    return OutputIndex(Path(directory) if directory else None)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+来源解析缓存
+1. 以 (来源内容 sha256, 来源格式, 转换代码版本) 为键保存转换后去重排序的规则
+2. 条目为文本: 首行JSON元数据（条数与逐来源计数），其后每行一条规则，尾部不留空行
+3. 命中时直接回放规则与计数，跳过逐行读取与转换；写入采用临时文件原子替换，子进程可并发读写
+4. 命中会刷新文件修改时间，淘汰按修改时间从旧到新删除直至总体积不超过上限
+5. convert_source_file 供进程池按来源并行转换，结果为有序去重的规则列表，写入缓存时逐条写出，不另行拼接
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from build_manifest import code_digest
+from build_metrics import source_record
+from fetch_cache import FetchCache
+from rule_source import SourceFile
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+ENTRY_SUFFIX = ".rules"
+
+
+class ParseCache:
+    """可直接传给子进程，只保存目录、版本与上限。"""
+
+    def __init__(self, directory: Path, version: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        if max_bytes <= 0:
+            raise ValueError("解析缓存上限必须是正整数")
+        self.directory = Path(directory)
+        self.version = version
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, source: SourceFile, rule_format: str) -> Path:
+        key = hashlib.sha256(
+            f"{source.sha256}\0{rule_format}\0{self.version}".encode("utf-8")
+        ).hexdigest()[:32]
+        return self.directory / f"{key}{ENTRY_SUFFIX}"
+
+    def load(self, source: SourceFile, rule_format: str) -> Optional[Tuple[Dict[str, int], List[str]]]:
+        """返回 (计数, 规则列表)，未命中或条目损坏时返回 None（损坏条目顺带删除）。"""
+        path = self._path(source, rule_format)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+        header, _, body = data.partition(b"\n")
+        try:
+            meta = json.loads(header)
+            rules = body.decode("utf-8").split("\n") if body else []
+            if meta.get("sha256") != source.sha256 or meta.get("count") != len(rules):
+                raise ValueError("条目与来源不一致")
+        except ValueError:
+            path.unlink(missing_ok=True)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return meta["counts"], rules
+
+    def store(
+        self,
+        source: SourceFile,
+        rule_format: str,
+        rules: List[str],
+        counts: Dict[str, int]
+    ) -> None:
+        """rules 须已去重排序。"""
+        path = self._path(source, rule_format)
+        meta = {"sha256": source.sha256, "format": rule_format, "count": len(rules), "counts": counts}
+        descriptor, temporary_name = tempfile.mkstemp(dir=self.directory, prefix=f".{path.name}.")
+        temporary_path = Path(temporary_name)
+        try:
+            with os.fdopen(descriptor, "w", encoding="utf-8") as file_handle:
+                file_handle.write(json.dumps(meta, ensure_ascii=False, sort_keys=True))
+                file_handle.writelines(map("\n".__add__, rules))
+            os.replace(temporary_path, path)
+        finally:
+            temporary_path.unlink(missing_ok=True)
+
+    def evict(self) -> int:
+        """按修改时间淘汰最旧的条目直至总体积不超过上限，返回淘汰条数。"""
+        entries = []
+        for path in self.directory.glob(f"*{ENTRY_SUFFIX}"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path.name, stat.st_size, path))
+        total = sum(size for _, _, size, _ in entries)
+        evicted = 0
+        for _, _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            evicted += 1
+        return evicted
+
+
+@dataclass(frozen=True)
+class ConvertedSource:
+    """单个来源的转换结果，在子进程与主进程之间传递，rules 为去重排序后的规则。"""
+
+    record: Dict
+    rules: List[str]
+
+
+def convert_source_file(
+    cache: Optional[ParseCache],
+    source: SourceFile,
+    rule_format: str,
+    keys: Tuple[str, ...],
+    parse: Callable[[Dict], Iterator[str]]
+) -> ConvertedSource:
+    """
+    转换单个来源，可在子进程中执行，parse(record) 逐条产出规则并累加 record 中 keys 对应的计数
+    结果去重后排序，与进程调度顺序及各进程的哈希种子无关；
+    来源内的重复条数累加到 record["deduplicated"]，命中缓存时同样计入并把 record["cached"] 置为 True。
+    未命中时转换结果在完整读完后写入缓存，去重集合只保留一份，排序后即释放。
+    """
+    with source_record(source.location) as record:
+        for key in keys:
+            record.setdefault(key, 0)
+        record["deduplicated"] = 0
+        cached = cache.load(source, rule_format) if cache is not None else None
+        if cached is not None:
+            counts, rules = cached
+            for key in keys:
+                record[key] += counts.get(key, 0)
+            record["cached"] = True
+            record["deduplicated"] += counts.get("rules", len(rules)) - len(rules)
+            return ConvertedSource(record, rules)
+
+        seen = set()
+        count = 0
+        for rule in parse(record):
+            seen.add(rule)
+            count += 1
+        rules = list(seen)
+        del seen
+        rules.sort()
+        record["deduplicated"] += count - len(rules)
+        if cache is not None:
+            cache.store(source, rule_format, rules, {key: record[key] for key in keys})
+    return ConvertedSource(record, rules)
+
+
+def open_parse_cache(cache: Optional[FetchCache], code_paths: Iterable[Path]) -> Optional[ParseCache]:
+    """放在下载缓存的 parsed 子目录，版本取转换代码摘要；未启用下载缓存时不缓存。"""
+    if cache is None:
+        return None
+    return ParseCache(cache.directory / "parsed", code_digest(code_paths))
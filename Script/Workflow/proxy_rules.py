@@ -4,74 +4,108 @@
 代理规则处理脚本
 功能:
 1. 按配置聚合本地与远程的 Surge domain-set 规则来源
-2. 规范化并校验域名规则，剔除非法条目
+2. 规范化并校验域名规则，剔除非法条目，纯 ASCII 来源按整行对齐的字节块批量解析
 3. 泛域名互相覆盖去重，并裁剪被泛域名覆盖的精确域名
 4. 集合差分判定变更后原子写入产物
 """
 
+import argparse
 import json
 import os
 import re
 import sys
 import tempfile
 import time
-import urllib.error
-import urllib.request
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from itertools import compress, islice
+from operator import not_
 from pathlib import Path
-from typing import Dict, Iterable, List, Set, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from domain_trie import EXACT, EXACT_COVERED, WILDCARD, WILDCARD_COVERED, DomainTrie
+from build_manifest import BuildManifest, code_digest
+from build_metrics import BuildMetrics, RuleMetrics, count_items
+from fetch_cache import DEFAULT_MAX_BYTES, FetchCache, fetch_source, open_cache
+from http_pool import shared_client
+from output_index import OutputIndex, content_digest, diff_sorted, open_index, render_patch
+from parse_cache import ConvertedSource, ParseCache, convert_source_file, open_parse_cache
+from rule_budget import check_budgets, output_rule_counter, validate_budget
+from rule_emitters import classify_surge_rule, emit_formats, validate_outputs
+from rule_scheduler import default_workers, dependency_graph, input_graph, run_graph
+from rule_source import SourceFile, iter_mapped_blocks, local_source, read_rule_lines
 
 DOMAIN_PATTERN = re.compile(r'^[a-zA-Z0-9.-]+$')
+# 可带泛域名前导点的完整域名: 总长 1-253，各标签 1-63 且首尾不为连字符
+DOMAIN_RULE_PATTERN = re.compile(
+    r'\.?(?=[a-zA-Z0-9.-]{1,253}\Z)'
+    r'(?:[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?\.)*'
+    r'[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?'
+)
+INVALID_REASONS = ("empty", "length", "characters", "label")
+INVALID_KEYS = tuple(f"invalid_{reason}" for reason in INVALID_REASONS)
+# 解析缓存中的来源格式名
+SOURCE_FORMAT = "domain_set"
 GITHUB_RAW_PATTERN = re.compile(r'^https?://raw\.githubusercontent\.com/([^/]+/[^/]+)/')
 INLINE_COMMENT_PATTERN = re.compile(r'\s+[#!;].*$')
+# 字节块快速解析: 与 clean_rule_lines + 小写 + 校验逐行处理的结果一致
+DOMAIN_RULE_BYTES_PATTERN = re.compile(DOMAIN_RULE_PATTERN.pattern.encode("ascii"))
+# 含域名字符以外字符（空白、注释符、逗号等）的行按文本规则逐行处理，其余行去掉空行后即为候选规则
+SPECIAL_CHAR_PATTERN = re.compile(rb'[^a-zA-Z0-9.\n-]')
+PLAIN_BYTES = b'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789.\n-'
+# str.splitlines 与 str.strip 另外认可的 ASCII 换行与空白，出现时整块按文本处理
+TEXT_ONLY_BYTES = b'\x0b\x0c\x1c\x1d\x1e\x1f'
+NEWLINE_TO_DOT = bytes.maketrans(b'\n', b'.')
+# 不超过该长度的规则无需再检查标签与总长
+SHORT_RULE_LENGTH = 63
 REPO_HOMEPAGE = "https://github.com/vitoegg/Provider"
 CONFIG_RELATIVE_PATH = "Script/Workflow/proxy_config.json"
-DOWNLOAD_ATTEMPTS = 3
-DOWNLOAD_TIMEOUT = 30
-MAX_WORKERS = 8
-
-WILDCARD_KIND = "wildcard"
-EXACT_KIND = "exact"
+# 每主机并发由共享连接池限制，线程数只决定同时处理的来源数
+MAX_WORKERS = 16
+CODE_PATHS = (
+    Path(__file__),
+    Path(__file__).with_name("domain_trie.py"),
+    Path(__file__).with_name("rule_source.py"),
+)
+# 解析缓存的版本只取决于逐行转换代码
+PARSE_CODE_PATHS = (
+    Path(__file__),
+    Path(__file__).with_name("rule_source.py"),
+)
+# 规则分批写入前缀树，流式转换时只缓冲一批
+ADD_BATCH_SIZE = 65536
+# 来源按批校验，一批内的小写与正则匹配各只调用一次
+VALIDATE_BATCH_SIZE = 4096
+
+
+def invalid_reason(rule: str) -> str:
+    """归类未通过校验的规则，只对少数无效条目调用。"""
+    domain = rule[1:] if rule.startswith('.') else rule
+    if not domain:
+        return "empty"
+    if len(domain) > 253:
+        return "length"
+    if not DOMAIN_PATTERN.match(domain):
+        return "characters"
+    return "label"
 
 
-def is_valid_domain(domain: str) -> bool:
-    """校验域名是否合法（不含前导点）。"""
-    if not domain or len(domain) > 253:
-        return False
-    if not DOMAIN_PATTERN.match(domain):
-        return False
-    if domain.startswith('.') or domain.endswith('.') or '..' in domain:
-        return False
-    for part in domain.split('.'):
-        if not part or len(part) > 63:
-            return False
-        if part.startswith('-') or part.endswith('-'):
-            return False
-    return True
-
-
-def convert_domain_set_rule(line: str) -> Tuple[str, str]:
+def validate_domain_rules(rules: Sequence[str]) -> Tuple[List[bool], Dict[str, int]]:
     """
-    解析 Surge domain-set 规则
-    .example.com -> 泛域名, example.com -> 精确域名
-    返回: (规则, 类型) 类型为 wildcard / exact / invalid
+    批量校验 Surge domain-set 规则，前导点表示泛域名且不计入长度
+    整批只调用一次编译好的完整域名正则，逐条循环在 C 中完成；
+    返回: (保留掩码, 各无效原因的条数)
     """
-    rule = line.strip().lower()
+    kept = list(map(bool, map(DOMAIN_RULE_PATTERN.fullmatch, rules)))
+    reasons = dict.fromkeys(INVALID_REASONS, 0)
+    for rule in compress(rules, map(not_, kept)):
+        reasons[invalid_reason(rule)] += 1
+    return kept, reasons
 
-    if rule.startswith('.'):
-        if is_valid_domain(rule[1:]):
-            return rule, WILDCARD_KIND
-        return "", "invalid"
 
-    if is_valid_domain(rule):
-        return rule, EXACT_KIND
-    return "", "invalid"
-
-
-def clean_rule_lines(content: str) -> Iterable[str]:
+def clean_rule_lines(lines: Iterable[str]) -> Iterator[str]:
     """剔除注释、空行与非规则行，并去掉行尾行内注释。"""
-    for raw_line in content.splitlines():
+    for raw_line in lines:
         line = raw_line.strip()
         if (
             not line or
@@ -85,77 +119,159 @@ def clean_rule_lines(content: str) -> Iterable[str]:
             yield line
 
 
-def convert_source(content: str, label: str) -> Tuple[List[str], int]:
-    """将单个来源转换为规则列表，返回 (规则列表, 无效条数)。"""
-    rules = []
-    invalid_count = 0
+def count_invalid(reasons: Dict[str, int], counters: Dict[str, int]) -> None:
+    for reason, count in reasons.items():
+        counters["invalid"] += count
+        counters[f"invalid_{reason}"] = counters.get(f"invalid_{reason}", 0) + count
+
+
+def convert_lines(lines: Iterable[str], counters: Dict[str, int]) -> Iterator[str]:
+    """分批转换文本行，整批小写后批量校验，无效条数累加到 counters。"""
+    lines = clean_rule_lines(lines)
+    while True:
+        batch = list(islice(lines, VALIDATE_BATCH_SIZE))
+        if not batch:
+            break
+        # 行内不含换行符，整批拼接后一次小写
+        rules = "\n".join(batch).lower().split("\n")
+        kept, reasons = validate_domain_rules(rules)
+        count_invalid(reasons, counters)
+        yield from compress(rules, kept)
+
+
+def split_special_lines(block: bytes) -> Tuple[bytes, List[bytes]]:
+    """返回 (普通行拼成的字节串, 特殊行列表)，特殊行通常只有注释与少量无效行，逐个定位后整行取出。"""
+    if not block.translate(None, PLAIN_BYTES):
+        return block, []
+    plain = []
+    special = []
+    position = 0
+    search = SPECIAL_CHAR_PATTERN.search
+    match = search(block)
+    while match:
+        start = block.rfind(b"\n", 0, match.start()) + 1
+        end = block.find(b"\n", match.end())
+        if end < 0:
+            end = len(block)
+        plain.append(block[position:start])
+        special.append(block[start:end])
+        position = end + 1
+        match = search(block, position)
+    plain.append(block[position:])
+    return b"".join(plain), special
+
+
+def validate_plain_rules(rules: List[bytes]) -> Optional[List[bool]]:
+    """
+    校验只含域名字符的小写规则，全部有效时返回 None，否则返回保留掩码
+    标签边界（空标签、首尾连字符）对整批拼接后的字节串检查，
+    只有超过 SHORT_RULE_LENGTH 的规则需单独用正则核对长度。
+    """
+    joined = b"\n" + b"\n".join(rules)
+    labels = joined.replace(b"\n.", b"\n").translate(NEWLINE_TO_DOT) + b"."
+    if b".." in labels or b"-." in labels or b".-" in labels:
+        return list(map(bool, map(DOMAIN_RULE_BYTES_PATTERN.fullmatch, rules)))
+    if max(map(len, rules)) <= SHORT_RULE_LENGTH:
+        return None
+    kept = [True] * len(rules)
+    fullmatch = DOMAIN_RULE_BYTES_PATTERN.fullmatch
+    for position, length in enumerate(map(len, rules)):
+        if length > SHORT_RULE_LENGTH and not fullmatch(rules[position]):
+            kept[position] = False
+    return kept
+
+
+def convert_block(block: bytes, counters: Dict[str, int]) -> List[str]:
+    """
+    转换一个以整行结尾的原始字节块，行数累加到 counters["lines"]，块内规则顺序不保证与原文一致
+    纯 ASCII 块中只有含特殊字符的行逐行按文本处理，其余行的小写与校验均为整块操作；
+    含非 ASCII、其他换行符或单独 \\r 的块解码后全部按文本处理。
+    """
+    if (
+        not block.isascii() or
+        len(block.translate(None, TEXT_ONLY_BYTES)) != len(block) or
+        (b"\r" in block and block.count(b"\r") != block.count(b"\r\n"))
+    ):
+        lines = block.decode("utf-8").splitlines()
+        counters["lines"] += len(lines)
+        return list(convert_lines(lines, counters))
+
+    counters["lines"] += block.count(b"\n") + (not block.endswith(b"\n"))
+    if b"\r" in block:
+        block = block.replace(b"\r\n", b"\n")
+    plain, special = split_special_lines(block)
+    rules = list(filter(None, plain.lower().split(b"\n")))
+    converted = []
+    if rules:
+        kept = validate_plain_rules(rules)
+        reasons = dict.fromkeys(INVALID_REASONS, 0)
+        if kept is not None:
+            for rule in compress(rules, map(not_, kept)):
+                reasons[invalid_reason(rule.decode("ascii"))] += 1
+            rules = list(compress(rules, kept))
+        count_invalid(reasons, counters)
+        if rules:
+            converted = b"\n".join(rules).decode("ascii").split("\n")
+    if special:
+        converted.extend(convert_lines(b"\n".join(special).decode("ascii").split("\n"), counters))
+    return converted
+
+
+def convert_source_blocks(blocks: Iterable[bytes], label: str, counters: Dict[str, int]) -> Iterator[str]:
+    """按字节块转换单个来源，结果与 convert_lines 逐行转换一致，未产出规则时失败。"""
+    found = False
+    for block in blocks:
+        rules = convert_block(block, counters)
+        if rules:
+            found = True
+            yield from rules
+    if not found:
+        raise ValueError(f"来源未产生有效规则: {label}")
 
-    for line in clean_rule_lines(content):
-        rule, kind = convert_domain_set_rule(line)
-        if kind == "invalid":
-            invalid_count += 1
-            continue
-        rules.append(rule)
 
-    if not rules:
-        raise ValueError(f"来源未产生有效规则: {label}")
-    return rules, invalid_count
+def parse_location(source: SourceFile, label: str, record: Dict) -> Iterator[str]:
+    """读取并转换单个来源，行数、规则条数与无效条数累加到 record。"""
+    return count_items(convert_source_blocks(iter_mapped_blocks(source.path), label, record), record, "rules")
 
 
-def optimize_domains(rules: List[str]) -> Tuple[List[str], Dict[str, int]]:
+def optimize_domains(rules: Iterable[str]) -> Tuple[List[str], Dict[str, int]]:
     """
     去重并裁剪被覆盖的规则:
     1. 完全相同的规则去重
     2. 泛域名被更短的泛域名覆盖则丢弃
     3. 精确域名被泛域名的父域覆盖则丢弃
+    规则分批写入前缀树，可直接消费流式转换结果
     """
     stats = {
-        "total": len(rules),
+        "total": 0,
         "duplicates": 0,
         "wildcard_covered": 0,
         "exact_covered": 0,
         "kept": 0,
     }
 
-    seen: Set[str] = set()
-    wildcards: List[str] = []
-    exacts: List[str] = []
-
-    for rule in rules:
-        if rule in seen:
-            stats["duplicates"] += 1
-            continue
-        seen.add(rule)
-        if rule.startswith('.'):
-            wildcards.append(rule[1:])
-        else:
-            exacts.append(rule)
-
-    kept_wildcard_domains: Set[str] = set()
-    kept_wildcards: List[str] = []
-    for domain in sorted(wildcards, key=lambda item: (item.count('.'), item)):
-        parts = domain.split('.')
-        if any(
-            '.'.join(parts[index:]) in kept_wildcard_domains
-            for index in range(1, len(parts))
-        ):
-            stats["wildcard_covered"] += 1
-            continue
-        kept_wildcard_domains.add(domain)
-        kept_wildcards.append(f".{domain}")
-
-    kept_exacts: List[str] = []
-    for domain in exacts:
-        parts = domain.split('.')
-        if any(
-            '.'.join(parts[index:]) in kept_wildcard_domains
-            for index in range(1, len(parts))
-        ):
-            stats["exact_covered"] += 1
-            continue
-        kept_exacts.append(domain)
-
-    final_rules = sorted(kept_wildcards + kept_exacts)
+    trie = DomainTrie()
+    rules = iter(rules)
+    while True:
+        batch = list(islice(rules, ADD_BATCH_SIZE))
+        if not batch:
+            break
+        stats["total"] += len(batch)
+        stats["duplicates"] += trie.add_many(
+            (rule[1:] for rule in batch if rule.startswith('.')),
+            WILDCARD
+        )
+        stats["duplicates"] += trie.add_many(
+            (rule for rule in batch if not rule.startswith('.')),
+            EXACT
+        )
+    wildcards, exacts, counts = trie.prune(wildcard_covers_exact=False)
+    stats["wildcard_covered"] = counts[WILDCARD_COVERED]
+    stats["exact_covered"] = counts[EXACT_COVERED]
+    # 来源与引用的产物均为升序，前缀树按插入顺序返回，拼接后只有少量升序段；
+    # 仍整体排序一次，list.sort 会识别已有的升序段，实测比 heapq.merge 逐条归并更快
+    kept_rules = [f".{domain}" for domain in wildcards] + exacts
+    final_rules = sorted(kept_rules)
     stats["kept"] = len(final_rules)
     return final_rules, stats
 
@@ -181,38 +297,32 @@ def workspace_path(workspace: Path, relative_path: str) -> Path:
     return path
 
 
-def download(location: str) -> str:
-    """带重试的远程下载。"""
-    last_error = None
-    for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
-        try:
-            request = urllib.request.Request(
-                location,
-                headers={"User-Agent": "Provider-Proxy-Workflow"}
-            )
-            with urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT) as response:
-                data = response.read()
-            if not data:
-                raise ValueError("下载内容为空")
-            return data.decode("utf-8")
-        except (urllib.error.URLError, OSError, ValueError) as error:
-            last_error = error
-            if attempt < DOWNLOAD_ATTEMPTS:
-                time.sleep(attempt * 2)
-    raise RuntimeError(f"下载失败({DOWNLOAD_ATTEMPTS} 次): {location} -> {last_error}")
-
-
-def read_location(workspace: Path, location: str) -> str:
-    if is_remote(location):
-        return download(location)
+def download(
+    location: str,
+    spool_dir: Path,
+    cache: Optional[FetchCache] = None
+) -> SourceFile:
+    """
+    远程下载，响应写入缓存或 spool_dir，提供缓存时走条件请求
+    keep-alive 复用、每主机并发限制与失败重试由共享连接池负责。
+    """
+    return fetch_source(
+        location,
+        {"User-Agent": "Provider-Proxy-Workflow"},
+        spool_dir,
+        cache
+    )
 
-    path = workspace_path(workspace, location)
-    if not path.is_file():
-        raise FileNotFoundError(f"本地来源不存在: {location}")
-    content = path.read_text(encoding="utf-8")
-    if not content:
-        raise ValueError(f"本地来源为空: {location}")
-    return content
+
+def read_location(
+    workspace: Path,
+    location: str,
+    spool_dir: Path,
+    cache: Optional[FetchCache] = None
+) -> SourceFile:
+    if is_remote(location):
+        return download(location, spool_dir, cache)
+    return local_source(workspace_path(workspace, location), location)
 
 
 def load_config(workspace: Path) -> List[Dict]:
@@ -241,10 +351,21 @@ def load_config(workspace: Path) -> List[Dict]:
             raise ValueError(f"规则 {name} 的 sources 无效")
         seen_names.add(name)
         seen_paths.add(output_path)
+        validate_budget(rule, name)
+        for path in validate_outputs(rule.get("outputs", {}), name):
+            if path in seen_paths:
+                raise ValueError(f"规则 {name} 的输出路径重复: {path}")
+            seen_paths.add(path)
     return rules
 
 
-def load_locations(workspace: Path, rules: List[Dict]) -> Dict[str, str]:
+def load_locations(
+    workspace: Path,
+    rules: List[Dict],
+    spool_dir: Path,
+    cache: Optional[FetchCache] = None,
+    metrics: Optional[BuildMetrics] = None
+) -> Dict[str, SourceFile]:
     """并发读取所有非产物来源，任一失败即整体失败。"""
     output_paths = {rule["path"] for rule in rules}
     locations = sorted({
@@ -253,64 +374,239 @@ def load_locations(workspace: Path, rules: List[Dict]) -> Dict[str, str]:
         for source in rule["sources"]
         if source not in output_paths
     })
+
+    def load(location: str) -> SourceFile:
+        started = time.perf_counter()
+        source = read_location(workspace, location, spool_dir, cache)
+        if metrics is not None:
+            metrics.record_fetch(
+                location, time.perf_counter() - started, source.size, source.wire_bytes
+            )
+        return source
+
     with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(locations))) as executor:
-        contents = executor.map(
-            lambda location: read_location(workspace, location),
-            locations
-        )
+        contents = executor.map(load, locations)
         return dict(zip(locations, contents))
 
 
-def build_rulesets(rules: List[Dict], contents: Dict[str, str]) -> Dict[str, List[str]]:
-    """按配置顺序生成规则集，后续规则可直接引用先前生成的产物。"""
-    output_paths = {rule["path"] for rule in rules}
-    generated: Dict[str, List[str]] = {}
+def rule_input_digests(
+    rule: Dict,
+    source_digests: Dict[str, str],
+    generated_digests: Dict[str, str]
+) -> Dict[str, str]:
+    """收集规则集全部来源的摘要，引用的产物取其生成结果摘要。"""
+    digests = {}
+    for source in rule["sources"]:
+        if source in generated_digests:
+            digests[source] = generated_digests[source]
+        else:
+            digests[source] = source_digests[source]
+    return digests
+
+
+def source_node(location: str) -> str:
+    """来源转换任务在依赖图中的节点名，与产物路径互不冲突。"""
+    return f"{SOURCE_FORMAT}:{location}"
+
+
+def convert_location(
+    source: SourceFile,
+    label: str,
+    parse_cache: Optional[ParseCache] = None
+) -> ConvertedSource:
+    """转换单个来源，可在子进程中执行，提供 parse_cache 时内容未变的来源直接回放缓存的转换结果。"""
+    return convert_source_file(
+        parse_cache,
+        source,
+        SOURCE_FORMAT,
+        ("lines", "rules", "invalid") + INVALID_KEYS,
+        lambda record: parse_location(source, label, record)
+    )
 
-    for rule in rules:
-        name = rule["name"]
-        collected: List[str] = []
-        invalid_total = 0
 
+def build_ruleset(
+    rule: Dict,
+    converted: Dict[str, ConvertedSource],
+    dependencies: Dict[str, List[str]],
+    trace_memory: bool = False
+) -> Tuple[List[str], Dict[str, int], int, Dict]:
+    """
+    生成单个规则集，可在子进程中执行
+    converted 为本规则外部来源的转换结果（按 source_node 索引），dependencies 为引用的已生成产物；
+    来源按配置顺序依次解码后写入前缀树
+    返回: (最终规则, 优化统计, 无效条数, 构建指标)
+    """
+    metrics = RuleMetrics(trace_memory)
+    name = rule["name"]
+    counters = {"invalid": 0, "deduplicated": 0}
+
+    def collected() -> Iterator[str]:
         for source in rule["sources"]:
-            if source in output_paths:
-                if source not in generated:
-                    raise ValueError(f"规则 {name} 的依赖尚未生成: {source}")
-                collected.extend(generated[source])
+            if source in dependencies:
+                yield from dependencies[source]
                 continue
-            source_rules, invalid_count = convert_source(
-                contents[source],
-                f"{name}:{source}"
-            )
-            collected.extend(source_rules)
-            invalid_total += invalid_count
-
-        final_rules, stats = optimize_domains(collected)
-        if not final_rules:
-            raise ValueError(f"规则 {name} 的最终产物为空")
+            result = converted[source_node(source)]
+            metrics.add_source(result.record)
+            counters["invalid"] += result.record["invalid"]
+            counters["deduplicated"] += result.record["deduplicated"]
+            yield from result.rules
+        metrics.lap("parse")
+
+    final_rules, stats = optimize_domains(collected())
+    # 转换结果是来源内已去重的规则，补回这部分重复条数，统计与逐条写入时一致
+    stats["total"] += counters["deduplicated"]
+    stats["duplicates"] += counters["deduplicated"]
+    metrics.lap("optimize")
+    if not final_rules:
+        raise ValueError(f"规则 {name} 的最终产物为空")
+    return final_rules, stats, counters["invalid"], metrics.result()
+
+
+def build_rulesets(
+    rules: List[Dict],
+    contents: Dict[str, SourceFile],
+    manifest: Optional[BuildManifest] = None,
+    workspace: Optional[Path] = None,
+    max_workers: int = 1,
+    metrics: Optional[BuildMetrics] = None,
+    parse_cache: Optional[ParseCache] = None
+) -> Dict[str, List[str]]:
+    """
+    按产物引用形成的依赖图调度构建，规则可直接引用其他规则的产物
+    外部来源的转换按 (来源, 规则集) 调度，与互不依赖的规则集一起在进程池中并行执行；
+    转换只依赖该规则集引用的产物，届时已能判断它是否复用，复用时跳过；被多个规则集引用的来源只转换一次。
+    """
+    rules_by_path = {rule["path"]: rule for rule in rules}
+    source_locations: Dict[str, str] = {}
+    rule_sources: Dict[str, List[str]] = {}
+    for path, rule in rules_by_path.items():
+        rule_sources[path] = []
+        for location in rule["sources"]:
+            if location in rules_by_path:
+                continue
+            node = source_node(location)
+            source_locations[node] = location
+            if node not in rule_sources[path]:
+                rule_sources[path].append(node)
 
-        generated[rule["path"]] = final_rules
+    rule_dependencies = dependency_graph(rules_by_path, lambda path: rules_by_path[path]["sources"])
+    graph, tasks, consumers = input_graph(rule_dependencies, rule_sources)
+    generated: Dict[str, List[str]] = {}
+    generated_digests: Dict[str, str] = {}
+    input_digests: Dict[str, str] = {}
+    reused: Dict[str, bool] = {}
+    converted: Dict[str, ConvertedSource] = {}
+    pending = {node: len(paths) for node, paths in consumers.items()}
+    source_digests = {location: source.sha256 for location, source in contents.items()}
+
+    def reuse(path: str) -> bool:
+        """判断规则集能否复用上次产物，每个规则集只判断一次，需在其引用的产物完成后调用。"""
+        if path in reused:
+            return reused[path]
+        reused[path] = False
+        rule = rules_by_path[path]
+        if manifest is not None:
+            inputs = manifest.input_digest(
+                rule,
+                rule_input_digests(rule, source_digests, generated_digests)
+            )
+            reused_rules = manifest.reuse(
+                path,
+                inputs,
+                workspace_path(workspace, path),
+                read_output_rules
+            )
+            if reused_rules is not None:
+                generated[path] = reused_rules
+                generated_digests[path] = manifest.rules_digest_of(path)
+                print(f"{rule['name']}: 输入未变化，复用 {len(reused_rules)} 条")
+                if metrics is not None:
+                    metrics.record_rule(rule["name"], path, len(reused_rules))
+                reused[path] = True
+            else:
+                input_digests[path] = inputs
+        return reused[path]
+
+    def prepare(node: str):
+        if node in tasks:
+            source, path = tasks[node]
+            if source in converted or reuse(path):
+                return None
+            location = source_locations[source]
+            label = f"{rules_by_path[path]['name']}:{location}"
+            return convert_location, (contents[location], label, parse_cache)
+
+        path = node
+        rule = rules_by_path[path]
+        job = None
+        if not reuse(path):
+            job = build_ruleset, (
+                rule,
+                {source: converted[source] for source in rule_sources[path]},
+                {dependency: generated[dependency] for dependency in rule_dependencies[path]},
+                metrics is not None and metrics.trace_memory
+            )
+        # 任务参数已持有转换结果，最后一个使用者取走后即可释放
+        for source in rule_sources[path]:
+            pending[source] -= 1
+            if not pending[source]:
+                converted.pop(source, None)
+        return job
+
+    def finish(node: str, result) -> None:
+        if node in tasks:
+            converted[tasks[node][0]] = result
+            return
+        path = node
+        final_rules, stats, invalid_total, rule_metrics = result
+        generated[path] = final_rules
+        if manifest is not None:
+            generated_digests[path] = manifest.record(path, input_digests[path], final_rules)
         print(
-            f"{name}: {stats['total']} -> {stats['kept']} 条 "
+            f"{rules_by_path[path]['name']}: {stats['total']} -> {stats['kept']} 条 "
             f"(重复 {stats['duplicates']}, 泛域名覆盖 {stats['wildcard_covered']}, "
             f"精确域名覆盖 {stats['exact_covered']}, 无效 {invalid_total})"
         )
+        if metrics is not None:
+            metrics.record_rule(rules_by_path[path]["name"], path, len(final_rules), rule_metrics)
 
-    return generated
+    run_graph(graph, prepare, finish, max_workers)
+    return {path: generated[path] for path in rules_by_path}
 
 
-def render_ruleset(rule: Dict, final_rules: List[str]) -> str:
-    """生成含头部注释的产物内容。"""
+def ruleset_header(rule: Dict, final_rules: List[str]) -> List[str]:
+    """产物头部注释内容（不含注释符号），各输出格式共用。"""
     lines = [
-        f"# 更新时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-        f"# 规则条数: {len(final_rules)}",
-        "# 规则来源:",
+        f"更新时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        f"规则条数: {len(final_rules)}",
+        "规则来源:",
     ]
-    lines.extend(f"# - {source_display(source)}" for source in rule["sources"])
+    lines.extend(f"- {source_display(source)}" for source in rule["sources"])
+    return lines
+
+
+def render_ruleset(rule: Dict, final_rules: List[str]) -> str:
+    """生成含头部注释的产物内容。"""
+    lines = [f"# {line}" for line in ruleset_header(rule, final_rules)]
     lines.append("")
     lines.extend(final_rules)
     return "\n".join(lines) + "\n"
 
 
+def publish_formats(workspace: Path, rule: Dict, final_rules: List[str], refresh: bool) -> None:
+    """按 outputs 配置一次遍历写出其他格式，规则变化或有目标缺失时才重写。"""
+    targets = {
+        output_format: workspace_path(workspace, path)
+        for output_format, path in rule.get("outputs", {}).items()
+    }
+    if not targets or (not refresh and all(path.is_file() for path in targets.values())):
+        return
+    skipped = emit_formats(final_rules, classify_surge_rule, targets, ruleset_header(rule, final_rules))
+    for output_format, count in skipped.items():
+        if count:
+            print(f"{rule['name']}: {output_format} 不支持的规则 {count} 条已跳过")
+
+
 def atomic_write(path: Path, content: str) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
     descriptor, temporary_name = tempfile.mkstemp(
@@ -329,45 +625,62 @@ def atomic_write(path: Path, content: str) -> None:
         temporary_path.unlink(missing_ok=True)
 
 
-def read_existing_rules(path: Path) -> Set[str]:
-    if not path.is_file():
-        return set()
-    return {
-        line.strip()
-        for line in path.read_text(encoding="utf-8").splitlines()
-        if line.strip() and not line.startswith('#')
-    }
+def read_output_rules(path: Path) -> List[str]:
+    return list(read_rule_lines(path))
 
 
 def publish_rulesets(
     workspace: Path,
     rules: List[Dict],
-    generated: Dict[str, List[str]]
+    generated: Dict[str, List[str]],
+    unchanged: Iterable[str] = (),
+    index: Optional[OutputIndex] = None,
+    patch_dir: Optional[Path] = None
 ) -> List[str]:
-    """仅在规则内容变化时落盘，返回变更摘要。"""
+    """
+    与产物的有序索引归并比较，仅在规则增删时落盘并更新索引，再按 outputs 写出其他格式
+    返回变更摘要；提供 patch_dir 时为每个变化的规则集写出补丁；unchanged 中的产物直接跳过。
+    """
     summaries = []
     pending_writes = []
+    unchanged = set(unchanged)
+    index = index or OutputIndex()
 
     for rule in rules:
         relative_path = rule["path"]
+        if relative_path in unchanged:
+            print(f"{rule['name']}: 无变化")
+            continue
         output_path = workspace_path(workspace, relative_path)
         final_rules = generated[relative_path]
-        old_rules = read_existing_rules(output_path)
-        new_rules = set(final_rules)
+        ordered_rules = sorted(final_rules)
+        base_digest, old_rules = index.previous(relative_path, output_path, read_output_rules)
+        added, removed = diff_sorted(old_rules, ordered_rules)
 
-        if old_rules == new_rules:
+        if not added and not removed:
+            index.save(relative_path, base_digest, ordered_rules)
             print(f"{rule['name']}: 无变化")
             continue
 
-        added = len(new_rules - old_rules)
-        removed = len(old_rules - new_rules)
         label = Path(relative_path).stem
-        summaries.append(f"{label}(+{added}/-{removed})")
-        pending_writes.append((output_path, render_ruleset(rule, final_rules)))
-        print(f"{rule['name']}: 新增 {added} 条, 移除 {removed} 条")
-
-    for output_path, content in pending_writes:
+        summaries.append(f"{label}(+{len(added)}/-{len(removed)})")
+        content = render_ruleset(rule, final_rules)
+        target_digest = content_digest(content)
+        patch = None
+        if patch_dir is not None:
+            patch = render_patch(relative_path, base_digest, target_digest, added, removed)
+        pending_writes.append((relative_path, output_path, content, target_digest, ordered_rules, patch))
+        print(f"{rule['name']}: 新增 {len(added)} 条, 移除 {len(removed)} 条")
+
+    for relative_path, output_path, content, target_digest, ordered_rules, patch in pending_writes:
         atomic_write(output_path, content)
+        index.save(relative_path, target_digest, ordered_rules)
+        if patch is not None:
+            atomic_write(patch_dir / f"{relative_path}.patch", patch)
+
+    changed_paths = {relative_path for relative_path, *_ in pending_writes}
+    for rule in rules:
+        publish_formats(workspace, rule, generated[rule["path"]], rule["path"] in changed_paths)
     return summaries
 
 
@@ -381,15 +694,110 @@ def write_github_output(summaries: List[str]) -> None:
             file_handle.write(f"change_summary={' '.join(summaries)}\n")
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="代理规则生成")
+    parser.add_argument(
+        "--cache-dir",
+        default="",
+        help="远程来源下载缓存目录，默认读取 RULE_FETCH_CACHE_DIR"
+    )
+    parser.add_argument(
+        "--cache-max-bytes",
+        type=int,
+        default=DEFAULT_MAX_BYTES,
+        help="下载缓存体积上限（字节）"
+    )
+    parser.add_argument("--offline", action="store_true", help="仅使用下载缓存重建规则")
+    parser.add_argument(
+        "--manifest",
+        default="",
+        help="构建清单路径，默认位于下载缓存目录的 manifests/proxy.json"
+    )
+    parser.add_argument(
+        "--index-dir",
+        default="",
+        help="产物有序索引目录，默认位于下载缓存目录的 indexes 子目录"
+    )
+    parser.add_argument(
+        "--patch-dir",
+        default="",
+        help="为变化的规则集写出增删补丁（<产物路径>.patch）的目录，默认不输出"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=default_workers(),
+        help="并行构建规则集的进程数，1 表示串行"
+    )
+    parser.add_argument(
+        "--metrics",
+        default="",
+        help="构建指标JSON行输出路径，- 表示标准输出"
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="用 tracemalloc 统计各规则集分配内存最多的代码位置（明显变慢）"
+    )
+    return parser.parse_args()
+
+
+def open_manifest(manifest_path: str, cache: Optional[FetchCache]) -> Optional[BuildManifest]:
+    if not manifest_path:
+        if cache is None:
+            return None
+        manifest_path = cache.directory / "manifests" / "proxy.json"
+    return BuildManifest(Path(manifest_path), code_digest(CODE_PATHS))
+
+
 def main() -> int:
+    args = parse_args()
     start_time = time.time()
     workspace = Path(os.environ.get("GITHUB_WORKSPACE", Path.cwd())).resolve()
     try:
+        metrics = BuildMetrics(args.metrics, args.trace_memory)
+        cache = open_cache(args.cache_dir, args.cache_max_bytes, args.offline)
+        manifest = open_manifest(args.manifest, cache)
+        index = open_index(args.index_dir, cache)
+        parse_cache = open_parse_cache(cache, PARSE_CODE_PATHS)
         rules = load_config(workspace)
-        contents = load_locations(workspace, rules)
-        generated = build_rulesets(rules, contents)
-        summaries = publish_rulesets(workspace, rules, generated)
+        with tempfile.TemporaryDirectory(prefix="proxy-sources-") as spool_dir:
+            contents = load_locations(workspace, rules, Path(spool_dir), cache, metrics)
+            client = shared_client()
+            client.close()
+            print(client.summary())
+            generated = build_rulesets(
+                rules, contents, manifest, workspace, args.jobs, metrics, parse_cache
+            )
+        unchanged = manifest.reused if manifest is not None else ()
+        check_budgets(
+            rules,
+            generated,
+            "name",
+            classify_surge_rule,
+            output_rule_counter(lambda path: workspace_path(workspace, path), read_output_rules),
+            unchanged
+        )
+        summaries = publish_rulesets(
+            workspace,
+            rules,
+            generated,
+            unchanged,
+            index,
+            Path(args.patch_dir) if args.patch_dir else None
+        )
+        print(index.summary())
         write_github_output(summaries)
+        if manifest is not None:
+            for rule in rules:
+                manifest.record_output(rule["path"], workspace_path(workspace, rule["path"]))
+            manifest.save()
+        if cache is not None:
+            cache.evict()
+            print(cache.summary())
+        if parse_cache is not None:
+            print(f"解析缓存: 淘汰 {parse_cache.evict()}")
+        metrics.write_github("代理规则构建指标")
     except Exception as error:
         print(f"错误: {error}", file=sys.stderr)
         return 1
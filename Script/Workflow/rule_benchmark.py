@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+规则编译基准测试
+功能:
+1. 按固定随机种子生成 AdGuard、Surge domain-set、MosDNS、CIDR 合成语料，
+   域名共享注册域与多级子域，带注释、重复、正则与允许规则等真实噪声
+2. 按生产构建的调用路径对 mosdns_rules / proxy_rules 的各阶段分别计时
+3. 结果以JSON输出，可与基线对比，超过回退阈值时返回非零退出码
+"""
+
+import argparse
+import contextlib
+import io
+import ipaddress
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import ip_intervals
+import mosdns_rules
+import proxy_rules
+from domain_trie import DomainTrie
+from rule_source import local_source
+
+REPORT_VERSION = 1
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000, 5_000_000)
+DEFAULT_SEED = 20240601
+TLDS = ("com", "net", "org", "cn", "io", "co", "uk", "de", "jp", "xyz", "top", "info")
+SYLLABLES = ("ad", "cdn", "img", "api", "log", "trk", "met", "sta", "pix", "srv", "ns", "cl", "vid", "go")
+SUBLABELS = ("www", "m", "api", "cdn", "static", "img", "ads", "track", "log", "s1", "s2", "edge", "mail", "t")
+# (格式, 编译器) 组合及其计时阶段
+SCENARIOS = (
+    ("domain_adguard", "mosdns"),
+    ("domain_surge", "mosdns"),
+    ("domain_mosdns", "mosdns"),
+    ("ip_cidr", "mosdns"),
+    ("domain_surge", "proxy"),
+)
+
+
+class DomainPool:
+    """共享注册域的域名生成器，子域层级越深越少见，保证足够的后缀重叠。"""
+
+    def __init__(self, rng: random.Random, lines: int):
+        self.rng = rng
+        self.bases = [
+            f"{''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3)))}{index}.{rng.choice(TLDS)}"
+            for index in range(max(100, lines // 8))
+        ]
+
+    def base(self) -> str:
+        return self.rng.choice(self.bases)
+
+    def domain(self) -> str:
+        depth = self.rng.choices((0, 1, 2, 3), weights=(4, 3, 2, 1))[0]
+        labels = [self.rng.choice(SUBLABELS) for _ in range(depth)]
+        labels.append(self.base())
+        return ".".join(labels)
+
+
+def adguard_line(pool: DomainPool) -> str:
+    roll = pool.rng.random()
+    if roll < 0.70:
+        return f"||{pool.domain()}^"
+    if roll < 0.78:
+        return f"||{pool.domain()}^$third-party"
+    if roll < 0.83:
+        return pool.domain()
+    if roll < 0.86:
+        return f".{pool.domain()}"
+    if roll < 0.89:
+        return f"@@||{pool.domain()}^"
+    if roll < 0.93:
+        return f"! {pool.base()}"
+    if roll < 0.96:
+        return f"||ad*{pool.rng.randint(0, 99)}.{pool.base()}^"
+    if roll < 0.98:
+        return f"|https://{pool.domain()}/path?x=1"
+    return f"domain:{pool.domain()}"
+
+
+def surge_line(pool: DomainPool) -> str:
+    roll = pool.rng.random()
+    if roll < 0.40:
+        return f".{pool.domain()}"
+    if roll < 0.90:
+        return pool.domain()
+    if roll < 0.95:
+        return f"# {pool.base()}"
+    if roll < 0.98:
+        return f"DOMAIN-SUFFIX,{pool.domain()}"
+    return f"DOMAIN,{pool.domain()}"
+
+
+def mosdns_line(pool: DomainPool) -> str:
+    roll = pool.rng.random()
+    if roll < 0.50:
+        return f"domain:{pool.domain()}"
+    if roll < 0.95:
+        return f"full:{pool.domain()}"
+    if roll < 0.98:
+        return f"# {pool.base()}"
+    return f"domain:{pool.domain()}  # inline"
+
+
+def cidr_line(rng: random.Random) -> str:
+    """在少量父网段内取子网段，使覆盖关系与相邻网段都足够常见。"""
+    roll = rng.random()
+    if roll < 0.03:
+        return "# comment"
+    if roll < 0.88:
+        parent = rng.getrandbits(12) << 20
+        prefix = rng.randint(12, 32)
+        start = parent | (rng.getrandbits(prefix - 12) << (32 - prefix))
+        text = f"{ipaddress.IPv4Address(start)}/{prefix}"
+        if roll > 0.85:
+            return f"IP-CIDR,{text},no-resolve"
+        return text
+    if roll < 0.90:
+        return str(ipaddress.IPv4Address(rng.getrandbits(32)))
+    prefix = rng.randint(20, 64)
+    start = ((0x2400 << 112) | (rng.getrandbits(16) << 96)) >> (128 - prefix) << (128 - prefix)
+    return f"{ipaddress.IPv6Address(start)}/{prefix}"
+
+
+def write_corpus(path: Path, rule_format: str, lines: int, seed: int) -> List[str]:
+    """流式写出语料，返回用作排除规则的 domain: 条目。"""
+    rng = random.Random(f"{seed}:{rule_format}:{lines}")
+    excludes = []
+    if rule_format == "ip_cidr":
+        make_line = lambda: cidr_line(rng)
+    else:
+        pool = DomainPool(rng, lines)
+        make_line = {
+            "domain_adguard": lambda: adguard_line(pool),
+            "domain_surge": lambda: surge_line(pool),
+            "domain_mosdns": lambda: mosdns_line(pool),
+        }[rule_format]
+        excludes = sorted({f"domain:{pool.base()}" for _ in range(max(10, len(pool.bases) // 50))})
+
+    with open(path, "w", encoding="utf-8") as file_handle:
+        batch = []
+        for _ in range(lines):
+            batch.append(make_line())
+            if len(batch) >= 65536:
+                file_handle.write("\n".join(batch) + "\n")
+                batch.clear()
+        if batch:
+            file_handle.write("\n".join(batch) + "\n")
+    return excludes
+
+
+def measure(function: Callable, repeat: int, reset: Optional[Callable] = None) -> Tuple[float, object]:
+    """重复执行取最短耗时，编译器的进度输出不计入结果。"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        if reset is not None:
+            reset()
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            result = function()
+            elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def stage(seconds: float, input_count: int, output_count: int) -> Dict:
+    return {
+        "seconds": round(seconds, 6),
+        "input": input_count,
+        "output": output_count,
+        "lines_per_second": round(input_count / seconds) if seconds else None,
+    }
+
+
+def add_domain_rules(rules: List[str]) -> Tuple[DomainTrie, Set[str]]:
+    """与 build_ruleset 相同，每次写入新的前缀树。"""
+    trie = DomainTrie()
+    other_rules = set()
+    mosdns_rules.add_domain_rules(trie, rules, other_rules)
+    return trie, other_rules
+
+
+def publish_stage(workspace: Path, compiler: str, rules: List[str], repeat: int) -> Dict:
+    relative_path = f"RuleSet/benchmark-{compiler}.txt"
+    output_path = workspace / relative_path
+    if compiler == "mosdns":
+        config = [{"id": "benchmark", "path": relative_path}]
+        publish = mosdns_rules.publish_rulesets
+    else:
+        config = [{"name": "BENCHMARK", "path": relative_path, "sources": ["benchmark"]}]
+        publish = proxy_rules.publish_rulesets
+    seconds, _ = measure(
+        lambda: publish(workspace, config, {relative_path: rules}),
+        repeat,
+        lambda: output_path.unlink(missing_ok=True)
+    )
+    return stage(seconds, len(rules), len(rules))
+
+
+def run_scenario(
+    workspace: Path,
+    rule_format: str,
+    compiler: str,
+    lines: int,
+    seed: int,
+    repeat: int
+) -> Dict:
+    corpus_path = workspace / f"{compiler}-{rule_format}-{lines}.txt"
+    started = time.perf_counter()
+    excludes = write_corpus(corpus_path, rule_format, lines, seed)
+    source = local_source(corpus_path, corpus_path.name)
+    stages = {}
+
+    if compiler == "proxy":
+        seconds, converted = measure(lambda: proxy_rules.convert_location(source, corpus_path.name), repeat)
+        rules = converted.rules
+        stages["convert_location"] = stage(seconds, lines, len(rules))
+        seconds, (final_rules, _) = measure(lambda: proxy_rules.optimize_domains(rules), repeat)
+        stages["optimize_domains"] = stage(seconds, len(rules), len(final_rules))
+    else:
+        seconds, converted = measure(
+            lambda: mosdns_rules.convert_location(rule_format, source, corpus_path.name),
+            repeat
+        )
+        rules = converted.rules
+        stages["convert_location"] = stage(seconds, lines, len(rules))
+        if rule_format == "ip_cidr":
+            seconds, (final_rules, _) = measure(lambda: mosdns_rules.optimize_ip_networks(rules), repeat)
+            stages["optimize_ip_networks"] = stage(seconds, len(rules), len(final_rules))
+            seconds, (aggregated, _) = measure(
+                lambda: mosdns_rules.optimize_ip_networks(rules, aggregate=True),
+                repeat
+            )
+            stages["optimize_ip_networks_aggregate"] = stage(seconds, len(rules), len(aggregated))
+        else:
+            seconds, (trie, other_rules) = measure(lambda: add_domain_rules(rules), repeat)
+            stages["add_domain_rules"] = stage(seconds, len(rules), trie.size + len(other_rules))
+            seconds, exclusion_index = measure(
+                lambda: mosdns_rules.build_exclusion_index(corpus_path.name, excludes, None),
+                repeat
+            )
+            stages["build_exclusion_index"] = stage(seconds, len(excludes), exclusion_index.size)
+            seconds, (final_rules, _) = measure(
+                lambda: mosdns_rules.collect_domain_rules(trie, other_rules, [exclusion_index]),
+                repeat
+            )
+            stages["collect_domain_rules"] = stage(seconds, trie.size + len(other_rules), len(final_rules))
+
+    stages["publish_rulesets"] = publish_stage(workspace, compiler, final_rules, repeat)
+    corpus_bytes = source.size
+    corpus_path.unlink()
+    return {
+        "compiler": compiler,
+        "format": rule_format,
+        "lines": lines,
+        "bytes": corpus_bytes,
+        "stages": stages,
+        "total_seconds": round(time.perf_counter() - started, 6),
+    }
+
+
+def result_key(result: Dict, stage_name: str) -> str:
+    return f"{result['compiler']}/{result['format']}/{result['lines']}/{stage_name}"
+
+
+def compare_baseline(report: Dict, baseline: Dict, max_regression: float) -> List[str]:
+    """逐阶段对比基线耗时，返回超过阈值的回退描述。"""
+    baseline_seconds = {
+        result_key(result, stage_name): values["seconds"]
+        for result in baseline.get("results", [])
+        for stage_name, values in result.get("stages", {}).items()
+    }
+    regressions = []
+    for result in report["results"]:
+        for stage_name, values in result["stages"].items():
+            key = result_key(result, stage_name)
+            previous = baseline_seconds.get(key)
+            if not previous:
+                continue
+            ratio = values["seconds"] / previous
+            values["baseline_ratio"] = round(ratio, 3)
+            if ratio > 1 + max_regression:
+                regressions.append(f"{key}: {previous:.4f}s -> {values['seconds']:.4f}s ({ratio:.2f}x)")
+    return regressions
+
+
+def parse_sizes(value: str) -> List[int]:
+    try:
+        sizes = [int(item.replace("_", "")) for item in value.split(",") if item.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的语料规模: {value}")
+    if not sizes or any(size <= 0 for size in sizes):
+        raise argparse.ArgumentTypeError(f"无效的语料规模: {value}")
+    return sizes
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="规则编译基准测试")
+    parser.add_argument(
+        "--sizes",
+        type=parse_sizes,
+        default=list(DEFAULT_SIZES),
+        help="逗号分隔的语料行数，默认 10000,100000,1000000,5000000"
+    )
+    parser.add_argument(
+        "--formats",
+        default="",
+        help="逗号分隔的 格式/编译器 组合，如 domain_adguard/mosdns，默认全部"
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="每个阶段重复次数，取最短耗时")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="语料随机种子")
+    parser.add_argument("--output", default="", help="JSON结果路径，默认输出到标准输出")
+    parser.add_argument("--baseline", default="", help="用于对比的历史JSON结果")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.25,
+        help="相对基线允许的最大耗时增幅，默认 0.25"
+    )
+    return parser.parse_args()
+
+
+def select_scenarios(value: str) -> List[Tuple[str, str]]:
+    if not value:
+        return list(SCENARIOS)
+    selected = []
+    for item in value.split(","):
+        rule_format, _, compiler = item.strip().partition("/")
+        scenario = (rule_format, compiler or "mosdns")
+        if scenario not in SCENARIOS:
+            raise ValueError(f"未知的基准组合: {item}")
+        selected.append(scenario)
+    return selected
+
+
+def main() -> int:
+    args = parse_args()
+    try:
+        if args.repeat <= 0:
+            raise ValueError("--repeat 必须是正整数")
+        scenarios = select_scenarios(args.formats)
+        report = {
+            "version": REPORT_VERSION,
+            "python": platform.python_version(),
+            "numpy": ip_intervals.numpy is not None,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "results": [],
+        }
+        with tempfile.TemporaryDirectory(prefix="rule-benchmark-") as directory:
+            workspace = Path(directory).resolve()
+            for lines in args.sizes:
+                for rule_format, compiler in scenarios:
+                    result = run_scenario(workspace, rule_format, compiler, lines, args.seed, args.repeat)
+                    report["results"].append(result)
+                    print(
+                        f"{compiler}/{rule_format} {lines} 行: " + ", ".join(
+                            f"{name} {values['seconds']:.3f}s"
+                            for name, values in result["stages"].items()
+                        ),
+                        file=sys.stderr
+                    )
+
+        regressions = []
+        if args.baseline:
+            baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+            regressions = compare_baseline(report, baseline, args.max_regression)
+            report["regressions"] = regressions
+
+        payload = json.dumps(report, ensure_ascii=False, indent=2) + "\n"
+        if args.output:
+            Path(args.output).write_text(payload, encoding="utf-8")
+        else:
+            sys.stdout.write(payload)
+    except Exception as error:
+        print(f"错误: {error}", file=sys.stderr)
+        return 1
+
+    for regression in regressions:
+        print(f"性能回退: {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
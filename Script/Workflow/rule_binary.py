@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+规则集二进制格式
+1. 域名按标签反转后排序（www.example.com -> com.example.www），前缀压缩分块存储，
+   块首偏移表支持二分查找，后缀匹配只需按标签边界逐级查找
+2. IP/CIDR 合并为互不重叠的地址区间表，IPv4 为 u32 对，IPv6 为 16 字节大端对
+3. 文件尾部为 CRC32，读取时校验头部、分区边界与校验和，validate 额外检查有序性
+
+文件布局（小端）:
+    头部     magic(4) version(u8) reserved(u8) section_count(u16)
+    分区表   type(u8) pad(3) count(u32) offset(u64) length(u64)，每个分区一项
+    分区数据
+    CRC32(u32)，覆盖之前的全部字节
+
+用法:
+    python3 rule_binary.py check reject.bin [reject.txt]
+    python3 rule_binary.py match reject.bin ads.example.com 1.2.3.4
+"""
+
+import argparse
+import ipaddress
+import re
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from ip_intervals import WIDTHS, format_network, parse_network, split_range
+from rule_source import read_rule_lines
+
+MAGIC = b"RSBN"
+VERSION = 1
+BLOCK_SIZE = 16
+HEADER = struct.Struct("<4sBxH")
+SECTION = struct.Struct("<BxxxIQQ")
+CRC = struct.Struct("<I")
+U32 = struct.Struct("<I")
+
+SUFFIX_SECTION = 1
+FULL_SECTION = 2
+KEYWORD_SECTION = 3
+REGEXP_SECTION = 4
+IPV4_SECTION = 5
+IPV6_SECTION = 6
+DOMAIN_SECTIONS = (SUFFIX_SECTION, FULL_SECTION, KEYWORD_SECTION, REGEXP_SECTION)
+TEXT_PREFIXES = {
+    SUFFIX_SECTION: "domain:",
+    FULL_SECTION: "full:",
+    KEYWORD_SECTION: "keyword:",
+    REGEXP_SECTION: "regexp:",
+}
+ADDRESS_BYTES = {IPV4_SECTION: 4, IPV6_SECTION: 16}
+
+
+class RuleSetFormatError(ValueError):
+    pass
+
+
+def reverse_domain(domain: str) -> str:
+    return ".".join(reversed(domain.split(".")))
+
+
+def write_varint(output: bytearray, value: int) -> None:
+    while value >= 0x80:
+        output.append(value & 0x7F | 0x80)
+        value >>= 7
+    output.append(value)
+
+
+def read_varint(data, position: int) -> Tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        if position >= len(data):
+            raise RuleSetFormatError("变长整数越界")
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def encode_strings(values: Sequence[bytes]) -> bytes:
+    """
+    有序字节串的前缀压缩分块编码
+    块数(u32) + 块偏移(u32 * 块数) + 条目: 与上一条的公共前缀长度、剩余长度（均为变长整数）与剩余字节，
+    每块首条的公共前缀长度固定为 0。
+    """
+    blocks = bytearray()
+    offsets = array('I')
+    previous = b""
+    for position, value in enumerate(values):
+        if position % BLOCK_SIZE == 0:
+            offsets.append(len(blocks))
+            previous = b""
+        shared = 0
+        limit = min(len(previous), len(value))
+        while shared < limit and previous[shared] == value[shared]:
+            shared += 1
+        write_varint(blocks, shared)
+        write_varint(blocks, len(value) - shared)
+        blocks += value[shared:]
+        previous = value
+    if sys.byteorder != "little":
+        offsets.byteswap()
+    return U32.pack(len(offsets)) + offsets.tobytes() + bytes(blocks)
+
+
+def network_ranges(networks: Iterable[str]) -> Dict[int, List[Tuple[int, int]]]:
+    """CIDR 转为按版本分组、合并重叠与相邻后的 [起始, 结束] 区间。"""
+    keyed: Dict[int, List[Tuple[int, int]]] = {4: [], 6: []}
+    for network in networks:
+        version, start, prefixlen = parse_network(network)
+        keyed[version].append((start, start + (1 << (WIDTHS[version] - prefixlen)) - 1))
+    merged: Dict[int, List[Tuple[int, int]]] = {}
+    for version, ranges in keyed.items():
+        result: List[Tuple[int, int]] = []
+        for start, end in sorted(ranges):
+            if result and start <= result[-1][1] + 1:
+                if end > result[-1][1]:
+                    result[-1] = (result[-1][0], end)
+                continue
+            result.append((start, end))
+        merged[version] = result
+    return merged
+
+
+def encode_ranges(ranges: List[Tuple[int, int]], width: int) -> bytes:
+    return b"".join(
+        start.to_bytes(width, "big") + end.to_bytes(width, "big")
+        for start, end in ranges
+    )
+
+
+def encode_rule_set(
+    suffixes: Iterable[str] = (),
+    fulls: Iterable[str] = (),
+    keywords: Iterable[str] = (),
+    regexps: Iterable[str] = (),
+    networks: Iterable[str] = ()
+) -> bytes:
+    """编码一个规则集，空分区不写入。"""
+    sections: List[Tuple[int, int, bytes]] = []
+    for section_type, values, reverse in (
+        (SUFFIX_SECTION, suffixes, True),
+        (FULL_SECTION, fulls, True),
+        (KEYWORD_SECTION, keywords, False),
+        (REGEXP_SECTION, regexps, False),
+    ):
+        encoded = sorted({
+            (reverse_domain(value) if reverse else value).encode("utf-8")
+            for value in values
+        })
+        if encoded:
+            sections.append((section_type, len(encoded), encode_strings(encoded)))
+    for version, ranges in network_ranges(networks).items():
+        if ranges:
+            section_type = IPV4_SECTION if version == 4 else IPV6_SECTION
+            payload = encode_ranges(ranges, ADDRESS_BYTES[section_type])
+            sections.append((section_type, len(ranges), payload))
+
+    output = bytearray(HEADER.pack(MAGIC, VERSION, len(sections)))
+    offset = HEADER.size + SECTION.size * len(sections)
+    for section_type, count, payload in sections:
+        output += SECTION.pack(section_type, count, offset, len(payload))
+        offset += len(payload)
+    for _, _, payload in sections:
+        output += payload
+    output += CRC.pack(zlib.crc32(output))
+    return bytes(output)
+
+
+class StringSection:
+    """前缀压缩分块的有序字节串，块首条目预先解出用于二分。"""
+
+    def __init__(self, data: memoryview, count: int):
+        if len(data) < U32.size:
+            raise RuleSetFormatError("字符串分区过短")
+        block_count = U32.unpack_from(data, 0)[0]
+        header_size = U32.size * (block_count + 1)
+        if block_count != (count + BLOCK_SIZE - 1) // BLOCK_SIZE or len(data) < header_size:
+            raise RuleSetFormatError("字符串分区块数与条目数不一致")
+        self.count = count
+        self.offsets = array('I', bytes(data[U32.size:header_size]))
+        if sys.byteorder != "little":
+            self.offsets.byteswap()
+        self.blocks = data[header_size:]
+        self.firsts = [self._entry(offset, b"")[0] for offset in self.offsets]
+
+    def _entry(self, position: int, previous: bytes) -> Tuple[bytes, int]:
+        shared, position = read_varint(self.blocks, position)
+        length, position = read_varint(self.blocks, position)
+        if shared > len(previous) or position + length > len(self.blocks):
+            raise RuleSetFormatError("字符串条目越界")
+        value = previous[:shared] + bytes(self.blocks[position:position + length])
+        return value, position + length
+
+    def _block(self, block: int) -> Iterator[bytes]:
+        position = self.offsets[block]
+        remaining = min(BLOCK_SIZE, self.count - block * BLOCK_SIZE)
+        value = b""
+        for _ in range(remaining):
+            value, position = self._entry(position, value)
+            yield value
+
+    def __iter__(self) -> Iterator[bytes]:
+        for block in range(len(self.offsets)):
+            yield from self._block(block)
+
+    def __contains__(self, value: bytes) -> bool:
+        block = bisect_right(self.firsts, value) - 1
+        if block < 0:
+            return False
+        for candidate in self._block(block):
+            if candidate >= value:
+                return candidate == value
+        return False
+
+
+class RangeSection:
+    """互不重叠的升序地址区间表。"""
+
+    def __init__(self, data: memoryview, count: int, width: int):
+        if len(data) != count * width * 2:
+            raise RuleSetFormatError("地址区间分区长度不一致")
+        values = [
+            int.from_bytes(data[position:position + width], "big")
+            for position in range(0, len(data), width)
+        ]
+        self.starts = values[0::2]
+        self.ends = values[1::2]
+
+    def __contains__(self, address: int) -> bool:
+        position = bisect_right(self.starts, address) - 1
+        return position >= 0 and address <= self.ends[position]
+
+
+class CompiledRuleSet:
+    """二进制规则集读取器，构造时校验头部、分区边界与 CRC32。"""
+
+    def __init__(self, data: bytes):
+        view = memoryview(data)
+        if len(view) < HEADER.size + CRC.size:
+            raise RuleSetFormatError("文件过短")
+        magic, version, section_count = HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise RuleSetFormatError("文件标识不匹配")
+        if version != VERSION:
+            raise RuleSetFormatError(f"不支持的格式版本: {version}")
+        body_size = len(view) - CRC.size
+        if zlib.crc32(view[:body_size]) != CRC.unpack_from(view, body_size)[0]:
+            raise RuleSetFormatError("CRC32 校验失败")
+
+        self.strings: Dict[int, StringSection] = {}
+        self.ranges: Dict[int, RangeSection] = {}
+        data_start = HEADER.size + SECTION.size * section_count
+        if data_start > body_size:
+            raise RuleSetFormatError("分区表越界")
+        for index in range(section_count):
+            section_type, count, offset, length = SECTION.unpack_from(view, HEADER.size + SECTION.size * index)
+            if offset < data_start or offset + length > body_size:
+                raise RuleSetFormatError(f"分区 {section_type} 越界")
+            if section_type in self.strings or section_type in self.ranges:
+                raise RuleSetFormatError(f"分区 {section_type} 重复")
+            payload = view[offset:offset + length]
+            if section_type in DOMAIN_SECTIONS:
+                self.strings[section_type] = StringSection(payload, count)
+            elif section_type in ADDRESS_BYTES:
+                self.ranges[section_type] = RangeSection(payload, count, ADDRESS_BYTES[section_type])
+            else:
+                raise RuleSetFormatError(f"未知分区类型: {section_type}")
+
+    @classmethod
+    def load(cls, path: Path) -> "CompiledRuleSet":
+        return cls(Path(path).read_bytes())
+
+    def validate(self) -> None:
+        """逐条检查字符串严格升序、地址区间升序且互不相邻重叠。"""
+        for section_type, section in self.strings.items():
+            previous = None
+            total = 0
+            for value in section:
+                if previous is not None and value <= previous:
+                    raise RuleSetFormatError(f"分区 {section_type} 未严格升序")
+                previous = value
+                total += 1
+            if total != section.count:
+                raise RuleSetFormatError(f"分区 {section_type} 条目数不一致")
+        for section_type, section in self.ranges.items():
+            previous_end = -2
+            for start, end in zip(section.starts, section.ends):
+                if start > end or start <= previous_end + 1:
+                    raise RuleSetFormatError(f"分区 {section_type} 区间无序或未合并")
+                previous_end = end
+
+    def match_domain(self, domain: str) -> Optional[str]:
+        """返回命中的规则文本（domain:/full:/keyword:/regexp:），未命中返回 None。"""
+        domain = domain.strip().rstrip(".").lower()
+        labels = domain.split(".")
+        reversed_domain = ".".join(reversed(labels)).encode("utf-8")
+        full = self.strings.get(FULL_SECTION)
+        if full is not None and reversed_domain in full:
+            return f"full:{domain}"
+        suffixes = self.strings.get(SUFFIX_SECTION)
+        if suffixes is not None:
+            for size in range(1, len(labels) + 1):
+                candidate = ".".join(labels[-size:])
+                if reverse_domain(candidate).encode("utf-8") in suffixes:
+                    return f"domain:{candidate}"
+        keywords = self.strings.get(KEYWORD_SECTION)
+        if keywords is not None:
+            for keyword in keywords:
+                if keyword.decode("utf-8") in domain:
+                    return f"keyword:{keyword.decode('utf-8')}"
+        regexps = self.strings.get(REGEXP_SECTION)
+        if regexps is not None:
+            for pattern in regexps:
+                if re.search(pattern.decode("utf-8"), domain):
+                    return f"regexp:{pattern.decode('utf-8')}"
+        return None
+
+    def match_ip(self, address: str) -> bool:
+        parsed = ipaddress.ip_address(address.strip())
+        section = self.ranges.get(IPV4_SECTION if parsed.version == 4 else IPV6_SECTION)
+        return section is not None and int(parsed) in section
+
+    def rules(self) -> Iterator[str]:
+        """按 MosDNS 文本写法产出全部规则，地址区间拆分为最少数量的CIDR。"""
+        for section_type in DOMAIN_SECTIONS:
+            section = self.strings.get(section_type)
+            if section is None:
+                continue
+            prefix = TEXT_PREFIXES[section_type]
+            reverse = section_type in (SUFFIX_SECTION, FULL_SECTION)
+            for value in section:
+                text = value.decode("utf-8")
+                yield prefix + (reverse_domain(text) if reverse else text)
+        for section_type, version in ((IPV4_SECTION, 4), (IPV6_SECTION, 6)):
+            section = self.ranges.get(section_type)
+            if section is None:
+                continue
+            for start, end in zip(section.starts, section.ends):
+                starts, prefixes = split_range(start, end, WIDTHS[version])
+                for network_start, prefixlen in zip(starts, prefixes):
+                    yield format_network(version, network_start, prefixlen)
+
+
+def group_text_rules(rules: Iterable[str]) -> Dict[int, List[str]]:
+    """按 MosDNS 文本前缀把规则分到各分区，无前缀的视为IP/CIDR（键为 0）。"""
+    groups: Dict[int, List[str]] = {section_type: [] for section_type in DOMAIN_SECTIONS}
+    groups[0] = []
+    for rule in rules:
+        for section_type, prefix in TEXT_PREFIXES.items():
+            if rule.startswith(prefix):
+                groups[section_type].append(rule[len(prefix):])
+                break
+        else:
+            groups[0].append(rule)
+    return groups
+
+
+def encode_text_rules(rules: Iterable[str]) -> bytes:
+    groups = group_text_rules(rules)
+    return encode_rule_set(
+        groups[SUFFIX_SECTION],
+        groups[FULL_SECTION],
+        groups[KEYWORD_SECTION],
+        groups[REGEXP_SECTION],
+        groups[0]
+    )
+
+
+def verify_round_trip(data: bytes, rules: Iterable[str]) -> None:
+    """
+    校验二进制规则集与文本规则等价: 域名规则集合一致，CIDR 覆盖的地址区间一致
+    不一致时抛出 RuleSetFormatError。
+    """
+    compiled = CompiledRuleSet(data)
+    compiled.validate()
+    expected = group_text_rules(rules)
+    actual = group_text_rules(compiled.rules())
+    for section_type in DOMAIN_SECTIONS:
+        if set(expected[section_type]) != set(actual[section_type]):
+            raise RuleSetFormatError(f"{TEXT_PREFIXES[section_type]} 规则往返不一致")
+    if network_ranges(expected[0]) != network_ranges(actual[0]):
+        raise RuleSetFormatError("IP/CIDR 规则往返不一致")
+
+
+def read_text_rules(path: Path) -> List[str]:
+    return list(read_rule_lines(path))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="二进制规则集校验与查询")
+    commands = parser.add_subparsers(dest="command", required=True)
+    check = commands.add_parser("check", help="校验文件结构，给出文本产物时做往返比对")
+    check.add_argument("binary", type=Path)
+    check.add_argument("text", type=Path, nargs="?")
+    match = commands.add_parser("match", help="查询域名或IP是否命中")
+    match.add_argument("binary", type=Path)
+    match.add_argument("queries", nargs="+")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    try:
+        data = args.binary.read_bytes()
+        compiled = CompiledRuleSet(data)
+        if args.command == "check":
+            compiled.validate()
+            if args.text is not None:
+                verify_round_trip(data, read_text_rules(args.text))
+            counts = [
+                f"{TEXT_PREFIXES[section_type]} {section.count}"
+                for section_type, section in sorted(compiled.strings.items())
+            ]
+            counts.extend(
+                f"IPv{4 if section_type == IPV4_SECTION else 6} 区间 {len(section.starts)}"
+                for section_type, section in sorted(compiled.ranges.items())
+            )
+            print(f"{args.binary}: 校验通过，{len(data)} 字节，{', '.join(counts) or '空规则集'}")
+            return 0
+        for query in args.queries:
+            try:
+                hit = "命中" if compiled.match_ip(query) else None
+            except ValueError:
+                hit = compiled.match_domain(query)
+            print(f"{query}\t{hit or '未命中'}")
+    except (OSError, ValueError) as error:
+        print(f"错误: {error}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
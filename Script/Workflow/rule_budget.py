@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+规则集容量预算
+1. 规则配置可选 max_rules、max_bytes、max_growth_percent，分别限制规则条数、产物规则字节数与相对上次产物的条数增幅
+2. 在写出任何产物前按优化后的规则检查，任一规则集超出预算时整体失败，避免上游突增直接推送到路由器
+3. 按规则类型估算路由器加载后的内存占用，随检查结果一并输出
+"""
+
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from rule_emitters import CIDR, FULL, KEYWORD, REGEXP, SUFFIX
+
+BUDGET_KEYS = ("max_rules", "max_bytes", "max_growth_percent")
+# 按 Go 实现的匹配器粗略估算的每条规则开销（字节），域名与关键字另加字符串长度
+ENTRY_OVERHEAD = {
+    SUFFIX: 48,
+    FULL: 48,
+    KEYWORD: 16,
+    REGEXP: 2048,
+    CIDR: 32,
+}
+
+
+def validate_budget(rule: Dict, label: str) -> None:
+    """预算项可省略，给出时须为非负数，条数与字节数须为整数。"""
+    for key in BUDGET_KEYS:
+        if key not in rule:
+            continue
+        value = rule[key]
+        valid_types = (int, float) if key == "max_growth_percent" else (int,)
+        if isinstance(value, bool) or not isinstance(value, valid_types) or value < 0:
+            raise ValueError(f"规则 {label} 的 {key} 必须是非负{'数' if key == 'max_growth_percent' else '整数'}")
+
+
+def measure_rules(rules: Iterable[str], classify: Callable[[str], Tuple[str, str]]) -> Tuple[int, int, int]:
+    """返回 (规则条数, 产物规则字节数, 估计内存字节数)。"""
+    count = 0
+    size = 0
+    memory = 0
+    for rule in rules:
+        encoded_length = len(rule.encode("utf-8"))
+        kind, value = classify(rule)
+        count += 1
+        size += encoded_length + 1
+        memory += ENTRY_OVERHEAD[kind] + (len(value) if kind != CIDR else 0)
+    return count, size, memory
+
+
+def budget_violations(
+    label: str,
+    rule: Dict,
+    count: int,
+    size: int,
+    previous_count: Optional[int]
+) -> List[str]:
+    """previous_count 为 None 或 0 时不检查增幅（首次生成或产物不存在）。"""
+    violations = []
+    max_rules = rule.get("max_rules")
+    if max_rules is not None and count > max_rules:
+        violations.append(f"{label}: 规则 {count} 条，超过上限 {max_rules}")
+    max_bytes = rule.get("max_bytes")
+    if max_bytes is not None and size > max_bytes:
+        violations.append(f"{label}: 规则 {size} 字节，超过上限 {max_bytes}")
+    max_growth = rule.get("max_growth_percent")
+    if max_growth is not None and previous_count:
+        growth = (count - previous_count) * 100 / previous_count
+        if growth > max_growth:
+            violations.append(
+                f"{label}: 规则由 {previous_count} 条增至 {count} 条（+{growth:.1f}%），超过上限 {max_growth}%"
+            )
+    return violations
+
+
+def check_budgets(
+    rules: List[Dict],
+    generated: Dict[str, List[str]],
+    label_key: str,
+    classify: Callable[[str], Tuple[str, str]],
+    previous_count: Callable[[str], Optional[int]],
+    unchanged: Iterable[str] = ()
+) -> int:
+    """
+    检查全部规则集并输出各自的估计内存，返回估计内存总字节数，超出预算时抛出 ValueError
+    previous_count 按产物相对路径返回上次产物的规则条数；unchanged 中的产物复用上次结果，不检查增幅。
+    """
+    unchanged = set(unchanged)
+    violations = []
+    total_memory = 0
+    for rule in rules:
+        relative_path = rule["path"]
+        label = rule[label_key]
+        count, size, memory = measure_rules(generated[relative_path], classify)
+        total_memory += memory
+        print(f"{label}: {count} 条, {size} 字节, 估计路由器内存 {memory / 1024:.1f} KiB")
+        previous = None
+        if "max_growth_percent" in rule and relative_path not in unchanged:
+            previous = previous_count(relative_path)
+        violations.extend(budget_violations(label, rule, count, size, previous))
+    print(f"估计路由器内存合计: {total_memory / 1024 / 1024:.2f} MiB")
+    if violations:
+        raise ValueError("规则集超出预算，未写出任何产物:\n" + "\n".join(violations))
+    return total_memory
+
+
+def output_rule_counter(
+    workspace_path: Callable[[str], Path],
+    read_rules: Callable[[Path], Iterable[str]]
+) -> Callable[[str], Optional[int]]:
+    """上次产物的规则条数，产物不存在时为 None。"""
+    def previous_count(relative_path: str) -> Optional[int]:
+        path = workspace_path(relative_path)
+        if not path.is_file():
+            return None
+        return sum(1 for _ in read_rules(path))
+    return previous_count
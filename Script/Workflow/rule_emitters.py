@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+规则集多格式输出
+1. 优化后的规则统一归类为 (类型, 值)，类型为后缀、完整域名、关键字、正则或CIDR
+2. 一次遍历把每条规则分发给所有目标格式，逐条写入目标目录下的临时文件
+3. 全部格式写完后再原子替换，任一失败则全部放弃
+支持: Surge 规则列表、Clash payload、sing-box 规则集JSON、MosDNS 文本、nftables 集合，
+以及 rule_binary 定义的二进制规则集（写出后立即与文本规则做往返校验）。
+"""
+
+import json
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from rule_binary import encode_rule_set, verify_round_trip
+
+SUFFIX = "suffix"
+FULL = "full"
+KEYWORD = "keyword"
+REGEXP = "regexp"
+CIDR = "cidr"
+MOSDNS_PREFIXES = {SUFFIX: "domain:", FULL: "full:", KEYWORD: "keyword:", REGEXP: "regexp:", CIDR: ""}
+
+
+def classify_surge_rule(rule: str) -> Tuple[str, str]:
+    """Surge domain-set 规则: 以 . 开头为后缀匹配，否则为完整域名。"""
+    if rule.startswith('.'):
+        return SUFFIX, rule[1:]
+    return FULL, rule
+
+
+def classify_mosdns_rule(rule: str) -> Tuple[str, str]:
+    """MosDNS 规则: 按前缀区分域名匹配方式，无前缀的为IP/CIDR。"""
+    for kind, prefix in MOSDNS_PREFIXES.items():
+        if prefix and rule.startswith(prefix):
+            return kind, rule[len(prefix):]
+    return CIDR, rule
+
+
+class Emitter(ABC):
+    """单个格式的输出，写入目标同目录的临时文件，由 emit_formats 统一替换或放弃。"""
+
+    supported = (SUFFIX, FULL, KEYWORD, REGEXP, CIDR)
+    binary = False
+
+    def __init__(self, path: Path, header: List[str]):
+        self.path = path
+        self.skipped = 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        descriptor, temporary_name = tempfile.mkstemp(
+            dir=path.parent,
+            prefix=f".{path.name}.",
+            text=True
+        )
+        self.temporary_path = Path(temporary_name)
+        mode = path.stat().st_mode & 0o777 if path.exists() else 0o644
+        os.fchmod(descriptor, mode)
+        if self.binary:
+            self.file = os.fdopen(descriptor, "wb")
+        else:
+            self.file = os.fdopen(descriptor, "w", encoding="utf-8")
+        self.begin(header)
+
+    def add(self, kind: str, value: str) -> None:
+        if kind not in self.supported:
+            self.skipped += 1
+            return
+        self.write(kind, value)
+
+    def begin(self, header: List[str]) -> None:
+        pass
+
+    @abstractmethod
+    def write(self, kind: str, value: str) -> None:
+        """写出一条 supported 中类型的规则。"""
+
+    def end(self) -> None:
+        pass
+
+    def abort(self) -> None:
+        self.file.close()
+        self.temporary_path.unlink(missing_ok=True)
+
+
+class SurgeEmitter(Emitter):
+    """域名规则输出 domain-set 写法，CIDR 输出 IP-CIDR 规则。"""
+
+    supported = (SUFFIX, FULL, CIDR)
+
+    def begin(self, header: List[str]) -> None:
+        for line in header:
+            self.file.write(f"# {line}\n")
+        if header:
+            self.file.write("\n")
+
+    def write(self, kind: str, value: str) -> None:
+        if kind == SUFFIX:
+            self.file.write(f".{value}\n")
+        elif kind == FULL:
+            self.file.write(f"{value}\n")
+        elif ':' in value:
+            self.file.write(f"IP-CIDR6,{value},no-resolve\n")
+        else:
+            self.file.write(f"IP-CIDR,{value},no-resolve\n")
+
+
+class ClashEmitter(Emitter):
+    """domain / ipcidr 行为的 payload 列表，缩进与仓库现有 yaml 一致。"""
+
+    supported = (SUFFIX, FULL, CIDR)
+
+    def begin(self, header: List[str]) -> None:
+        self.file.write("payload:\n")
+        for line in header:
+            self.file.write(f" # {line}\n")
+
+    def write(self, kind: str, value: str) -> None:
+        value = value.replace("'", "''")
+        if kind == SUFFIX:
+            self.file.write(f" - '+.{value}'\n")
+        else:
+            self.file.write(f" - '{value}'\n")
+
+
+class MosdnsEmitter(Emitter):
+    def begin(self, header: List[str]) -> None:
+        for line in header:
+            self.file.write(f"# {line}\n")
+
+    def write(self, kind: str, value: str) -> None:
+        self.file.write(f"{MOSDNS_PREFIXES[kind]}{value}\n")
+
+
+class SingboxEmitter(Emitter):
+    """sing-box 源规则集（version 3），JSON 需按字段分组，规则先按类型暂存。"""
+
+    FIELDS = {
+        FULL: "domain",
+        SUFFIX: "domain_suffix",
+        KEYWORD: "domain_keyword",
+        REGEXP: "domain_regex",
+        CIDR: "ip_cidr",
+    }
+
+    def begin(self, header: List[str]) -> None:
+        self.groups: Dict[str, List[str]] = {field: [] for field in self.FIELDS.values()}
+
+    def write(self, kind: str, value: str) -> None:
+        self.groups[self.FIELDS[kind]].append(value)
+
+    def end(self) -> None:
+        rule = {field: values for field, values in self.groups.items() if values}
+        json.dump({"version": 3, "rules": [rule]}, self.file, ensure_ascii=False, indent=2)
+        self.file.write("\n")
+
+
+class NftEmitter(Emitter):
+    """以产物文件名为表名，IPv4/IPv6 各一个 interval 集合，可被 ip_nft 来源格式读回。"""
+
+    supported = (CIDR,)
+
+    def begin(self, header: List[str]) -> None:
+        self.header = header
+        self.networks: Dict[int, List[str]] = {4: [], 6: []}
+
+    def write(self, kind: str, value: str) -> None:
+        self.networks[6 if ':' in value else 4].append(value)
+
+    def end(self) -> None:
+        table = self.path.stem.replace('-', '_').replace('.', '_')
+        lines = ["#!/usr/sbin/nft -f", ""]
+        if self.header:
+            lines.extend(f"# {line}" for line in self.header)
+            lines.append("")
+        lines.extend([
+            f"table inet {table}",
+            f"delete table inet {table}",
+            "",
+            f"table inet {table} {{",
+        ])
+        sets = [(version, networks) for version, networks in self.networks.items() if networks]
+        for position, (version, networks) in enumerate(sets):
+            lines.extend([
+                f"    set {table}_ipv{version} {{",
+                f"        type ipv{version}_addr",
+                "        flags interval",
+                "        elements = {",
+            ])
+            lines.extend(
+                f"            {network}{',' if index < len(networks) - 1 else ''}"
+                for index, network in enumerate(networks)
+            )
+            lines.extend(["        }", "    }"])
+            if position < len(sets) - 1:
+                lines.append("")
+        lines.append("}")
+        self.file.write("\n".join(lines) + "\n")
+
+
+class BinaryEmitter(Emitter):
+    """rule_binary 二进制规则集，编码后解码比对，确保与文本产物等价。"""
+
+    binary = True
+
+    def begin(self, header: List[str]) -> None:
+        self.groups: Dict[str, List[str]] = {kind: [] for kind in MOSDNS_PREFIXES}
+
+    def write(self, kind: str, value: str) -> None:
+        self.groups[kind].append(value)
+
+    def end(self) -> None:
+        data = encode_rule_set(
+            self.groups[SUFFIX],
+            self.groups[FULL],
+            self.groups[KEYWORD],
+            self.groups[REGEXP],
+            self.groups[CIDR]
+        )
+        verify_round_trip(data, (
+            f"{MOSDNS_PREFIXES[kind]}{value}"
+            for kind, values in self.groups.items()
+            for value in values
+        ))
+        self.file.write(data)
+
+
+EMITTERS = {
+    "surge": SurgeEmitter,
+    "clash": ClashEmitter,
+    "singbox": SingboxEmitter,
+    "mosdns": MosdnsEmitter,
+    "nft": NftEmitter,
+    "binary": BinaryEmitter,
+}
+
+
+def validate_outputs(outputs, label: str) -> List[str]:
+    """校验规则的 outputs 配置（格式 -> 产物路径），返回全部产物路径。"""
+    if not isinstance(outputs, dict):
+        raise ValueError(f"规则 {label} 的 outputs 必须是对象")
+    for output_format, path in outputs.items():
+        if output_format not in EMITTERS:
+            raise ValueError(f"规则 {label} 使用了未知输出格式: {output_format}")
+        if not isinstance(path, str) or not path:
+            raise ValueError(f"规则 {label} 的 {output_format} 输出路径无效")
+    return list(outputs.values())
+
+
+def emit_formats(
+    rules: Iterable[str],
+    classify: Callable[[str], Tuple[str, str]],
+    targets: Dict[str, Path],
+    header: Sequence[str] = ()
+) -> Dict[str, int]:
+    """
+    一次遍历规则，同时写出 targets 中的全部格式
+    返回各格式因不支持而跳过的规则条数。
+    """
+    emitters: Dict[str, Emitter] = {}
+    try:
+        for output_format, path in targets.items():
+            emitters[output_format] = EMITTERS[output_format](path, list(header))
+        for rule in rules:
+            kind, value = classify(rule)
+            for emitter in emitters.values():
+                emitter.add(kind, value)
+        for emitter in emitters.values():
+            emitter.end()
+            emitter.file.close()
+    except BaseException:
+        for emitter in emitters.values():
+            emitter.abort()
+        raise
+    for emitter in emitters.values():
+        os.replace(emitter.temporary_path, emitter.path)
+    return {output_format: emitter.skipped for output_format, emitter in emitters.items()}
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+规则集查询
+1. 读取 RuleSet 下的 Surge 列表、MosDNS 文本、Clash payload、sing-box JSON 与 nftables 集合，
+   规则统一归类为后缀、完整域名、关键字、正则或CIDR，并记录所在产物与原始写法
+2. 域名按后缀建索引，查询时逐级取父域名查表，例如 domain:qq.com 覆盖 a.b.qq.com
+3. CIDR 切分为互不重叠的区间段，每段记录覆盖它的全部网段，查询只需一次二分
+4. 索引可缓存到磁盘，各文件路径、大小与修改时间及查询代码均未变时直接载入
+5. 命令行可直接给出查询，或从标准输入逐行批量查询
+"""
+
+import argparse
+import heapq
+import json
+import os
+import pickle
+import re
+import sys
+import time
+from bisect import bisect_right
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from build_manifest import code_digest
+from fetch_cache import write_bytes_atomic
+from ip_intervals import WIDTHS, parse_network
+from rule_emitters import CIDR, FULL, KEYWORD, REGEXP, SUFFIX, classify_mosdns_rule, classify_surge_rule
+from rule_source import read_rule_lines
+
+CACHE_CODE_PATHS = (
+    Path(__file__),
+    Path(__file__).with_name("rule_emitters.py"),
+    Path(__file__).with_name("ip_intervals.py"),
+)
+COMMENT_PREFIXES = ('#', '!', ';', '//')
+SURGE_TYPES = {
+    "DOMAIN": FULL,
+    "DOMAIN-SUFFIX": SUFFIX,
+    "DOMAIN-KEYWORD": KEYWORD,
+    "IP-CIDR": CIDR,
+    "IP-CIDR6": CIDR,
+}
+SINGBOX_FIELDS = {
+    "domain": FULL,
+    "domain_suffix": SUFFIX,
+    "domain_keyword": KEYWORD,
+    "domain_regex": REGEXP,
+    "ip_cidr": CIDR,
+}
+
+Entry = Tuple[str, str, str]
+
+
+@dataclass(frozen=True)
+class Match:
+    path: str
+    rule: str
+
+
+def parse_surge_rule(line: str) -> Optional[Tuple[str, str]]:
+    """Surge 规则列表行或 domain-set 行，其他规则类型（进程名、UA 等）忽略。"""
+    if ',' not in line:
+        return classify_surge_rule(line)
+    rule_type, _, rest = line.partition(',')
+    kind = SURGE_TYPES.get(rule_type.strip().upper())
+    if kind is None:
+        return None
+    return kind, rest.split(',', 1)[0].strip()
+
+
+def parse_clash_rule(line: str) -> Optional[Tuple[str, str]]:
+    """Clash payload 条目: '+.example.com' 为后缀，含逗号的按 classical 写法解析。"""
+    if not line.startswith('-'):
+        return None
+    value = line[1:].strip().strip("'\"")
+    if ',' in value:
+        return parse_surge_rule(value)
+    if value.startswith('+.'):
+        return SUFFIX, value[2:]
+    if '/' in value:
+        return CIDR, value
+    return classify_surge_rule(value)
+
+
+def read_line_entries(path: Path, parse) -> Iterator[Entry]:
+    for line in read_rule_lines(path, comment=None):
+        if line.startswith(COMMENT_PREFIXES):
+            continue
+        parsed = parse(line)
+        if parsed is not None:
+            yield parsed[0], parsed[1], line
+
+
+def read_singbox_entries(path: Path) -> Iterator[Entry]:
+    document = json.loads(path.read_text(encoding="utf-8"))
+    for rule in document.get("rules", []):
+        for field, kind in SINGBOX_FIELDS.items():
+            values = rule.get(field, [])
+            for value in [values] if isinstance(values, str) else values:
+                if kind == SUFFIX:
+                    value = value.lstrip('.')
+                yield kind, value, f"{field}: {value}"
+
+
+def read_nft_entries(path: Path) -> Iterator[Entry]:
+    """只读取 set 的 elements，与 ip_nft 来源格式的写法一致。"""
+    in_elements = False
+    for line in read_rule_lines(path, comment=None):
+        content = line.split('#', 1)[0].strip()
+        if not in_elements:
+            if 'elements' not in content or '{' not in content:
+                continue
+            in_elements = True
+            content = content.split('{', 1)[1]
+        if '}' in content:
+            content = content.split('}', 1)[0]
+            in_elements = False
+        for token in content.split(','):
+            token = token.strip()
+            if token:
+                yield CIDR, token, token
+
+
+READERS = {
+    ".list": lambda path: read_line_entries(path, parse_surge_rule),
+    ".txt": lambda path: read_line_entries(path, classify_mosdns_rule),
+    ".yaml": lambda path: read_line_entries(path, parse_clash_rule),
+    ".json": read_singbox_entries,
+    ".nft": read_nft_entries,
+}
+
+
+def network_range(value: str) -> Tuple[int, int, int]:
+    """返回 (版本, 起始地址, 结束地址)，无效时抛出 ValueError。"""
+    version, start, prefixlen = parse_network(value)
+    return version, start, start + (1 << (WIDTHS[version] - prefixlen)) - 1
+
+
+class RuleIndex:
+    """
+    全部产物的查询索引，规则按编号保存原始写法与所在产物
+    后缀与完整域名索引的值为单个规则编号，同一域名出现在多处时为编号列表。
+    """
+
+    def __init__(self):
+        self.paths: List[str] = []
+        self.rules: List[str] = []
+        self.owners: List[int] = []
+        self.suffixes: Dict[str, object] = {}
+        self.fulls: Dict[str, object] = {}
+        self.keywords: List[Tuple[str, int]] = []
+        self.regexps: List[Tuple[str, int]] = []
+        # 版本 -> (区间段起点, 各段覆盖的规则编号)，规则编号 -> 网段结束地址
+        self.segments: Dict[int, Tuple[List[int], List[Tuple[int, ...]]]] = {}
+        self.network_ends: Dict[int, int] = {}
+        self._networks: Dict[int, List[Tuple[int, int, int]]] = {4: [], 6: []}
+        self._compiled: Optional[List[Tuple[re.Pattern, int]]] = None
+
+    def __getstate__(self):
+        state = {name: getattr(self, name) for name in vars(self)}
+        state["_compiled"] = None
+        return state
+
+    def __setstate__(self, state) -> None:
+        vars(self).update(state)
+
+    @classmethod
+    def build(cls, root: Path) -> "RuleIndex":
+        index = cls()
+        for path in rule_files(root):
+            index.add_file(path.relative_to(root.parent).as_posix(), READERS[path.suffix](path))
+        index.finish()
+        return index
+
+    def add_file(self, relative_path: str, entries: Iterable[Entry]) -> None:
+        owner = len(self.paths)
+        self.paths.append(relative_path)
+        for kind, value, text in entries:
+            if kind == CIDR:
+                try:
+                    version, start, end = network_range(value)
+                except ValueError:
+                    continue
+            rule_id = len(self.rules)
+            self.rules.append(text)
+            self.owners.append(owner)
+            if kind == CIDR:
+                self._networks[version].append((start, end, rule_id))
+                self.network_ends[rule_id] = end
+            elif kind == KEYWORD:
+                self.keywords.append((value.lower(), rule_id))
+            elif kind == REGEXP:
+                self.regexps.append((value, rule_id))
+            else:
+                table = self.suffixes if kind == SUFFIX else self.fulls
+                domain = value.lower().rstrip('.')
+                existing = table.get(domain)
+                if existing is None:
+                    table[domain] = rule_id
+                elif isinstance(existing, list):
+                    existing.append(rule_id)
+                else:
+                    table[domain] = [existing, rule_id]
+
+    def finish(self) -> None:
+        """把网段切分为互不重叠的区间段，每段记录覆盖它的规则编号。"""
+        for version, networks in self._networks.items():
+            networks.sort()
+            boundaries = sorted({start for start, _, _ in networks} | {end + 1 for _, end, _ in networks})
+            starts: List[int] = []
+            covering: List[Tuple[int, ...]] = []
+            active: Dict[int, None] = {}
+            ending: List[Tuple[int, int]] = []
+            position = 0
+            for boundary in boundaries:
+                while ending and ending[0][0] <= boundary:
+                    del active[heapq.heappop(ending)[1]]
+                while position < len(networks) and networks[position][0] == boundary:
+                    _, end, rule_id = networks[position]
+                    active[rule_id] = None
+                    heapq.heappush(ending, (end + 1, rule_id))
+                    position += 1
+                starts.append(boundary)
+                covering.append(tuple(active))
+            self.segments[version] = (starts, covering)
+        self._networks = {4: [], 6: []}
+
+    def _rule_ids(self, table: Dict[str, object], domain: str) -> List[int]:
+        found = table.get(domain)
+        if found is None:
+            return []
+        # 表中的列表由索引持有，返回副本供调用方追加与排序
+        return list(found) if isinstance(found, list) else [found]
+
+    def lookup_domain(self, domain: str) -> List[int]:
+        domain = domain.lower().rstrip('.')
+        found = self._rule_ids(self.fulls, domain)
+        labels = domain.split('.')
+        for position in range(len(labels)):
+            found.extend(self._rule_ids(self.suffixes, '.'.join(labels[position:])))
+        found.extend(rule_id for keyword, rule_id in self.keywords if keyword in domain)
+        found.extend(rule_id for pattern, rule_id in self._compiled_regexps() if pattern.search(domain))
+        return found
+
+    def first_domain(self, domain: str) -> Optional[int]:
+        """lookup_domain 结果的首条，命中完整域名或后缀后不再检查关键字与正则，只读不复制索引中的列表。"""
+        domain = domain.lower().rstrip('.')
+        found = self.fulls.get(domain)
+        if found is None:
+            labels = domain.split('.')
+            for position in range(len(labels)):
+                found = self.suffixes.get('.'.join(labels[position:]))
+                if found is not None:
+                    break
+        if found is not None:
+            return found[0] if isinstance(found, list) else found
+        for keyword, rule_id in self.keywords:
+            if keyword in domain:
+                return rule_id
+        for pattern, rule_id in self._compiled_regexps():
+            if pattern.search(domain):
+                return rule_id
+        return None
+
+    def _compiled_regexps(self) -> List[Tuple[re.Pattern, int]]:
+        """正则在首次查询时编译，无法编译的规则跳过。"""
+        if self._compiled is None:
+            self._compiled = []
+            for pattern, rule_id in self.regexps:
+                try:
+                    self._compiled.append((re.compile(pattern), rule_id))
+                except re.error:
+                    continue
+        return self._compiled
+
+    def lookup_network(self, version: int, start: int, end: int) -> List[int]:
+        """返回完整包含 [start, end] 的网段，查询单个地址时 start 与 end 相同。"""
+        starts, covering = self.segments.get(version, ([], []))
+        position = bisect_right(starts, start) - 1
+        if position < 0:
+            return []
+        return [rule_id for rule_id in covering[position] if self.network_ends[rule_id] >= end]
+
+    def lookup(self, query: str) -> List[Match]:
+        """查询域名、IP 或 CIDR，按产物顺序返回命中的规则，同一产物内越具体的越靠前。"""
+        query = query.strip()
+        rule_ids = None
+        if query[:1].isdigit() or ':' in query:
+            try:
+                version, start, end = network_range(query)
+            except ValueError:
+                pass
+            else:
+                rule_ids = self.lookup_network(version, start, end)
+                rule_ids.sort(key=lambda rule_id: start - self.network_ends[rule_id])
+        if rule_ids is None:
+            rule_ids = self.lookup_domain(query)
+        rule_ids.sort(key=self.owners.__getitem__)
+        return [Match(self.paths[self.owners[rule_id]], self.rules[rule_id]) for rule_id in rule_ids]
+
+    def summary(self) -> str:
+        return f"{len(self.paths)} 个产物, {len(self.rules)} 条规则"
+
+
+def rule_files(root: Path) -> List[Path]:
+    return sorted(path for path in root.rglob("*") if path.suffix in READERS and path.is_file())
+
+
+def index_signature(root: Path) -> List:
+    signature = [code_digest(CACHE_CODE_PATHS)]
+    for path in rule_files(root):
+        stat = path.stat()
+        signature.append((path.relative_to(root).as_posix(), stat.st_size, stat.st_mtime_ns))
+    return signature
+
+
+def load_index(root: Path, cache_path: Optional[Path] = None) -> Tuple[RuleIndex, bool]:
+    """返回 (索引, 是否来自缓存)，缓存缺失、损坏或过期时重建并写回。"""
+    if cache_path is None:
+        return RuleIndex.build(root), False
+    signature = index_signature(root)
+    try:
+        cached = pickle.loads(cache_path.read_bytes())
+        if cached["signature"] == signature:
+            return cached["index"], True
+    except (OSError, EOFError, KeyError, TypeError, ValueError, pickle.PickleError):
+        pass
+    index = RuleIndex.build(root)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    write_bytes_atomic(
+        cache_path,
+        pickle.dumps({"signature": signature, "index": index}, protocol=pickle.HIGHEST_PROTOCOL)
+    )
+    return index, False
+
+
+def read_queries(queries: List[str]) -> Iterator[str]:
+    if queries:
+        yield from queries
+        return
+    for line in sys.stdin:
+        query = line.strip()
+        if query and not query.startswith('#'):
+            yield query
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="查询域名或IP命中的规则集与规则")
+    parser.add_argument("queries", nargs="*", help="域名、IP 或 CIDR，未给出时从标准输入逐行读取")
+    parser.add_argument("--root", default="", help="规则集目录，默认工作区下的 RuleSet")
+    parser.add_argument("--cache", default="", help="索引缓存文件，默认不缓存")
+    parser.add_argument("--json", action="store_true", help="每条查询输出一行JSON")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    workspace = Path(os.environ.get("GITHUB_WORKSPACE", Path.cwd())).resolve()
+    root = Path(args.root).resolve() if args.root else workspace / "RuleSet"
+    try:
+        if not root.is_dir():
+            raise ValueError(f"规则集目录不存在: {root}")
+        started = time.perf_counter()
+        index, cached = load_index(root, Path(args.cache) if args.cache else None)
+        print(
+            f"索引: {index.summary()}，{'读取缓存' if cached else '构建'}用时 {time.perf_counter() - started:.2f} 秒",
+            file=sys.stderr
+        )
+
+        started = time.perf_counter()
+        count = 0
+        for query in read_queries(args.queries):
+            matches = index.lookup(query)
+            count += 1
+            if args.json:
+                print(json.dumps(
+                    {"query": query, "matches": [{"path": match.path, "rule": match.rule} for match in matches]},
+                    ensure_ascii=False
+                ))
+            elif not matches:
+                print(f"{query}\t未命中")
+            else:
+                for match in matches:
+                    print(f"{query}\t{match.path}\t{match.rule}")
+        elapsed = time.perf_counter() - started
+        if count:
+            print(f"查询: {count} 条，用时 {elapsed:.3f} 秒，{count / max(elapsed, 1e-9):.0f} 条/秒", file=sys.stderr)
+    except (OSError, ValueError) as error:
+        print(f"错误: {error}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
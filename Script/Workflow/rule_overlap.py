@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+规则集重叠分析
+1. 读取 mosdns_config.json 与 proxy_config.json 中全部规则集的产物，按产物族（MosDNS、Surge）分别分析；
+   两族产物多由同一上游转换而来，跨族比较只会得到无意义的镜像重叠
+   同族规则集的域名规则汇总到一张共享后缀表，每个域名记录哪些规则集以泛域名或精确域名收录了它
+2. 每条规则沿父域名查表一次，得到覆盖它的全部规则集，累计为两两重叠矩阵，
+   并区分同名重复、同名泛域名覆盖精确域名与父域名泛域名覆盖三种遮蔽关系
+3. 结果以JSON输出，并写入 GitHub 步骤摘要，用于发现未配置 exclude 的大面积重复
+"""
+
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import mosdns_rules
+import proxy_rules
+from rule_emitters import FULL, SUFFIX, classify_mosdns_rule, classify_surge_rule
+from rule_source import read_rule_lines
+
+REPORT_VERSION = 2
+DEFAULT_EXAMPLES = 5
+DUPLICATE = "duplicate"
+WILDCARD_COVERS_EXACT = "wildcard_covers_exact"
+PARENT_WILDCARD = "parent_wildcard"
+SHADOW_TYPES = (DUPLICATE, WILDCARD_COVERS_EXACT, PARENT_WILDCARD)
+
+
+def configured_rulesets(workspace: Path) -> Dict[str, List[Tuple[str, Path, Callable]]]:
+    """按产物族返回 (产物相对路径, 产物路径, 规则分类函数)，顺序与配置一致。"""
+    return {
+        "mosdns": [
+            (rule["path"], workspace / rule["path"], classify_mosdns_rule)
+            for rule in mosdns_rules.load_config(workspace)
+        ],
+        "surge": [
+            (rule["path"], workspace / rule["path"], classify_surge_rule)
+            for rule in proxy_rules.load_config(workspace)
+        ],
+    }
+
+
+class OverlapIndex:
+    """
+    同族规则集共享的后缀表，值为收录该域名的规则集位掩码
+    每个规则集的规则保存为 (域名, 是否泛域名) 列表，统计时逐条查询覆盖它的规则集。
+    """
+
+    def __init__(self, names: List[str]):
+        self.names = names
+        self.wildcards: Dict[str, int] = {}
+        self.exacts: Dict[str, int] = {}
+        self.rules: List[List[Tuple[str, bool]]] = [[] for _ in names]
+        self.skipped = [0] * len(names)
+
+    def add(self, position: int, kind: str, domain: str) -> None:
+        bit = 1 << position
+        wildcard = kind == SUFFIX
+        table = self.wildcards if wildcard else self.exacts
+        if table.get(domain, 0) & bit:
+            return
+        table[domain] = table.get(domain, 0) | bit
+        self.rules[position].append((domain, wildcard))
+
+    def parent_wildcards(self, domain: str) -> int:
+        """严格父域名上的泛域名掩码。"""
+        wildcards = self.wildcards
+        mask = 0
+        position = domain.find('.')
+        while position >= 0:
+            mask |= wildcards.get(domain[position + 1:], 0)
+            position = domain.find('.', position + 1)
+        return mask
+
+    def analyze(self, examples: int = DEFAULT_EXAMPLES) -> Dict:
+        count = len(self.names)
+        matrix = [[0] * count for _ in range(count)]
+        shadows = {}
+        covered_by_any = [0] * count
+        for position, rules in enumerate(self.rules):
+            own = ~(1 << position)
+            for domain, wildcard in rules:
+                parents = self.parent_wildcards(domain)
+                same_wildcard = self.wildcards.get(domain, 0)
+                if wildcard:
+                    duplicates = same_wildcard
+                    covers_exact = 0
+                else:
+                    duplicates = self.exacts.get(domain, 0)
+                    covers_exact = same_wildcard
+                covering = (parents | duplicates | covers_exact) & own
+                if not covering:
+                    continue
+                covered_by_any[position] += 1
+                while covering:
+                    lowest = covering & -covering
+                    covering ^= lowest
+                    other = lowest.bit_length() - 1
+                    matrix[position][other] += 1
+                    # 同一条规则可能同时满足多种关系，按 重复 > 同名覆盖 > 父域名覆盖 归类
+                    if duplicates & lowest:
+                        shadow_type = DUPLICATE
+                    elif covers_exact & lowest:
+                        shadow_type = WILDCARD_COVERS_EXACT
+                    else:
+                        shadow_type = PARENT_WILDCARD
+                    pair = shadows.setdefault((position, other), {
+                        "counts": dict.fromkeys(SHADOW_TYPES, 0),
+                        "examples": [],
+                    })
+                    pair["counts"][shadow_type] += 1
+                    if len(pair["examples"]) < examples:
+                        pair["examples"].append(f"{'+.' if wildcard else ''}{domain} ({shadow_type})")
+
+        rulesets = []
+        for position, name in enumerate(self.names):
+            total = len(self.rules[position])
+            rulesets.append({
+                "path": name,
+                "domain_rules": total,
+                "other_rules": self.skipped[position],
+                "covered_by_other": covered_by_any[position],
+                "covered_ratio": round(covered_by_any[position] / total, 6) if total else 0.0,
+            })
+        pairs = [
+            {
+                "ruleset": self.names[position],
+                "covered_by": self.names[other],
+                "rules": matrix[position][other],
+                "ratio": round(matrix[position][other] / len(self.rules[position]), 6),
+                **shadows[(position, other)],
+            }
+            for position, other in sorted(shadows, key=lambda pair: -matrix[pair[0]][pair[1]])
+        ]
+        return {
+            "rulesets": rulesets,
+            "matrix": matrix,
+            "pairs": pairs,
+        }
+
+
+def build_index(rulesets: List[Tuple[str, Path, Callable]]) -> OverlapIndex:
+    index = OverlapIndex([name for name, _, _ in rulesets])
+    for position, (name, path, classify) in enumerate(rulesets):
+        if not path.is_file():
+            print(f"警告: 产物不存在，按空规则集处理: {name}", file=sys.stderr)
+            continue
+        for line in read_rule_lines(path):
+            kind, value = classify(line)
+            if kind == SUFFIX or kind == FULL:
+                index.add(position, kind, value.lower())
+            else:
+                index.skipped[position] += 1
+    return index
+
+
+def analyze_families(
+    families: Dict[str, List[Tuple[str, Path, Callable]]],
+    examples: int = DEFAULT_EXAMPLES
+) -> Dict:
+    """各产物族单独建表分析，只比较同族规则集。"""
+    return {
+        "version": REPORT_VERSION,
+        "families": {
+            family: build_index(rulesets).analyze(examples)
+            for family, rulesets in families.items()
+        },
+    }
+
+
+def render_family(family: str, report: Dict, limit: int) -> List[str]:
+    """单个产物族: 各规则集被覆盖的比例，以及重叠最多的规则集对。"""
+    lines = [
+        f"#### {family}",
+        "",
+        "| 规则集 | 域名规则 | 被其他规则集覆盖 | 比例 |",
+        "|---|---|---|---|",
+    ]
+    for item in report["rulesets"]:
+        lines.append(
+            f"| {item['path']} | {item['domain_rules']} | {item['covered_by_other']} | "
+            f"{item['covered_ratio']:.2%} |"
+        )
+    if report["pairs"]:
+        lines.extend([
+            "",
+            "| 规则集 | 被覆盖于 | 规则 | 比例 | 重复 | 同名泛域名覆盖 | 父域名覆盖 |",
+            "|---|---|---|---|---|---|---|",
+        ])
+        for pair in report["pairs"][:limit]:
+            counts = pair["counts"]
+            lines.append(
+                f"| {pair['ruleset']} | {pair['covered_by']} | {pair['rules']} | {pair['ratio']:.2%} | "
+                f"{counts[DUPLICATE]} | {counts[WILDCARD_COVERS_EXACT]} | {counts[PARENT_WILDCARD]} |"
+            )
+    return lines
+
+
+def render_summary(report: Dict, limit: int) -> str:
+    """步骤摘要，按产物族分节。"""
+    lines = ["### 规则集重叠分析"]
+    for family, family_report in report["families"].items():
+        lines.append("")
+        lines.extend(render_family(family, family_report, limit))
+    return "\n".join(lines) + "\n"
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="分析同族已配置规则集之间的重叠与遮蔽")
+    parser.add_argument("--output", default="", help="JSON报告路径，默认输出到标准输出")
+    parser.add_argument("--examples", type=int, default=DEFAULT_EXAMPLES, help="每对规则集保留的示例规则条数")
+    parser.add_argument("--summary-pairs", type=int, default=20, help="步骤摘要中列出的规则集对数量")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    workspace = Path(os.environ.get("GITHUB_WORKSPACE", Path.cwd())).resolve()
+    try:
+        report = analyze_families(configured_rulesets(workspace), max(args.examples, 0))
+        payload = json.dumps(report, ensure_ascii=False, indent=2) + "\n"
+        if args.output:
+            Path(args.output).write_text(payload, encoding="utf-8")
+        else:
+            sys.stdout.write(payload)
+        summary_path = os.environ.get("GITHUB_STEP_SUMMARY")
+        if summary_path:
+            with open(summary_path, "a", encoding="utf-8") as file_handle:
+                file_handle.write(render_summary(report, args.summary_pairs))
+    except (OSError, ValueError) as error:
+        print(f"错误: {error}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
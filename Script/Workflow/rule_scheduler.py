@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+规则集依赖调度
+1. 由产物路径引用关系构建依赖图并检测环
+2. 依赖全部完成的规则集立即提交到进程池，互不依赖的规则集并行构建
+3. 主进程负责复用判断与结果收集，同一批完成的任务按配置顺序处理
+4. 规则集的输入（来源转换、排除索引）按 (输入, 规则集) 拆为独立节点，只依赖所属规则集的依赖项，
+   同一输入的节点按规则集拓扑序串联，被多个规则集共用时只执行一次，也不会因共用输入形成环
+"""
+
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+Job = Tuple[Callable, tuple]
+
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def dependency_graph(
+    nodes: Iterable[str],
+    dependencies: Callable[[str], Iterable[str]]
+) -> Dict[str, List[str]]:
+    """按节点顺序构建依赖图，只保留图内节点之间的依赖。"""
+    ordered = list(nodes)
+    known = set(ordered)
+    graph = {}
+    for node in ordered:
+        graph[node] = [
+            dependency
+            for dependency in dict.fromkeys(dependencies(node))
+            if dependency in known
+        ]
+    return graph
+
+
+def find_cycle(graph: Dict[str, List[str]], nodes: Iterable[str]) -> List[str]:
+    """在剩余节点中找出一条依赖环，用于错误提示。"""
+    remaining = set(nodes)
+    start = next(node for node in graph if node in remaining)
+    path = [start]
+    seen = {start: 0}
+    node = start
+    while True:
+        node = next(dependency for dependency in graph[node] if dependency in remaining)
+        if node in seen:
+            return path[seen[node]:] + [node]
+        seen[node] = len(path)
+        path.append(node)
+
+
+def topological_order(graph: Dict[str, List[str]]) -> List[str]:
+    """返回稳定的拓扑序（同层按图中顺序），存在环时失败。"""
+    position = {node: index for index, node in enumerate(graph)}
+    waiting = {node: len(dependencies) for node, dependencies in graph.items()}
+    dependents: Dict[str, List[str]] = {node: [] for node in graph}
+    for node, dependencies in graph.items():
+        for dependency in dependencies:
+            dependents[dependency].append(node)
+
+    ready = [node for node in graph if not waiting[node]]
+    order = []
+    while ready:
+        ready.sort(key=position.__getitem__)
+        node = ready.pop(0)
+        order.append(node)
+        for dependent in dependents[node]:
+            waiting[dependent] -= 1
+            if not waiting[dependent]:
+                ready.append(dependent)
+
+    if len(order) != len(graph):
+        cycle = find_cycle(graph, set(graph) - set(order))
+        raise ValueError(f"规则依赖存在环: {' -> '.join(cycle)}")
+    return order
+
+
+def input_graph(
+    rule_dependencies: Dict[str, List[str]],
+    rule_inputs: Dict[str, List[str]]
+) -> Tuple[Dict[str, List[str]], Dict[str, Tuple[str, str]], Dict[str, List[str]]]:
+    """
+    由规则集之间的依赖与各规则集的输入构建调度图
+    rule_dependencies 为规则集依赖的其他规则集（按配置顺序），rule_inputs 为各规则集去重后的输入节点名；
+    返回: (依赖图, 任务节点 -> (输入, 规则集), 输入 -> 按拓扑序排列的使用者)
+    任务节点执行时所属规则集的依赖已完成，可判断其是否复用；前一个使用者已执行的输入直接沿用。
+    规则集之间存在环时失败。
+    """
+    rank = {path: index for index, path in enumerate(topological_order(rule_dependencies))}
+    consumers: Dict[str, List[str]] = {}
+    for path in sorted(rule_dependencies, key=rank.__getitem__):
+        for input_node in rule_inputs[path]:
+            consumers.setdefault(input_node, []).append(path)
+
+    tasks: Dict[str, Tuple[str, str]] = {}
+    graph: Dict[str, List[str]] = {}
+    for path, dependencies in rule_dependencies.items():
+        task_nodes = []
+        for input_node in rule_inputs[path]:
+            node = f"{input_node}@{path}"
+            tasks[node] = (input_node, path)
+            users = consumers[input_node]
+            position = users.index(path)
+            previous = [f"{input_node}@{users[position - 1]}"] if position else []
+            graph[node] = list(dependencies) + previous
+            task_nodes.append(node)
+        graph[path] = task_nodes + list(dependencies)
+    return graph, tasks, consumers
+
+
+def run_graph(
+    graph: Dict[str, List[str]],
+    prepare: Callable[[str], Optional[Job]],
+    finish: Callable[[str, object], None],
+    max_workers: int
+) -> None:
+    """
+    按依赖图调度任务:
+    prepare(node) 在依赖完成后于主进程调用，返回 None 表示已就地完成，
+    否则返回 (函数, 参数) 提交到进程池；finish(node, 结果) 在主进程收集结果。
+    max_workers 不大于 1 时按拓扑序串行执行，不创建进程池。
+    """
+    order = topological_order(graph)
+    if max_workers <= 1 or len(graph) <= 1:
+        for node in order:
+            job = prepare(node)
+            if job is not None:
+                function, arguments = job
+                finish(node, function(*arguments))
+        return
+
+    position = {node: index for index, node in enumerate(order)}
+    waiting = {node: len(dependencies) for node, dependencies in graph.items()}
+    dependents: Dict[str, List[str]] = {node: [] for node in graph}
+    for node, dependencies in graph.items():
+        for dependency in dependencies:
+            dependents[dependency].append(node)
+
+    ready = deque(node for node in order if not waiting[node])
+    running: Dict[Future, str] = {}
+
+    def complete(node: str) -> None:
+        for dependent in dependents[node]:
+            waiting[dependent] -= 1
+            if not waiting[dependent]:
+                ready.append(dependent)
+
+    executor = ProcessPoolExecutor(max_workers=min(max_workers, len(graph)))
+    try:
+        while ready or running:
+            while ready:
+                node = ready.popleft()
+                job = prepare(node)
+                if job is None:
+                    complete(node)
+                    continue
+                function, arguments = job
+                running[executor.submit(function, *arguments)] = node
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in sorted(done, key=lambda item: position[running[item]]):
+                node = running.pop(future)
+                finish(node, future.result())
+                complete(node)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
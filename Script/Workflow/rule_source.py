@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+规则来源流式读写
+1. 下载响应分块落盘，同时计算内容哈希与字节数
+2. 来源文件分块读取并增量UTF-8解码，逐行产出文本，不生成整文件字符串
+3. 磁盘上的来源与产物经 mmap 映射，按窗口直接从映射页解码，不经过额外的读缓冲拷贝
+4. 也可按整行对齐的原始字节块读取，供直接处理字节的批量解析器使用
+"""
+
+import codecs
+import hashlib
+import mmap
+import os
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, Optional, Tuple
+
+CHUNK_SIZE = 1 << 20
+# str.splitlines 认可的全部换行符，keepends 切分后每行末尾恰有一个换行
+LINE_BREAKS = "\r\n\x0b\x0c\x1c\x1d\x1e\x85  "
+
+
+@dataclass(frozen=True)
+class SourceFile:
+    """已落盘的规则来源，可直接传给子进程。"""
+    location: str
+    path: Path
+    sha256: str
+    size: int
+    # 本次经网络传输的字节数（压缩后），缓存命中、304 与本地来源为 0
+    wire_bytes: int = 0
+
+
+def copy_stream(stream: BinaryIO, path: Path) -> Tuple[str, int]:
+    """将字节流分块写入临时文件后原子替换，返回 (sha256, 字节数)。"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    descriptor, temporary_name = tempfile.mkstemp(
+        dir=path.parent,
+        prefix=f".{path.name}."
+    )
+    temporary_path = Path(temporary_name)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(descriptor, "wb") as file_handle:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                file_handle.write(chunk)
+        os.replace(temporary_path, path)
+    finally:
+        temporary_path.unlink(missing_ok=True)
+    return digest.hexdigest(), size
+
+
+def iter_chunks(path: Path) -> Iterator[bytes]:
+    with open(path, "rb") as file_handle:
+        while True:
+            chunk = file_handle.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def file_digest(path: Path) -> Tuple[str, int]:
+    """分块计算文件 (sha256, 字节数)。"""
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter_chunks(path):
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def split_text_lines(pieces: Iterable[str]) -> Iterator[str]:
+    """
+    把依次解码出的文本片段切分为行，结果与整段文本 splitlines() 一致
+    每段末行（含其换行符）留到下一段再切分，避免 \\r\\n 跨段被拆成两行。
+    """
+    pending = ""
+    for piece in pieces:
+        lines = (pending + piece).splitlines(keepends=True)
+        pending = lines.pop() if lines else ""
+        for line in lines:
+            yield line.rstrip(LINE_BREAKS)
+    yield from pending.splitlines()
+
+
+def decode_chunks(chunks: Iterable[bytes]) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in chunks:
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+
+def iter_text_lines(chunks: Iterable[bytes]) -> Iterator[str]:
+    """增量UTF-8解码并逐行产出，切分结果与 bytes.decode().splitlines() 一致。"""
+    return split_text_lines(decode_chunks(chunks))
+
+
+def iter_mapped_text(path: Path) -> Iterator[str]:
+    """
+    mmap 映射文件，按 CHUNK_SIZE 窗口增量解码
+    窗口 memoryview 在产出文本前即释放，迭代中断时映射也能正常关闭。
+    """
+    with open(path, "rb") as file_handle:
+        if not os.fstat(file_handle.fileno()).st_size:
+            return
+        with mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            decoder = codecs.getincrementaldecoder("utf-8")()
+            for start in range(0, len(mapped), CHUNK_SIZE):
+                with memoryview(mapped)[start:start + CHUNK_SIZE] as window:
+                    text = decoder.decode(window)
+                yield text
+            yield decoder.decode(b"", final=True)
+
+
+def iter_mapped_blocks(path: Path) -> Iterator[bytes]:
+    """
+    mmap 映射文件，按约 CHUNK_SIZE 的窗口产出原始字节块
+    每块延伸到下一个换行符之后，行不会跨块，各块可独立解码与切分。
+    """
+    with open(path, "rb") as file_handle:
+        if not os.fstat(file_handle.fileno()).st_size:
+            return
+        with mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            start = 0
+            while start < len(mapped):
+                end = mapped.find(b"\n", start + CHUNK_SIZE)
+                end = len(mapped) if end < 0 else end + 1
+                yield mapped[start:end]
+                start = end
+
+
+def read_lines(source: SourceFile) -> Iterator[str]:
+    return split_text_lines(iter_mapped_text(source.path))
+
+
+def read_rule_lines(path: Path, comment: Optional[str] = "#") -> Iterator[str]:
+    """逐行读取产物中的规则，去除首尾空白并跳过空行，comment 非空时跳过以其开头的行。"""
+    for line in split_text_lines(iter_mapped_text(path)):
+        rule = line.strip()
+        if rule and not (comment and line.startswith(comment)):
+            yield rule
+
+
+def local_source(path: Path, location: str) -> SourceFile:
+    """登记工作区内的本地来源，不存在或为空时失败。"""
+    if not path.is_file():
+        raise FileNotFoundError(f"本地来源不存在: {location}")
+    sha256, size = file_digest(path)
+    if not size:
+        raise ValueError(f"本地来源为空: {location}")
+    return SourceFile(location, path, sha256, size)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+规则调度检查
+1. 在临时目录中用本地来源构造共用来源的规则配置，分别交给 mosdns_rules 与 proxy_rules 构建
+2. 覆盖曾导致依赖环的写法: 规则 A 读取来源 S，另一规则同样读取 S 并排除（或引用）A
+3. 串行与进程池各构建一次，检查两者结果一致且排除生效，失败时返回非零退出码
+"""
+
+import argparse
+import contextlib
+import io
+import sys
+import tempfile
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import mosdns_rules
+import proxy_rules
+from rule_source import local_source
+
+SOURCES = {
+    "shared.list": ".apple.com\n.example.com\nwww.example.org\n",
+    "extra.list": ".example.net\napple.com\n",
+    "blocklist.txt": "domain:ads.example.com\nfull:tracker.example.org\n",
+}
+
+
+def mosdns_cases() -> List[List[Dict]]:
+    return [
+        [
+            {"id": "apple", "path": "apple.txt", "sources": {"domain_surge": ["shared.list"]}},
+            {
+                "id": "foreign",
+                "path": "foreign.txt",
+                "sources": {"domain_surge": ["shared.list", "extra.list"]},
+                "exclude": ["apple.txt"],
+            },
+        ],
+        [
+            {"id": "reject", "path": "reject.txt", "sources": {"domain_mosdns": ["blocklist.txt"]}},
+            {
+                "id": "china",
+                "path": "china.txt",
+                "sources": {"domain_mosdns": ["blocklist.txt"], "domain_surge": ["extra.list"]},
+                "exclude": ["reject.txt"],
+            },
+        ],
+    ]
+
+
+def proxy_cases() -> List[List[Dict]]:
+    return [
+        [
+            {"name": "PRIVACY", "path": "Privacy.list", "sources": ["shared.list"]},
+            {"name": "REJECT", "path": "Reject.list", "sources": ["shared.list", "extra.list", "Privacy.list"]},
+        ],
+    ]
+
+
+def check_case(
+    label: str,
+    build: Callable,
+    rules: List[Dict],
+    directory: Path,
+    jobs: int
+) -> Tuple[List[str], Dict[str, List[str]]]:
+    """返回 (失败描述, 串行构建结果)，失败描述为空表示通过。"""
+    locations = {
+        location
+        for rule in rules
+        for location in (
+            rule["sources"] if isinstance(rule["sources"], list)
+            else [item for items in rule["sources"].values() for item in items]
+        )
+        if location in SOURCES
+    }
+    contents = {location: local_source(directory / location, location) for location in locations}
+    results = []
+    for workers in (1, jobs):
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                results.append(build(rules, contents, max_workers=workers))
+        except (OSError, ValueError) as error:
+            return [f"{label} (--jobs {workers}): {error}"], {}
+    failures = []
+    serial, parallel = results
+    if serial != parallel:
+        failures.append(f"{label}: 串行与并行构建结果不一致")
+    for rule in rules:
+        if not serial.get(rule["path"]):
+            failures.append(f"{label}: {rule['path']} 未生成规则")
+    return failures, serial
+
+
+def exclusion_failures(generated: Dict[str, List[str]], path: str, excluded: str) -> List[str]:
+    overlap = set(generated[path]) & set(generated[excluded])
+    return [f"{path} 仍包含被 {excluded} 排除的规则: {sorted(overlap)}"] if overlap else []
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="检查共用来源的规则配置能否正常调度构建")
+    parser.add_argument("--jobs", type=int, default=2, help="并行构建使用的进程数，默认 2")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    failures = []
+    with tempfile.TemporaryDirectory(prefix="schedule-check-") as directory:
+        root = Path(directory)
+        for name, content in SOURCES.items():
+            (root / name).write_text(content, encoding="utf-8")
+        for index, rules in enumerate(mosdns_cases(), start=1):
+            case_failures, generated = check_case(
+                f"mosdns#{index}", mosdns_rules.build_rulesets, rules, root, args.jobs
+            )
+            failures.extend(case_failures)
+            for rule in rules:
+                for exclude_path in rule.get("exclude", []):
+                    if generated and not case_failures:
+                        failures.extend(exclusion_failures(generated, rule["path"], exclude_path))
+        for index, rules in enumerate(proxy_cases(), start=1):
+            failures.extend(check_case(f"proxy#{index}", proxy_rules.build_rulesets, rules, root, args.jobs)[0])
+
+    for failure in failures:
+        print(f"错误: {failure}", file=sys.stderr)
+    if not failures:
+        print("调度检查通过")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())